@@ -0,0 +1,252 @@
+import datetime
+import os
+import queue
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from sqlalchemy import insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, CAPTCHA_Analytics, CAPTCHA_Attempt, CAPTCHA_Rollup, CAPTCHA_Traffic
+from rollups import ROLLUP_COLUMNS, add_to_rollups, rollup_rows
+from trajectory import encode
+
+# Analytics events queued by the request handlers
+CaptchaGenerated = namedtuple('CaptchaGenerated', ['session_id', 'captcha_id', 'presented_at'])
+AttemptCompleted = namedtuple('AttemptCompleted', ['session_id', 'captcha_id', 'success', 'trajectory', 'completed_at'])
+
+
+def utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class AnalyticsWriter:
+    """Queue analytics events in memory and write them in batched transactions from a background thread."""
+
+    def __init__(self, app, flush_interval=1.0, max_batch_size=500, max_queue_size=10000, put_timeout=0.01):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._traffic = Counter()
+        self._thread = None
+        self._pid = None
+        self._stats = {
+            'queued': 0,
+            'dropped': 0,
+            'written': 0,
+            'batches': 0,
+            'errors': 0,
+            'last_batch_seconds': 0.0,
+        }
+
+    def start(self):
+        """Start the writer thread (again, if this process was forked)."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the writer thread and write everything still queued."""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def captcha_generated(self, session_id, captcha_id):
+        self._put(CaptchaGenerated(session_id, captcha_id, utcnow()))
+
+    def attempt_completed(self, session_id, captcha_id, success, trajectory):
+        self._put(AttemptCompleted(session_id, captcha_id, success, trajectory, utcnow()))
+
+    def count(self, name, amount=1):
+        """Add to an hourly CAPTCHA_Traffic counter, kept in memory until the next write."""
+        self.start()
+        with self._lock:
+            self._traffic[name] += amount
+
+    def flush(self):
+        """Synchronously write every queued event."""
+        with self._write_lock:
+            while True:
+                events = self._take(block=False)
+                self._write(events)
+                if not events:
+                    return
+
+    def stats(self):
+        """Return a snapshot of the writer counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_size'] = self._queue.qsize()
+        return stats
+
+    def _put(self, event):
+        self.start()
+        try:
+            # Wait only briefly when the writer falls behind, never on database I/O
+            self._queue.put(event, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+        else:
+            with self._lock:
+                self._stats['queued'] += 1
+
+    def _take(self, block):
+        """Take up to max_batch_size events, waiting at most flush_interval for the first one."""
+        try:
+            events = [self._queue.get(block, self.flush_interval if block else None)]
+        except queue.Empty:
+            return []
+        while len(events) < self.max_batch_size:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Batches are taken and written under one lock so they reach the database in order
+            with self._write_lock:
+                self._write(self._take(block=True))
+
+    def _write(self, events):
+        with self._lock:
+            traffic, self._traffic = self._traffic, Counter()
+        if not events and not traffic:
+            return
+
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                write_events(db.session, events, traffic)
+        except Exception:
+            with self._lock:
+                self._stats['errors'] += 1
+                # Counters are cheap to keep, try them again with the next batch
+                self._traffic.update(traffic)
+            self.app.logger.exception('Failed to write %d analytics events', len(events))
+            return
+
+        with self._lock:
+            self._stats['written'] += len(events)
+            self._stats['batches'] += 1
+            self._stats['last_batch_seconds'] = time.perf_counter() - started
+
+
+def upsert(session, model, rows, increment=()):
+    """Insert rows, skipping existing keys or adding to the `increment` columns of existing rows."""
+    table = model.__table__
+    keys = [column.name for column in table.primary_key]
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(table)
+        if increment:
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={name: table.c[name] + statement.excluded[name] for name in increment}
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        session.execute(statement, rows)
+        return
+
+    # Other databases: look the keys up first
+    for row in rows:
+        existing = session.get(model, tuple(row[key] for key in keys))
+        if existing is None:
+            session.add(model(**row))
+        else:
+            for name in increment:
+                setattr(existing, name, getattr(existing, name) + row[name])
+    session.flush()
+
+
+def write_events(session, events, traffic=None):
+    """Apply a batch of analytics events in one transaction, coalescing counters per session and per hour."""
+    sessions = {}
+    new_attempts = []
+    completions = {}
+    counters = defaultdict(lambda: {'captchas_generated': 0, 'captchas_solved': 0, 'captchas_failed': 0})
+    rollups = defaultdict(Counter)
+
+    for event in events:
+        if isinstance(event, CaptchaGenerated):
+            # Sessions only get a row once they ask for their first CAPTCHA
+            sessions.setdefault(event.session_id, event.presented_at)
+            new_attempts.append({
+                'session_id': event.session_id,
+                'captcha_id': event.captcha_id,
+                'presented_at': event.presented_at,
+            })
+            counters[event.session_id]['captchas_generated'] += 1
+            add_to_rollups(rollups, event.presented_at, generated=1)
+        elif isinstance(event, AttemptCompleted):
+            completions[(event.session_id, event.captcha_id)] = event
+            counters[event.session_id]['captchas_solved' if event.success else 'captchas_failed'] += 1
+            add_to_rollups(rollups, event.completed_at, **{'solved' if event.success else 'failed': 1})
+
+    # New sessions, skipping any that already made it to the database
+    if sessions:
+        existing = {row[0] for row in session.query(CAPTCHA_Analytics.session_id)
+                    .filter(CAPTCHA_Analytics.session_id.in_(sessions))}
+        for session_id, created_at in sessions.items():
+            if session_id not in existing:
+                add_to_rollups(rollups, created_at, sessions=1)
+        upsert(session, CAPTCHA_Analytics, [
+            {'session_id': session_id, 'created_at': created_at, 'captchas_generated': 0,
+             'captchas_solved': 0, 'captchas_failed': 0}
+            for session_id, created_at in sessions.items()
+        ])
+
+    if new_attempts:
+        session.execute(insert(CAPTCHA_Attempt), new_attempts)
+
+    # Complete the attempts, which were all inserted before their completion was queued
+    if completions:
+        captcha_ids = {captcha_id for _, captcha_id in completions}
+        attempts = session.query(CAPTCHA_Attempt).filter(CAPTCHA_Attempt.captcha_id.in_(captcha_ids))
+        for attempt in attempts:
+            event = completions.get((attempt.session_id, attempt.captcha_id))
+            if event is None:
+                continue
+            attempt.completed_at = event.completed_at
+            attempt.success = event.success
+            attempt.mouse_trajectory = encode(event.trajectory) if event.trajectory is not None else None
+
+            # Calculate the time taken to solve or fail the CAPTCHA
+            attempt.time_taken = (attempt.completed_at.replace(tzinfo=None) - attempt.presented_at.replace(tzinfo=None)).total_seconds()
+            if event.success:
+                add_to_rollups(rollups, event.completed_at, timed_solves=1, solve_seconds=attempt.time_taken)
+            else:
+                add_to_rollups(rollups, event.completed_at, timed_fails=1, fail_seconds=attempt.time_taken)
+
+    # One UPDATE per session, however many events it had in this batch
+    for session_id, deltas in counters.items():
+        session.execute(
+            update(CAPTCHA_Analytics)
+            .where(CAPTCHA_Analytics.session_id == session_id)
+            .values({name: getattr(CAPTCHA_Analytics, name) + delta for name, delta in deltas.items() if delta})
+        )
+
+    # Hourly and daily totals for the dashboard
+    if rollups:
+        upsert(session, CAPTCHA_Rollup, rollup_rows(rollups), increment=ROLLUP_COLUMNS)
+
+    # Visitors without a session row are only counted per hour
+    if traffic:
+        row = {'hour': utcnow().replace(minute=0, second=0, microsecond=0, tzinfo=None)}
+        for column in ('script_loads', 'sessions_started'):
+            row[column] = traffic.get(column, 0)
+        upsert(session, CAPTCHA_Traffic, [row], increment=('script_loads', 'sessions_started'))
+
+    session.commit()
@@ -0,0 +1,158 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from main import app as flask_app, analytics_writer, puzzle_pool, reaper, render_pool
+
+# Connections and request bodies are handled on the event loop, so slow or idle clients cost no
+# thread; complete requests then run the Flask routes on a bounded pool of worker threads
+flask_app.config['PCAPTCHA_ASGI_THREADS'] = 32
+flask_app.config['PCAPTCHA_ASGI_MAX_BODY_BYTES'] = 1024 * 1024
+
+
+def wsgi_environ(scope, body):
+    """Build the WSGI environ of an ASGI HTTP request whose body has been read."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI carries the raw UTF-8 bytes of the path as latin-1
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        if key in environ:
+            environ[key] += ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        else:
+            environ[key] = value
+    # The body is complete, even if it arrived chunked
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class ASGIAdapter:
+    """Serve a WSGI app over ASGI, running each complete request on one of `max_threads` threads."""
+
+    def __init__(self, wsgi_app, max_threads=32, max_body_bytes=1024 * 1024, on_shutdown=()):
+        self.wsgi_app = wsgi_app
+        self.max_body_bytes = max_body_bytes
+        self.on_shutdown = on_shutdown
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Flush analytics and stop the background workers off the event loop
+                loop = asyncio.get_running_loop()
+                for callback in self.on_shutdown:
+                    await loop.run_in_executor(self._executor, callback)
+                self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        too_large = [('Content-Type', 'text/plain')], [b'Request too large']
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > self.max_body_bytes:
+                await self._send(send, '413 Request Entity Too Large', *too_large)
+                return
+
+        # Read the whole body here, so a slow upload never holds a worker thread
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                await self._send(send, '413 Request Entity Too Large', *too_large)
+                return
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(
+            self._executor, self._run_wsgi, wsgi_environ(scope, b''.join(chunks))
+        )
+        await self._send(send, status, headers, body)
+
+    def _run_wsgi(self, environ):
+        """Run the WSGI app on a worker thread and collect its whole response."""
+        response = {}
+        body = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = status
+            response['headers'] = headers
+            return body.append
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            body.extend(chunk for chunk in result if chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], body
+
+    @staticmethod
+    async def _send(send, status, headers, body):
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+        })
+        await send({'type': 'http.response.body', 'body': b''.join(body)})
+
+
+app = ASGIAdapter(
+    flask_app,
+    max_threads=flask_app.config['PCAPTCHA_ASGI_THREADS'],
+    max_body_bytes=flask_app.config['PCAPTCHA_ASGI_MAX_BODY_BYTES'],
+    on_shutdown=(analytics_writer.stop, puzzle_pool.stop, reaper.stop, render_pool.stop)
+)
+
+if __name__ == '__main__':
+    # Any ASGI server can serve `asgi:app`; uvicorn is used when run directly
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('ASGI mode needs an ASGI server, e.g. pip install uvicorn')
+    uvicorn.run(app, host='0.0.0.0', port=5007, backlog=2048)
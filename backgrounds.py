@@ -0,0 +1,143 @@
+import os
+import random
+import tarfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import requests
+from PIL import Image, ImageOps
+
+# Size of every background handed to the renderer
+BACKGROUND_SIZE = (250, 250)
+
+# File extensions picked up from a local corpus
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
+
+
+def decode_background(data):
+    """Decode image bytes into a 250x250 RGBA background."""
+    image = Image.open(BytesIO(data))
+    if image.size != BACKGROUND_SIZE:
+        image = ImageOps.fit(image, BACKGROUND_SIZE)
+    return image.convert('RGBA')
+
+
+def iter_corpus(path):
+    """Yield (name, image bytes) for every image in a directory or tarball."""
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    file_path = os.path.join(root, name)
+                    with open(file_path, 'rb') as image_file:
+                        yield file_path, image_file.read()
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield member.name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f'{path} is neither a directory nor a tarball')
+
+
+class BackgroundSource:
+    """Something that hands out 250x250 RGBA background images."""
+
+    def get(self):
+        raise NotImplementedError
+
+
+class RemoteBackgroundSource(BackgroundSource):
+    """Fetch backgrounds over HTTP using a pooled session and a timeout."""
+
+    def __init__(self, url='https://picsum.photos/250', timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get(self):
+        response = self.session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return decode_background(response.content)
+
+
+class CachedBackgroundSource(BackgroundSource):
+    """Serve random backgrounds from an LRU cache of decoded images bounded by memory."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, refill_source=None, refill_every=0):
+        self.max_bytes = max_bytes
+        self.refill_source = refill_source
+        self.refill_every = refill_every
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._served = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def add(self, key, image):
+        """Cache a decoded background, evicting the least recently used ones past the memory limit."""
+        with self._lock:
+            if key in self._images:
+                self._bytes -= self._image_bytes(self._images.pop(key))
+            self._images[key] = image
+            self._bytes += self._image_bytes(image)
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= self._image_bytes(evicted)
+
+    def load(self, path):
+        """Decode every image of a local directory or tarball into the cache."""
+        for name, data in iter_corpus(path):
+            try:
+                self.add(name, decode_background(data))
+            except OSError:
+                # Skip files Pillow cannot decode
+                continue
+
+    def get(self):
+        """Return a random cached background, refilling from the remote source when due."""
+        with self._lock:
+            self._served += 1
+            refill_due = self.refill_every and self._served % self.refill_every == 0
+            key = random.choice(tuple(self._images)) if self._images else None
+            if key is not None:
+                self._images.move_to_end(key)
+                image = self._images[key]
+
+        if self.refill_source is not None and (key is None or refill_due):
+            try:
+                fresh = self.refill_source.get()
+            except (requests.RequestException, OSError):
+                # Keep serving from the cache while the remote source is down
+                if key is None:
+                    raise
+            else:
+                self.add(f'remote-{self._served}', fresh)
+                return fresh
+
+        if key is None:
+            raise LookupError('No background images available')
+        return image
+
+    def stats(self):
+        """Return the cache size in images and bytes."""
+        with self._lock:
+            return {'images': len(self._images), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+    @staticmethod
+    def _image_bytes(image):
+        return len(image.getbands()) * image.width * image.height
+
+
+def create_background_source(path=None, max_bytes=64 * 1024 * 1024, url=None, timeout=5.0, refill_every=0):
+    """Build the cached background source, preloaded from a local corpus and refilled from a URL."""
+    source = CachedBackgroundSource(
+        max_bytes=max_bytes,
+        refill_source=RemoteBackgroundSource(url, timeout=timeout) if url else None,
+        refill_every=refill_every
+    )
+    if path:
+        source.load(path)
+    return source
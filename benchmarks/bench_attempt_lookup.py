@@ -0,0 +1,107 @@
+"""Time the attempt lookups and dashboard aggregates with and without the lookup indexes.
+
+Usage: python benchmarks/bench_attempt_lookup.py [--rows 1000000 10000000] [--lookups 2000]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from sqlalchemy import create_engine, func, insert, select
+from migrations import migrate
+from models import db, CAPTCHA_Attempt
+
+CHUNK = 50000
+
+
+def populate(engine, rows, keep):
+    """Fill the attempt table with rows spread over 30 days, returning about `keep` of their ids."""
+    start = datetime.datetime(2024, 1, 1)
+    sessions = [str(uuid.uuid4()) for _ in range(max(rows // 5, 1))]
+    keep_every = max(rows // keep, 1)
+    captcha_ids = []
+    with engine.begin() as connection:
+        for offset in range(0, rows, CHUNK):
+            batch = []
+            for row in range(offset, min(offset + CHUNK, rows)):
+                captcha_id = str(uuid.uuid4())
+                if row % keep_every == 0:
+                    captcha_ids.append(captcha_id)
+                presented_at = start + datetime.timedelta(seconds=random.randint(0, 30 * 86400))
+                success = random.random() < 0.7
+                time_taken = random.uniform(1, 30)
+                batch.append({
+                    'session_id': random.choice(sessions),
+                    'captcha_id': captcha_id,
+                    'presented_at': presented_at,
+                    'completed_at': presented_at + datetime.timedelta(seconds=time_taken),
+                    'time_taken': time_taken,
+                    'success': success,
+                })
+            connection.execute(insert(CAPTCHA_Attempt), batch)
+    return captcha_ids
+
+
+def time_queries(engine, captcha_ids, lookups):
+    """Return the mean seconds of each query shape."""
+    table = CAPTCHA_Attempt.__table__
+    hour = func.extract('hour', table.c.presented_at)
+    samples = random.sample(captcha_ids, min(lookups, len(captcha_ids)))
+    results = {}
+    with engine.connect() as connection:
+        session_ids = dict(connection.execute(
+            select(table.c.captcha_id, table.c.session_id).where(table.c.captcha_id.in_(samples))
+        ).all())
+
+        started = time.perf_counter()
+        for captcha_id in samples:
+            connection.execute(select(table).where(
+                table.c.session_id == session_ids[captcha_id], table.c.captcha_id == captcha_id
+            )).first()
+        results['attempt lookup'] = (time.perf_counter() - started) / len(samples)
+
+        started = time.perf_counter()
+        connection.execute(select(hour, func.count()).group_by(hour).order_by(func.count().desc())).first()
+        results['hour histogram'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        connection.execute(select(func.avg(table.c.time_taken)).where(table.c.success == True)).scalar()  # noqa: E712
+        results['average solve time'] = time.perf_counter() - started
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f'sqlite:///{os.path.join(directory, "bench.db")}')
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                for index in CAPTCHA_Attempt.__table__.indexes:
+                    index.drop(connection)
+
+            started = time.perf_counter()
+            captcha_ids = populate(engine, rows, args.lookups)
+            print(f'{rows:,} attempts inserted in {time.perf_counter() - started:.1f}s')
+
+            before = time_queries(engine, captcha_ids, args.lookups)
+            started = time.perf_counter()
+            migrate(engine)
+            print(f'  migration applied in {time.perf_counter() - started:.1f}s')
+            after = time_queries(engine, captcha_ids, args.lookups)
+
+            for name in before:
+                print(f'  {name:<20} {before[name] * 1000:10.3f} ms -> {after[name] * 1000:10.3f} ms')
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
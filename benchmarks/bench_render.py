@@ -0,0 +1,65 @@
+"""Compare puzzle renders per second of the full-frame blur and the patch renderer.
+
+Usage: python benchmarks/bench_render.py [--seconds 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+import puzzle
+
+
+def render_full_frame(background, correct_x, correct_y):
+    """The original renderer: blur a full-size piece layer and composite the whole frame."""
+    outline_color = random.choice(puzzle.neon_colors)
+    fill = random.choice(puzzle.neon_colors)[:3] + (15,)
+    piece_layer = Image.new('RGBA', background.size, (0, 0, 0, 0))
+    ImageDraw.Draw(piece_layer).rectangle(
+        [correct_x, correct_y, correct_x + puzzle.piece_size, correct_y + puzzle.piece_size],
+        fill=fill, outline=outline_color, width=5
+    )
+    blurred_piece = piece_layer.filter(ImageFilter.GaussianBlur(radius=5))
+    return Image.alpha_composite(background, blurred_piece)
+
+
+def renders_per_second(render, background, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        render(background, random.randint(25, 200), random.randint(25, 200))
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    background = Image.fromarray(rng.integers(0, 256, (250, 250, 3), dtype=np.uint8)).convert('RGBA')
+
+    # Both renderers must produce the same picture
+    random.seed(1)
+    expected = np.asarray(render_full_frame(background, 120, 80), dtype=np.int16)
+    random.seed(1)
+    actual = np.asarray(puzzle.render_puzzle(background, 120, 80), dtype=np.int16)
+    print(f'max channel difference: {np.abs(expected - actual).max()}')
+
+    # Warm the piece cache so the steady state is measured
+    for outline_color in puzzle.neon_colors:
+        for fill in puzzle.neon_colors:
+            puzzle.blurred_piece(outline_color, fill[:3] + (15,))
+
+    full_frame = renders_per_second(render_full_frame, background, args.seconds)
+    patch = renders_per_second(puzzle.render_puzzle, background, args.seconds)
+    print(f'full-frame blur: {full_frame:8.1f} renders/s')
+    print(f'patch renderer:  {patch:8.1f} renders/s ({patch / full_frame:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
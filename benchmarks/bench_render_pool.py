@@ -0,0 +1,61 @@
+"""Measure puzzles per second of the RenderPool as worker processes are added.
+
+Usage: python benchmarks/bench_render_pool.py [--batches 8] [--batch-size 64] [--max-processes N]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+from PIL import Image
+from backgrounds import create_background_source
+from render_pool import RenderPool
+
+
+def make_corpus(path, count=16):
+    """Write random noise backgrounds, which encode to realistically large PNGs."""
+    rng = np.random.default_rng(0)
+    for index in range(count):
+        pixels = rng.integers(0, 256, size=(250, 250, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(path, f'noise-{index}.png'))
+
+
+def puzzles_per_second(pool, batches, batch_size):
+    # Warm up so worker start-up and corpus loading are not measured
+    pool.generate_puzzles(batch_size)
+    started = time.perf_counter()
+    for _ in range(batches):
+        pool.generate_puzzles(batch_size)
+    return batches * batch_size / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batches', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        make_corpus(path)
+        settings = {'path': path}
+
+        pool = RenderPool(create_background_source(**settings), settings, processes=0)
+        baseline = puzzles_per_second(pool, args.batches, args.batch_size)
+        print(f'in-process: {baseline:8.1f} puzzles/s')
+
+        processes = 1
+        while processes <= args.max_processes:
+            pool = RenderPool(None, settings, processes=processes)
+            try:
+                rate = puzzles_per_second(pool, args.batches, args.batch_size)
+            finally:
+                pool.stop()
+            print(f'{processes:3d} processes: {rate:8.1f} puzzles/s ({rate / baseline:.2f}x)')
+            processes *= 2
+
+
+if __name__ == '__main__':
+    main()
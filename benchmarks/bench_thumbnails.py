@@ -0,0 +1,69 @@
+"""Compare mouse path thumbnails per second of the per-point ellipse renderer and the NumPy rasterizer.
+
+Usage: python benchmarks/bench_thumbnails.py [--points 300] [--seconds 3]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+from PIL import Image, ImageDraw
+from thumbnails import render_thumbnail, svg_thumbnail
+from trajectory import decode, encode, Trajectory
+
+
+def render_ellipses(mouse_trajectory, mouse_movements, success):
+    """The original renderer: one ImageDraw.ellipse call per point, saved as an RGB PNG."""
+    trajectory = decode(mouse_trajectory)
+    img = Image.new('RGB', (250, 250), (0, 255, 0) if success else (255, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for x_coord, y_coord in zip(trajectory.x, trajectory.y):
+        if 0 <= x_coord < 250 and 0 <= y_coord < 250:
+            draw.ellipse((x_coord - 2, y_coord - 2, x_coord + 2, y_coord + 2), fill='blue')
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def random_walk(points, rng):
+    """A mouse path wandering over the puzzle, a point every 5 to 20 ms."""
+    x = 125 + np.cumsum(rng.integers(-4, 5, points))
+    y = 125 + np.cumsum(rng.integers(-4, 5, points))
+    return encode(Trajectory(x, y, np.cumsum(rng.integers(5, 21, points))))
+
+
+def thumbnails_per_second(render, paths, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        render(paths[count % len(paths)], None, count % 2 == 0)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=300)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    paths = [random_walk(args.points, rng) for _ in range(32)]
+    renderers = {
+        'ellipses (PNG)': render_ellipses,
+        'points (PNG)': render_thumbnail,
+        'velocity (PNG)': lambda *row: render_thumbnail(*row, style='velocity'),
+        'points (SVG)': svg_thumbnail,
+        'velocity (SVG)': lambda *row: svg_thumbnail(*row, style='velocity'),
+    }
+    baseline = None
+    for name, render in renderers.items():
+        rate = thumbnails_per_second(render, paths, args.seconds)
+        baseline = baseline or rate
+        print(f'{name:15s} {rate:8.1f} thumbnails/s ({rate / baseline:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
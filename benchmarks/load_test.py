@@ -0,0 +1,97 @@
+"""Load test the CAPTCHA API with many concurrent clients generating and checking puzzles.
+
+Each client repeatedly fetches a puzzle from /generate_puzzle_piece and posts a position
+to /check_position, one connection per request. Compare the two serving modes with:
+
+    python main.py                       # sync (Flask development server)
+    python asgi.py                       # async (ASGI, needs uvicorn)
+    python benchmarks/load_test.py --url http://127.0.0.1:5007 --clients 1000
+
+Usage: python benchmarks/load_test.py [--url URL] [--clients 1000] [--seconds 20]
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+async def http_request(host, port, method, path, body=b'', headers=(), timeout=30.0):
+    """Send one HTTP/1.1 request on a new connection and return (status, headers, body)."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close',
+                 f'Content-Length: {len(body)}', *headers]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, content = raw.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    response_headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        response_headers.setdefault(name.strip().lower(), []).append(value.strip())
+    return int(status_line.split()[1]), response_headers, content
+
+
+async def client(host, port, deadline, latencies, errors):
+    """Generate and check puzzles until the deadline, keeping the session cookie."""
+    cookie = ()
+    while time.perf_counter() < deadline:
+        try:
+            started = time.perf_counter()
+            status, headers, content = await http_request(host, port, 'GET', '/generate_puzzle_piece', headers=cookie)
+            latencies['generate'].append(time.perf_counter() - started)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+                continue
+            if 'set-cookie' in headers:
+                cookie = ('Cookie: ' + headers['set-cookie'][0].split(';', 1)[0],)
+            captcha_id = json.loads(content)['captcha_id']
+
+            body = json.dumps({'captcha_id': captcha_id, 'x': 100, 'y': 100, 'mouse_path': ''}).encode()
+            started = time.perf_counter()
+            status, _, _ = await http_request(
+                host, port, 'POST', '/check_position', body, ('Content-Type: application/json', *cookie)
+            )
+            latencies['check'].append(time.perf_counter() - started)
+            if status != 200:
+                errors[status] = errors.get(status, 0) + 1
+        except (OSError, asyncio.TimeoutError, ValueError) as exc:
+            errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+
+async def run(url, clients, seconds):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies = {'generate': [], 'check': []}
+    errors = {}
+    started = time.perf_counter()
+    deadline = started + seconds
+    await asyncio.gather(*(client(host, port, deadline, latencies, errors) for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    for name, values in latencies.items():
+        print(f'{name:9s} {len(values) / elapsed:8.1f} req/s  '
+              f'p50 {1000 * percentile(values, 0.5):8.1f} ms  p99 {1000 * percentile(values, 0.99):8.1f} ms')
+    print(f'errors    {errors or "none"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5007')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=20.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import base64
+import binascii
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import namedtuple
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from sqlalchemy.exc import IntegrityError
+from models import db, CAPTCHA_UsedChallenge
+
+# Challenge id, piece position and expiry (unix seconds) sealed inside a token
+_PAYLOAD = struct.Struct('>16sHHQ')
+_NONCE_SIZE = 12
+
+Challenge = namedtuple('Challenge', ['id', 'correct_x', 'correct_y', 'expires_at'])
+
+
+class InvalidChallenge(Exception):
+    """Raised when a challenge token is malformed, tampered with, expired or reused."""
+
+
+class ChallengeCodec:
+    """Seal puzzle solutions into encrypted, authenticated challenge tokens."""
+
+    def __init__(self, secret_key, lifetime):
+        key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'pCAPTCHA challenge').derive(
+            secret_key.encode('utf-8')
+        )
+        self._aead = AESGCM(key)
+        self.lifetime = lifetime
+
+    def issue(self, correct_x, correct_y):
+        """Return a new Challenge and the token that carries it."""
+        challenge = Challenge(str(uuid.uuid4()), correct_x, correct_y, int(time.time() + self.lifetime))
+        payload = _PAYLOAD.pack(uuid.UUID(challenge.id).bytes, correct_x, correct_y, challenge.expires_at)
+        nonce = os.urandom(_NONCE_SIZE)
+        sealed = nonce + self._aead.encrypt(nonce, payload, None)
+        return challenge, base64.urlsafe_b64encode(sealed).rstrip(b'=').decode('ascii')
+
+    def open(self, token):
+        """Decrypt and authenticate a token, returning its Challenge if it has not expired."""
+        try:
+            sealed = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            payload = self._aead.decrypt(sealed[:_NONCE_SIZE], sealed[_NONCE_SIZE:], None)
+            challenge_id, correct_x, correct_y, expires_at = _PAYLOAD.unpack(payload)
+        except (TypeError, ValueError, binascii.Error, InvalidTag, struct.error):
+            raise InvalidChallenge('Malformed or forged challenge')
+
+        if expires_at <= time.time():
+            raise InvalidChallenge('Challenge has expired')
+        return Challenge(str(uuid.UUID(bytes=challenge_id)), correct_x, correct_y, expires_at)
+
+
+class ReplayStore:
+    """Remembers the ids of checked challenges until the challenges expire."""
+
+    def add(self, challenge_id, expires_at):
+        """Record a challenge as used, returning False if it had already been used."""
+        raise NotImplementedError
+
+    def purge(self):
+        """Forget every expired challenge and return how many were removed."""
+        raise NotImplementedError
+
+
+class ReplayFilter(ReplayStore):
+    """Remembers used challenge ids in-process, bucketed by expiry so they can be forgotten once expired.
+
+    Only valid when a single process checks challenges: every worker or node has its own
+    filter, so each of them would accept the same challenge once. Use DatabaseReplayStore
+    (or another shared ReplayStore) otherwise.
+    """
+
+    def __init__(self, bucket_seconds=60):
+        self.bucket_seconds = bucket_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def add(self, challenge_id, expires_at):
+        bucket = int(expires_at // self.bucket_seconds)
+        with self._lock:
+            self._purge(time.time())
+            seen = self._buckets.setdefault(bucket, set())
+            if challenge_id in seen:
+                return False
+            seen.add(challenge_id)
+            return True
+
+    def purge(self):
+        with self._lock:
+            return self._purge(time.time())
+
+    def _purge(self, now):
+        # Once a bucket's challenges have expired they are rejected before reaching the filter
+        current = int(now // self.bucket_seconds)
+        removed = 0
+        for bucket in [bucket for bucket in self._buckets if bucket < current]:
+            removed += len(self._buckets.pop(bucket))
+        return removed
+
+
+class DatabaseReplayStore(ReplayStore):
+    """Replay store in the database, shared by every worker and node. Needs an app context."""
+
+    def add(self, challenge_id, expires_at):
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    CAPTCHA_UsedChallenge.__table__.insert().values(id=challenge_id, expires_at=int(expires_at))
+                )
+        except IntegrityError:
+            return False
+        return True
+
+    def purge(self):
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                CAPTCHA_UsedChallenge.__table__.delete().where(CAPTCHA_UsedChallenge.expires_at <= int(time.time()))
+            )
+        return result.rowcount
@@ -1,31 +1,91 @@
-import base64
-import io
-import multiprocessing
-from flask import Flask, render_template_string
-from models import db, CAPTCHA_Analytics, CAPTCHA_Attempt
-from sqlalchemy import func, desc
-from PIL import Image, ImageDraw
+import atexit
+import datetime
+import os
+from flask import Flask, Response, abort, render_template_string, request, stream_template_string, url_for
+from markupsafe import Markup
+from models import db, CAPTCHA_Analytics, CAPTCHA_Attempt, CAPTCHA_Rollup, CAPTCHA_LIFETIME
+from database import configure_database, create_read_session
+from heatmaps import build_heatmaps, load_heatmap, render_heatmap
+from migrations import migrate
+from rollups import ROLLUP_COLUMNS, rebuild_rollups
+from thumbnails import ThumbnailCache, ThumbnailRenderer, svg_thumbnail
+from sqlalchemy import func, select, tuple_
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///captchas.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-
-
-def analyze_captcha_data():
-    """Retrieve captcha data from the database and calculate analytics for the dashboard."""
-    # Query for total analytics data
-    total_data = db.session.query(
-        func.sum(CAPTCHA_Analytics.captchas_generated).label('total_generated'),
-        func.sum(CAPTCHA_Analytics.captchas_solved).label('total_solved'),
-        func.sum(CAPTCHA_Analytics.captchas_failed).label('total_failed'),
-        func.count(CAPTCHA_Analytics.session_id).label('total_sessions')
-    ).first()
+configure_database(app)
+
+# Dashboard queries go to a read-only engine so they never contend with the CAPTCHA write path
+read_session = create_read_session(app)
+
+# Sessions listed per page of /sessions
+app.config['PCAPTCHA_SESSIONS_PAGE_SIZE'] = 500
+
+# Attempts shown per page of /mouse-movement
+app.config['PCAPTCHA_MOUSE_MOVEMENT_PAGE_SIZE'] = 30
+
+# Mouse path thumbnails kept in memory, and the worker processes rendering the missing ones
+# (0 renders them in the request thread). Every serve.py worker starts its own pool, so the
+# default stays small rather than one process per CPU.
+app.config['PCAPTCHA_THUMBNAIL_CACHE_SIZE'] = 10000
+app.config['PCAPTCHA_THUMBNAIL_PROCESSES'] = int(os.environ.get('PCAPTCHA_THUMBNAIL_PROCESSES', 2))
+
+# Mouse paths are drawn as dots ('points') or as lines colored by speed ('velocity'), either
+# rasterized to PNGs here ('png') or embedded in the page as SVGs for the browser to draw ('svg')
+app.config['PCAPTCHA_THUMBNAIL_STYLE'] = 'points'
+app.config['PCAPTCHA_THUMBNAIL_FORMAT'] = 'png'
+
+thumbnail_renderer = ThumbnailRenderer(
+    ThumbnailCache(app.config['PCAPTCHA_THUMBNAIL_CACHE_SIZE']),
+    processes=app.config['PCAPTCHA_THUMBNAIL_PROCESSES'],
+    style=app.config['PCAPTCHA_THUMBNAIL_STYLE']
+)
+# The pool is started with the app, which serve.py's workers import after forking
+thumbnail_renderer.start()
+atexit.register(thumbnail_renderer.stop)
+
+@app.before_request
+def start_thumbnail_workers():
+    """Make sure this worker process has its thumbnail rendering pool, if the app was imported before a fork."""
+    thumbnail_renderer.start()
+
+
+def rollup_totals():
+    """Return the all-time analytics totals, added up from the daily rollups."""
+    return read_session.query(
+        *(func.coalesce(func.sum(getattr(CAPTCHA_Rollup, name)), 0).label(name) for name in ROLLUP_COLUMNS)
+    ).filter(CAPTCHA_Rollup.period == 'day').one()._asdict()
+
+def busiest_hours():
+    """Return the hour of day (UTC) with the most generations, regenerations, solves and fails."""
+    hour = func.extract('hour', CAPTCHA_Rollup.start)
+    rows = (
+        read_session.query(hour.label('hour'),
+                           func.sum(CAPTCHA_Rollup.generated).label('generated'),
+                           func.sum(CAPTCHA_Rollup.solved).label('solved'),
+                           func.sum(CAPTCHA_Rollup.failed).label('failed'))
+            .filter(CAPTCHA_Rollup.period == 'hour')
+            .group_by(hour)
+            .all()
+    )
+
+    def busiest(counts):
+        hour, count = max(counts, key=lambda item: item[1], default=(None, 0))
+        return int(hour) if count else None
 
-    total_generated = total_data.total_generated or 0
-    total_solved = total_data.total_solved or 0
-    total_failed = total_data.total_failed or 0
-    total_sessions = total_data.total_sessions or 1  # Prevent division by zero
+    return {
+        'generated': busiest((row.hour, row.generated) for row in rows),
+        # CAPTCHAs generated in an hour that were not solved or failed in it
+        'regenerated': busiest((row.hour, row.generated - row.solved - row.failed) for row in rows),
+        'solved': busiest((row.hour, row.solved) for row in rows),
+        'failed': busiest((row.hour, row.failed) for row in rows),
+    }
+
+def analyze_captcha_data(totals):
+    """Calculate analytics for the dashboard from the rollup totals and hourly rollups."""
+    total_generated = totals['generated']
+    total_solved = totals['solved']
+    total_failed = totals['failed']
+    total_sessions = totals['sessions'] or 1  # Prevent division by zero
 
     # Calculate average generations, solves, and fails per session
     avg_generations_per_session = total_generated / total_sessions
@@ -33,58 +93,16 @@ def analyze_captcha_data():
     avg_solves_per_session = total_solved / total_sessions
     avg_fails_per_session = total_failed / total_sessions
 
-    # Find the most common generation time
-    most_common_generation_time_hour = (
-        db.session.query(func.extract('hour', CAPTCHA_Attempt.presented_at).label('hour'), 
-                func.count(func.extract('hour', CAPTCHA_Attempt.presented_at)).label('count'))
-            .group_by(func.extract('hour', CAPTCHA_Attempt.presented_at))
-            .order_by(desc('count'))
-            .first()
-    )
-    
-    most_common_generation_time_hour = most_common_generation_time_hour[0] if most_common_generation_time_hour is not None else None
-
-    # Find the most common regeneration time
-    most_common_regeneration_time_hour = (
-        db.session.query(func.extract('hour', CAPTCHA_Attempt.presented_at).label('hour'), 
-                func.count(func.extract('hour', CAPTCHA_Attempt.presented_at)).label('count'))
-            .filter(CAPTCHA_Attempt.completed_at is None)
-            .group_by(func.extract('hour', CAPTCHA_Attempt.presented_at))
-            .order_by(desc('count'))
-            .first()
-    )
-    
-    most_common_regeneration_time_hour = most_common_regeneration_time_hour[0] if most_common_regeneration_time_hour is not None else None
-
-    # Find the most common solving time
-    most_common_solve_time_hour = (
-        db.session.query(func.extract('hour', CAPTCHA_Attempt.completed_at).label('hour'), 
-                func.count(func.extract('hour', CAPTCHA_Attempt.completed_at)).label('count'))
-            .filter(CAPTCHA_Attempt.completed_at is not None, CAPTCHA_Attempt.success is True)
-            .group_by(func.extract('hour', CAPTCHA_Attempt.presented_at))
-            .order_by(desc('count'))
-            .first()
-    )
-    
-    most_common_solve_time_hour = most_common_solve_time_hour[0] if most_common_solve_time_hour is not None else None
-    
-    # Find the most common failing time
-    most_common_fail_time_hour = (
-        db.session.query(func.extract('hour', CAPTCHA_Attempt.completed_at).label('hour'), 
-                func.count(func.extract('hour', CAPTCHA_Attempt.completed_at)).label('count'))
-            .filter(CAPTCHA_Attempt.completed_at is not None, CAPTCHA_Attempt.success is False)
-            .group_by(func.extract('hour', CAPTCHA_Attempt.presented_at))
-            .order_by(desc('count'))
-            .first()
-    )
-    
-    most_common_fail_time_hour = most_common_fail_time_hour[0] if most_common_fail_time_hour is not None else None
+    # Find the most common times of generation, regeneration, solving and failing
+    hours = busiest_hours()
+    most_common_generation_time_hour = hours['generated']
+    most_common_regeneration_time_hour = hours['regenerated']
+    most_common_solve_time_hour = hours['solved']
+    most_common_fail_time_hour = hours['failed']
 
-    # Calculate average time to solve
-    avg_time_to_solve = db.session.query(func.avg(CAPTCHA_Attempt.time_taken).label('average')).filter(CAPTCHA_Attempt.success == True).scalar()
-
-    # Calculate average time to fail
-    avg_time_to_fail = db.session.query(func.avg(CAPTCHA_Attempt.time_taken).label('average')).filter(CAPTCHA_Attempt.success == False).scalar()
+    # Calculate average time to solve and to fail
+    avg_time_to_solve = totals['solve_seconds'] / totals['timed_solves'] if totals['timed_solves'] else None
+    avg_time_to_fail = totals['fail_seconds'] / totals['timed_fails'] if totals['timed_fails'] else None
 
     # Constructing results
     results = {
@@ -110,54 +128,16 @@ def analyze_captcha_data():
 
     return results
 
-def process_mouse_movement(data):
-    """Check if data is there and then create image from it."""
-    mouse_movement, success = data
-    if mouse_movement is not None:
-        image_base64 = create_base64_image(mouse_movement, success)
-        return image_base64 if image_base64 else None
-    return None
-
-def create_base64_image(mouse_movements, success):
-    """Create an image showing the mouse path on the captcha, and changing the background color depending on success."""
-    # Check if mouse_movements is empty
-    if not mouse_movements:
-        return None  # Handle empty input gracefully
-
-    # Extract x, y coordinates from the list
-    x, y = zip(*[(m['x'], m['y']) for m in mouse_movements])
-    
-    # Create a new image with a green background if success, red otherwise
-    background_color = (0, 255, 0) if success else (255, 0, 0)  # Green or Red
-    img = Image.new('RGB', (250, 250), background_color)
-
-    # Create a draw object
-    draw = ImageDraw.Draw(img)
-
-    # Draw the mouse movements
-    for x_coord, y_coord in zip(x, y):
-        if 0 <= x_coord < 250 and 0 <= y_coord < 250:  # Ensure coordinates are within bounds
-            draw.ellipse((x_coord-2, y_coord-2, x_coord+2, y_coord+2), fill='blue')  # Small circles
-
-    # Save to a BytesIO object
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-
-    # Encode to Base64
-    image_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-
-    return image_base64
-
 @app.route('/')
 def index():
     """Returns an overview of data from the analytics table."""
-    total_pcaptchas_generated = db.session.query(func.sum(CAPTCHA_Analytics.captchas_generated)).scalar() or 0
-    total_pcaptchas_solved = db.session.query(func.sum(CAPTCHA_Analytics.captchas_solved)).scalar() or 0
-    total_pcaptchas_failed = db.session.query(func.sum(CAPTCHA_Analytics.captchas_failed)).scalar() or 0
+    totals = rollup_totals()
+    total_pcaptchas_generated = totals['generated']
+    total_pcaptchas_solved = totals['solved']
+    total_pcaptchas_failed = totals['failed']
     total_pcaptchas_regenerated = total_pcaptchas_generated - (total_pcaptchas_solved + total_pcaptchas_failed)
 
-    captcha_analysis = analyze_captcha_data()
+    captcha_analysis = analyze_captcha_data(totals)
 
     return f'''
 <!DOCTYPE html>
@@ -182,6 +162,7 @@ def index():
                     <li class="nav-item"><a class="nav-link active" href="/">Overview</a></li>
                     <li class="nav-item"><a class="nav-link" href="/sessions">Sessions</a></li>
                     <li class="nav-item"><a class="nav-link" href="/mouse-movement">Mouse Movement</a></li>
+                    <li class="nav-item"><a class="nav-link" href="/heatmap">Heatmap</a></li>
                 </ul>
             </div>
         </div>
@@ -280,25 +261,101 @@ def index():
 </html>
 '''
 
+# Columns the sessions can be sorted by, each paged through by (column, session_id)
+SESSION_SORTS = {
+    'created_at': CAPTCHA_Analytics.created_at,
+    'generated': func.coalesce(CAPTCHA_Analytics.captchas_generated, 0),
+    'solved': func.coalesce(CAPTCHA_Analytics.captchas_solved, 0),
+    'failed': func.coalesce(CAPTCHA_Analytics.captchas_failed, 0),
+}
+
+def session_listing():
+    """Build the query of one page of sessions from the filters, sort order and cursor in the query string.
+
+    Returns the query, which selects one session more than a page to tell whether another
+    page follows, the query string arguments to carry over to the other pages, and whether
+    the query reads backwards from a previous page cursor (its rows then come in reverse).
+    """
+    arguments = {name: request.args[name] for name in ('since', 'until', 'session', 'sort', 'order') if request.args.get(name)}
+    sort = arguments.get('sort', 'created_at')
+    order = arguments.get('order', 'desc')
+    if sort not in SESSION_SORTS or order not in ('asc', 'desc'):
+        abort(400, 'Invalid sort order')
+    sort_column = SESSION_SORTS[sort]
+
+    query = select(
+        CAPTCHA_Analytics.session_id,
+        CAPTCHA_Analytics.captchas_generated,
+        CAPTCHA_Analytics.captchas_solved,
+        CAPTCHA_Analytics.captchas_failed,
+        CAPTCHA_Analytics.created_at,
+        sort_column.label('sort_value'),
+    )
+    since = parse_time_filter('since')
+    if since is not None:
+        query = query.where(CAPTCHA_Analytics.created_at >= since)
+    until = parse_time_filter('until')
+    if until is not None:
+        query = query.where(CAPTCHA_Analytics.created_at < until)
+    if 'session' in arguments:
+        query = query.where(CAPTCHA_Analytics.session_id.startswith(arguments['session'], autoescape=True))
+
+    # Keyset pagination: carry on after the (sort value, session id) of the last row shown,
+    # or read back from before the first one for the previous page
+    cursors = {name: request.args.get(name) for name in ('after', 'after_id', 'before', 'before_id')}
+    given = [name for name, value in cursors.items() if value is not None]
+    if given not in ([], ['after', 'after_id'], ['before', 'before_id']):
+        abort(400, 'Invalid cursor')
+    backward = 'before' in given
+    descending = (order == 'desc') != backward
+    if given:
+        value, value_id = (cursors['before'], cursors['before_id']) if backward else (cursors['after'], cursors['after_id'])
+        try:
+            value = datetime.datetime.fromisoformat(value) if sort == 'created_at' else int(value)
+        except ValueError:
+            abort(400, 'Invalid cursor')
+        cursor = tuple_(sort_column, CAPTCHA_Analytics.session_id)
+        query = query.where(cursor < (value, value_id) if descending else cursor > (value, value_id))
+
+    direction = (lambda column: column.desc()) if descending else (lambda column: column.asc())
+    page_size = app.config['PCAPTCHA_SESSIONS_PAGE_SIZE']
+    query = query.order_by(direction(sort_column), direction(CAPTCHA_Analytics.session_id)).limit(page_size + 1)
+    return query, arguments, backward
+
 @app.route('/sessions')
 def sessions():
-    """Display a list of sessions and their statics."""
-    total_pcaptchas_generated = db.session.query(func.sum(CAPTCHA_Analytics.captchas_generated)).scalar() or 0
-    total_pcaptchas_solved = db.session.query(func.sum(CAPTCHA_Analytics.captchas_solved)).scalar() or 0
-    total_pcaptchas_failed = db.session.query(func.sum(CAPTCHA_Analytics.captchas_failed)).scalar() or 0
+    """Stream a page of sessions and their statistics, filtered and sorted in the database."""
+    totals = rollup_totals()
+    total_pcaptchas_generated = totals['generated']
+    total_pcaptchas_solved = totals['solved']
+    total_pcaptchas_failed = totals['failed']
     total_pcaptchas_regenerated = total_pcaptchas_generated - (total_pcaptchas_solved + total_pcaptchas_failed)
 
-    session_records = db.session.query(CAPTCHA_Analytics).all()
+    query, arguments, backward = session_listing()
+    page_size = app.config['PCAPTCHA_SESSIONS_PAGE_SIZE']
+    if backward:
+        # A previous page is read in reverse, so its rows are fetched and put back in order first
+        session_records = read_session.execute(query).all()
+        has_previous = len(session_records) > page_size
+        session_records = session_records[:page_size][::-1]
+    else:
+        # Rows are fetched in batches while the page is being sent, so the first ones arrive right away
+        session_records = read_session.execute(query.execution_options(yield_per=100))
+        has_previous = 'after' in request.args
+
+    def page_link(record, direction):
+        value = record.sort_value.isoformat() if isinstance(record.sort_value, datetime.datetime) else record.sort_value
+        return url_for('sessions', **{direction: value, f'{direction}_id': record.session_id}, **arguments)
 
     session_stats = {
-        'total_session_count': len(session_records),
+        'total_session_count': totals['sessions'],
         'total_pcaptchas_generated': total_pcaptchas_generated,
         'total_pcaptchas_solved': total_pcaptchas_solved,
         'total_pcaptchas_failed': total_pcaptchas_failed,
         'total_pcaptchas_regenerated': total_pcaptchas_regenerated,
     }
 
-    return render_template_string('''
+    return stream_template_string('''
 <!DOCTYPE html>
 <html data-bs-theme="light" lang="en">
 
@@ -321,6 +378,7 @@ def sessions():
                     <li class="nav-item"><a class="nav-link" href="/">Overview</a></li>
                     <li class="nav-item"><a class="nav-link active" href="/sessions">Sessions</a></li>
                     <li class="nav-item"><a class="nav-link" href="/mouse-movement">Mouse Movement</a></li>
+                    <li class="nav-item"><a class="nav-link" href="/heatmap">Heatmap</a></li>
                 </ul>
             </div>
         </div>
@@ -381,6 +439,38 @@ def sessions():
         </div>
     </div>
     <div class="container" style="margin-top: 30px;">
+        <form class="row g-2 align-items-end" method="get" action="/sessions" style="color: var(--bs-body-bg);margin-bottom: 30px;">
+            <div class="col-md-3">
+                <label class="form-label" for="session">Session ID starts with</label>
+                <input class="form-control" type="text" id="session" name="session" value="{{ arguments.session }}">
+            </div>
+            <div class="col-md-2">
+                <label class="form-label" for="since">Created since (GMT)</label>
+                <input class="form-control" type="datetime-local" id="since" name="since" value="{{ arguments.since }}">
+            </div>
+            <div class="col-md-2">
+                <label class="form-label" for="until">Created before (GMT)</label>
+                <input class="form-control" type="datetime-local" id="until" name="until" value="{{ arguments.until }}">
+            </div>
+            <div class="col-md-2">
+                <label class="form-label" for="sort">Sort by</label>
+                <select class="form-select" id="sort" name="sort">
+                    {% for value, label in [('created_at', 'Created At'), ('generated', 'Generated'), ('solved', 'Solved'), ('failed', 'Failed')] %}
+                        <option value="{{ value }}" {% if arguments.sort == value %}selected{% endif %}>{{ label }}</option>
+                    {% endfor %}
+                </select>
+            </div>
+            <div class="col-md-2">
+                <label class="form-label" for="order">Order</label>
+                <select class="form-select" id="order" name="order">
+                    <option value="desc">Descending</option>
+                    <option value="asc" {% if arguments.order == 'asc' %}selected{% endif %}>Ascending</option>
+                </select>
+            </div>
+            <div class="col-md-1">
+                <button class="btn btn-primary w-100" type="submit">Filter</button>
+            </div>
+        </form>
         <div class="table-responsive" style="background: var(--bs-body-color);border-radius: 10px;border: 0.8px solid var(--bs-emphasis-color) ;">
             <table class="table">
                 <thead>
@@ -393,7 +483,13 @@ def sessions():
                     </tr>
                 </thead>
                 <tbody style="background: var(--bs-body-color);">
+                    {% set page = namespace(first=none, last=none, more=has_next) %}
                     {% for record in records %}
+                        {% if loop.index > page_size %}
+                            {% set page.more = true %}
+                        {% else %}
+                        {% if loop.first %}{% set page.first = record %}{% endif %}
+                        {% set page.last = record %}
                         <tr>
                             <td style="background: var(--bs-body-color);color: var(--bs-table-bg);border-color: var(--bs-table-color);">{{record.session_id}}</td>
                             <td style="background: var(--bs-body-color);color: var(--bs-table-bg);border-color: var(--bs-table-color);">{{record.captchas_generated}}</td>
@@ -401,45 +497,132 @@ def sessions():
                             <td style="background: var(--bs-body-color);color: var(--bs-table-bg);border-color: var(--bs-table-color);">{{record.captchas_failed}}</td>
                             <td style="background: var(--bs-body-color);color: var(--bs-table-bg);border-color: var(--bs-table-color);">{{record.created_at}} GMT</td>
                         </tr>
+                        {% endif %}
                     {% endfor %}
                 </tbody>
             </table>
         </div>
+        <div class="d-flex justify-content-between" style="margin: 30px 0;">
+            <div>
+                {% if first_page %}<a class="btn btn-secondary" href="{{ first_page }}">First page</a>{% endif %}
+                {% if has_previous and page.first %}<a class="btn btn-secondary" href="{{ page_link(page.first, 'before') }}">Previous page</a>{% endif %}
+            </div>
+            {% if page.more and page.last %}<a class="btn btn-secondary" href="{{ page_link(page.last, 'after') }}">Next page</a>{% endif %}
+        </div>
     </div>
     <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
 </body>
 
 </html>
-''', stats=session_stats, records=session_records)
+''', stats=session_stats, records=session_records, page_size=page_size, arguments=arguments,
+       page_link=page_link, has_previous=has_previous, has_next=backward,
+       first_page=url_for('sessions', **arguments) if has_previous else None)
+
+def parse_time_filter(name):
+    """Parse an ISO 8601 time from the query string as naive UTC, aborting with 400 if it is invalid."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f'Invalid {name} time')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+def mouse_movement_filters():
+    """Return the /mouse-movement filters given in the query string and the conditions they select attempts by."""
+    filters = {name: request.args[name] for name in ('success', 'since', 'until', 'session') if request.args.get(name)}
+    # Only completed attempts have a mouse path
+    conditions = [CAPTCHA_Attempt.completed_at.isnot(None)]
+    if 'success' in filters:
+        if filters['success'] not in ('0', '1'):
+            abort(400, 'Invalid success filter')
+        conditions.append(CAPTCHA_Attempt.success == (filters['success'] == '1'))
+    since = parse_time_filter('since')
+    if since is not None:
+        conditions.append(CAPTCHA_Attempt.completed_at >= since)
+    until = parse_time_filter('until')
+    if until is not None:
+        conditions.append(CAPTCHA_Attempt.completed_at < until)
+    if 'session' in filters:
+        conditions.append(CAPTCHA_Attempt.session_id == filters['session'])
+    return filters, conditions
+
+def attempt_paths(keys):
+    """Load the mouse paths of the (attempt id, completed_at) pairs, newest attempt first."""
+    return read_session.query(
+        CAPTCHA_Attempt.id, CAPTCHA_Attempt.completed_at,
+        CAPTCHA_Attempt.mouse_trajectory, CAPTCHA_Attempt.mouse_movements, CAPTCHA_Attempt.success
+    ).filter(CAPTCHA_Attempt.id.in_([attempt_id for attempt_id, _ in keys])).order_by(CAPTCHA_Attempt.id.desc()).all()
+
+def render_missing_thumbnails(keys):
+    """Render the thumbnails of the (attempt id, completed_at) pairs that are not cached yet, in one batch."""
+    missing = thumbnail_renderer.missing(keys)
+    if missing:
+        thumbnail_renderer.render(attempt_paths(missing))
+
+@app.route('/mouse-movement/<int:attempt_id>.png')
+def mouse_movement_thumbnail(attempt_id):
+    """Return the mouse path thumbnail of an attempt."""
+    key = read_session.query(CAPTCHA_Attempt.id, CAPTCHA_Attempt.completed_at).filter(
+        CAPTCHA_Attempt.id == attempt_id, CAPTCHA_Attempt.completed_at.isnot(None)
+    ).first()
+    if key is None:
+        abort(404)
+    render_missing_thumbnails([tuple(key)])
+    _, thumbnail = thumbnail_renderer.cache.get(*key)
+    if thumbnail is None:
+        abort(404)
+    response = Response(thumbnail, mimetype='image/png')
+    # The URL carries the attempt's completion time, which changes if its CAPTCHA is checked again
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
 
 @app.route('/mouse-movement')
 def mouse_movement():
-    """Show the mouse path of attempts."""
-    # Fetch attempt data from the database
-    results = db.session.execute(
-        db.select(
-            func.sum(CAPTCHA_Analytics.captchas_generated),
-            func.sum(CAPTCHA_Analytics.captchas_solved),
-            func.sum(CAPTCHA_Analytics.captchas_failed)
-        )
-    ).first()
-
-    total_pcaptchas_generated, total_pcaptchas_solved, total_pcaptchas_failed = results
-    total_pcaptchas_regenerated = total_pcaptchas_generated - (total_pcaptchas_solved + total_pcaptchas_failed)
+    """Show the mouse path of attempts, newest first, one page at a time."""
+    totals = rollup_totals()
+    total_pcaptchas_solved = totals['solved']
+    total_pcaptchas_failed = totals['failed']
+    total_pcaptchas_regenerated = totals['generated'] - (total_pcaptchas_solved + total_pcaptchas_failed)
+
+    filters, conditions = mouse_movement_filters()
+    page_size = app.config['PCAPTCHA_MOUSE_MOVEMENT_PAGE_SIZE']
+    before = request.args.get('before', type=int)
+    if before is not None:
+        conditions.append(CAPTCHA_Attempt.id < before)
+
+    # Keyset pagination: walk the primary key down from the last attempt of the previous page
+    keys = [tuple(key) for key in read_session.query(CAPTCHA_Attempt.id, CAPTCHA_Attempt.completed_at)
+            .filter(*conditions)
+            .order_by(CAPTCHA_Attempt.id.desc())
+            .limit(page_size + 1)]
+    older = keys[page_size - 1][0] if len(keys) > page_size else None
+    keys = keys[:page_size]
 
-    # Fetch mouse movement data
-    mouse_and_success_data = db.session.execute(db.select(CAPTCHA_Attempt.mouse_movements, CAPTCHA_Attempt.success)).all()
-    
-    # Loop through mouse
     images = []
-
-    # Create a pool of workers
-    with multiprocessing.Pool() as pool:
-        # Process the data in parallel
-        results = pool.map(process_mouse_movement, mouse_and_success_data)
-
-    # Filter out None results and append valid images
-    images = [image for image in results if image is not None]
+    if app.config['PCAPTCHA_THUMBNAIL_FORMAT'] == 'svg':
+        # The browser draws the paths, so nothing is rasterized or cached here
+        for row in attempt_paths(keys):
+            svg = svg_thumbnail(*row[2:], style=app.config['PCAPTCHA_THUMBNAIL_STYLE'])
+            if svg is not None:
+                images.append({'svg': Markup(svg)})
+    else:
+        render_missing_thumbnails(keys)
+        for attempt_id, completed_at in keys:
+            found, thumbnail = thumbnail_renderer.cache.get(attempt_id, completed_at)
+            # Skip attempts without a path; one checked again meanwhile is left to the thumbnail route
+            if found and thumbnail is None:
+                continue
+            images.append({'url': url_for('mouse_movement_thumbnail', attempt_id=attempt_id,
+                                          v=int(completed_at.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000))})
+
+    pages = {
+        'newer': url_for('mouse_movement', **filters) if before is not None else None,
+        'older': url_for('mouse_movement', before=older, **filters) if older is not None else None,
+    }
 
     return render_template_string('''
 <!DOCTYPE html>
@@ -452,6 +635,7 @@ def mouse_movement():
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css">
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css">
     <link rel="stylesheet" href="assets/css/Navbar-Right-Links-Dark-icons.css">
+    <style>.thumbnail img, .thumbnail svg { width: 100%; height: auto; }</style>
 </head>
 
 <body style="background: var(--bs-secondary-text-emphasis);">
@@ -465,6 +649,7 @@ def mouse_movement():
                     <li class="nav-item"><a class="nav-link" href="/">Overview</a></li>
                     <li class="nav-item"><a class="nav-link" href="/sessions">Sessions</a></li>
                     <li class="nav-item"><a class="nav-link active" href="/mouse-movement">Mouse Movement</a></li>
+                    <li class="nav-item"><a class="nav-link" href="/heatmap">Heatmap</a></li>
                 </ul>
             </div>
         </div>
@@ -513,13 +698,40 @@ def mouse_movement():
             </div>
         </div>
     </div>
+    <div class="container" style="margin-top: 30px;">
+        <form class="row g-2 align-items-end" method="get" action="/mouse-movement" style="color: var(--bs-body-bg);">
+            <div class="col-md-2">
+                <label class="form-label" for="success">Outcome</label>
+                <select class="form-select" id="success" name="success">
+                    <option value="">Any</option>
+                    <option value="1" {% if filters.success == '1' %}selected{% endif %}>Solved</option>
+                    <option value="0" {% if filters.success == '0' %}selected{% endif %}>Failed</option>
+                </select>
+            </div>
+            <div class="col-md-3">
+                <label class="form-label" for="since">Completed since (GMT)</label>
+                <input class="form-control" type="datetime-local" id="since" name="since" value="{{ filters.since }}">
+            </div>
+            <div class="col-md-3">
+                <label class="form-label" for="until">Completed before (GMT)</label>
+                <input class="form-control" type="datetime-local" id="until" name="until" value="{{ filters.until }}">
+            </div>
+            <div class="col-md-3">
+                <label class="form-label" for="session">Session ID</label>
+                <input class="form-control" type="text" id="session" name="session" value="{{ filters.session }}">
+            </div>
+            <div class="col-md-1">
+                <button class="btn btn-primary w-100" type="submit">Filter</button>
+            </div>
+        </form>
+    </div>
     <div class="container">
         <div class="row" style="margin-top: 30px;">
             {% for image in images %}
                 <div class="col-md-4">
                     <div class="card" style="background-color: var(--bs-body-color);">
-                        <div class="card-body text-center">
-                            <img src="data:image/png;base64,{{ image }}" style="width: 100%; height: auto;">
+                        <div class="card-body text-center thumbnail">
+                            {% if image.svg %}{{ image.svg }}{% else %}<img src="{{ image.url }}" loading="lazy" width="250" height="250">{% endif %}
                         </div>
                     </div>
                 </div>
@@ -528,16 +740,129 @@ def mouse_movement():
                 {% endif %}
             {% endfor %}
         </div>
+        <div class="d-flex justify-content-between" style="margin: 30px 0;">
+            {% if pages.newer %}<a class="btn btn-secondary" href="{{ pages.newer }}">Newest</a>{% else %}<span></span>{% endif %}
+            {% if pages.older %}<a class="btn btn-secondary" href="{{ pages.older }}">Older</a>{% endif %}
+        </div>
+    </div>
+    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
+</body>
+
+</html>
+''', images=images, filters=filters, pages=pages)
+
+def heatmap_filters():
+    """Return the outcome and completion time range the heatmap is filtered by."""
+    success = request.args.get('success', '')
+    if success not in ('', '0', '1'):
+        abort(400, 'Invalid success filter')
+    return (success == '1') if success else None, parse_time_filter('since'), parse_time_filter('until')
+
+@app.route('/heatmap.png')
+def heatmap_image():
+    """Return where the mouse paths of the attempts completed in a time range went, as a heatmap."""
+    success, since, until = heatmap_filters()
+    grid, _ = load_heatmap(read_session.connection(), success, since, until)
+    response = Response(render_heatmap(grid), mimetype='image/png')
+    response.headers['Cache-Control'] = 'private, max-age=60'
+    return response
+
+@app.route('/heatmap')
+def heatmap():
+    """Show the heatmaps of all, solved and failed attempts."""
+    heatmap_filters()
+    filters = {name: request.args[name] for name in ('since', 'until') if request.args.get(name)}
+    images = [
+        ('All Attempts', url_for('heatmap_image', **filters)),
+        ('Solved', url_for('heatmap_image', success='1', **filters)),
+        ('Failed', url_for('heatmap_image', success='0', **filters)),
+    ]
+    return render_template_string('''
+<!DOCTYPE html>
+<html data-bs-theme="light" lang="en">
+
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0, shrink-to-fit=no">
+    <title>pCAPTCHA</title>
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css">
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css">
+</head>
+
+<body style="background: var(--bs-secondary-text-emphasis);">
+    <nav class="navbar navbar-expand-md bg-dark py-3" data-bs-theme="dark">
+        <div class="container"><a class="navbar-brand d-flex align-items-center" href="/"><span class="bs-icon-sm bs-icon-rounded bs-icon-primary d-flex justify-content-center align-items-center me-2 bs-icon"><svg xmlns="http://www.w3.org/2000/svg" width="1em" height="1em" fill="currentColor" viewBox="0 0 16 16" class="bi bi-robot">
+                        <path d="M6 12.5a.5.5 0 0 1 .5-.5h3a.5.5 0 0 1 0 1h-3a.5.5 0 0 1-.5-.5M3 8.062C3 6.76 4.235 5.765 5.53 5.886a26.58 26.58 0 0 0 4.94 0C11.765 5.765 13 6.76 13 8.062v1.157a.933.933 0 0 1-.765.935c-.845.147-2.34.346-4.235.346-1.895 0-3.39-.2-4.235-.346A.933.933 0 0 1 3 9.219zm4.542-.827a.25.25 0 0 0-.217.068l-.92.9a24.767 24.767 0 0 1-1.871-.183.25.25 0 0 0-.068.495c.55.076 1.232.149 2.02.193a.25.25 0 0 0 .189-.071l.754-.736.847 1.71a.25.25 0 0 0 .404.062l.932-.97a25.286 25.286 0 0 0 1.922-.188.25.25 0 0 0-.068-.495c-.538.074-1.207.145-1.98.189a.25.25 0 0 0-.166.076l-.754.785-.842-1.7a.25.25 0 0 0-.182-.135Z"></path>
+                        <path d="M8.5 1.866a1 1 0 1 0-1 0V3h-2A4.5 4.5 0 0 0 1 7.5V8a1 1 0 0 0-1 1v2a1 1 0 0 0 1 1v1a2 2 0 0 0 2 2h10a2 2 0 0 0 2-2v-1a1 1 0 0 0 1-1V9a1 1 0 0 0-1-1v-.5A4.5 4.5 0 0 0 10.5 3h-2zM14 7.5V13a1 1 0 0 1-1 1H3a1 1 0 0 1-1-1V7.5A3.5 3.5 0 0 1 5.5 4h5A3.5 3.5 0 0 1 14 7.5"></path>
+                    </svg></span><span>pCAPTCHA Dashboard</span></a><button data-bs-toggle="collapse" class="navbar-toggler" data-bs-target="#navcol-5"><span class="visually-hidden">Toggle navigation</span><span class="navbar-toggler-icon"></span></button>
+            <div class="collapse navbar-collapse" id="navcol-5">
+                <ul class="navbar-nav ms-auto">
+                    <li class="nav-item"><a class="nav-link" href="/">Overview</a></li>
+                    <li class="nav-item"><a class="nav-link" href="/sessions">Sessions</a></li>
+                    <li class="nav-item"><a class="nav-link" href="/mouse-movement">Mouse Movement</a></li>
+                    <li class="nav-item"><a class="nav-link active" href="/heatmap">Heatmap</a></li>
+                </ul>
+            </div>
+        </div>
+    </nav>
+    <div class="container" style="margin-top: 30px;">
+        <form class="row g-2 align-items-end" method="get" action="/heatmap" style="color: var(--bs-body-bg);">
+            <div class="col-md-5">
+                <label class="form-label" for="since">Completed since (GMT)</label>
+                <input class="form-control" type="datetime-local" id="since" name="since" value="{{ filters.since }}">
+            </div>
+            <div class="col-md-5">
+                <label class="form-label" for="until">Completed before (GMT)</label>
+                <input class="form-control" type="datetime-local" id="until" name="until" value="{{ filters.until }}">
+            </div>
+            <div class="col-md-2">
+                <button class="btn btn-primary w-100" type="submit">Filter</button>
+            </div>
+        </form>
+        <div class="row" style="margin-top: 30px;">
+            {% for title, image in images %}
+                <div class="col-md-4">
+                    <div class="card" style="background: var(--bs-body-color);color: var(--bs-body-bg);margin-bottom: 30px;">
+                        <div class="card-body text-center">
+                            <h4 class="card-title">{{ title }}</h4>
+                            <img src="{{ image }}" width="250" height="250" style="width: 100%; height: auto; image-rendering: pixelated;">
+                        </div>
+                    </div>
+                </div>
+            {% endfor %}
+        </div>
     </div>
     <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js"></script>
 </body>
 
 </html>
-''', images=images)
+''', images=images, filters=filters)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the hourly and daily analytics rollups from the raw history."""
+    with db.engine.begin() as connection:
+        rows = rebuild_rollups(connection)
+    print(f'Rebuilt {rows} rollup rows')
+
+@app.cli.command('build-heatmaps')
+def build_heatmaps_command():
+    """Bin the mouse paths of every settled hour that has no heatmap yet, which the CAPTCHA app's reaper also does."""
+    settled = datetime.datetime.utcnow() - CAPTCHA_LIFETIME
+    grids = 0
+    while True:
+        with db.engine.begin() as connection:
+            built = build_heatmaps(connection, settled)
+        if not built:
+            break
+        grids += built
+    print(f'Built {grids} heatmap grids')
+
+# Database and app initialization, on import so that serve.py's workers migrate too
+with app.app_context():
+    db.create_all()
+    migrate(db.engine, app.logger)
 
 if __name__ == '__main__':
-    # Create the database tables
-    with app.app_context():
-        db.create_all()
     # Run the Flask app
     app.run(host='0.0.0.0', port=5010, debug=True)
\ No newline at end of file
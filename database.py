@@ -0,0 +1,111 @@
+import os
+import sqlite3
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session, sessionmaker
+from models import db
+
+# Database settings and their defaults, each can be overridden by an environment variable of the same name
+DATABASE_DEFAULTS = {
+    'PCAPTCHA_DATABASE_URI': 'sqlite:///captchas.db',
+    'PCAPTCHA_READ_DATABASE_URI': None,
+    'PCAPTCHA_DB_POOL_SIZE': 5,
+    'PCAPTCHA_DB_MAX_OVERFLOW': 10,
+    'PCAPTCHA_DB_POOL_PRE_PING': True,
+    'PCAPTCHA_SQLITE_BUSY_TIMEOUT': 5000,
+    'PCAPTCHA_SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+}
+
+
+def _from_environment(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    return value
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _engine_options(app, url):
+    """Pool options for the URI, leaving SQLite in-memory databases on their static pool."""
+    if _is_memory_sqlite(url):
+        return {}
+    return {
+        'pool_size': app.config['PCAPTCHA_DB_POOL_SIZE'],
+        'max_overflow': app.config['PCAPTCHA_DB_MAX_OVERFLOW'],
+        'pool_pre_ping': app.config['PCAPTCHA_DB_POOL_PRE_PING'],
+    }
+
+
+def sqlite_pragmas(app, read_only=False):
+    """Return a connect listener tuning every new SQLite connection."""
+    busy_timeout = app.config['PCAPTCHA_SQLITE_BUSY_TIMEOUT']
+    mmap_size = app.config['PCAPTCHA_SQLITE_MMAP_SIZE']
+
+    def on_connect(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+        cursor.execute(f'PRAGMA mmap_size = {int(mmap_size)}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        else:
+            # WAL lets readers carry on while a writer commits
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.close()
+
+    return on_connect
+
+
+def configure_database(app):
+    """Configure the database from app.config or the environment and bind it to the app."""
+    for name, default in DATABASE_DEFAULTS.items():
+        app.config.setdefault(name, _from_environment(name, default))
+
+    url = make_url(app.config['PCAPTCHA_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', app.config['PCAPTCHA_DATABASE_URI'])
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', _engine_options(app, url))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', sqlite_pragmas(app))
+
+
+def create_read_session(app):
+    """Return a scoped session for read-only queries, on its own engine where possible."""
+    with app.app_context():
+        write_engine = db.engine
+
+    read_uri = app.config['PCAPTCHA_READ_DATABASE_URI']
+    if read_uri:
+        url = make_url(read_uri)
+        engine = create_engine(url, **_engine_options(app, url))
+    elif write_engine.dialect.name == 'sqlite' and not _is_memory_sqlite(write_engine.url):
+        # Open the same SQLite file read-only so dashboard reads never take the write lock
+        path = os.path.abspath(write_engine.url.database)
+        url = make_url(f'sqlite:///file:{path}?mode=ro&uri=true')
+        engine = create_engine(url, **_engine_options(app, url))
+    else:
+        engine = write_engine
+
+    if engine is not write_engine and engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', sqlite_pragmas(app, read_only=True))
+
+    read_session = scoped_session(sessionmaker(bind=engine))
+
+    @app.teardown_appcontext
+    def remove_read_session(exception=None):
+        read_session.remove()
+
+    return read_session
@@ -0,0 +1,242 @@
+import datetime
+import io
+import zlib
+import numpy as np
+from PIL import Image
+from sqlalchemy import func, insert, or_, select
+from models import CAPTCHA_Attempt, CAPTCHA_Heatmap
+from thumbnails import THUMBNAIL_SIZE, load_trajectory
+
+# A heatmap has a cell per pixel of the puzzle
+GRID_SIZE = THUMBNAIL_SIZE
+
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def ceil_hour(moment):
+    start = floor_hour(moment)
+    return start if start == moment.replace(tzinfo=None) else start + HOUR
+
+
+def floor_day(moment):
+    return floor_hour(moment).replace(hour=0)
+
+
+def ceil_day(moment):
+    start = floor_day(moment)
+    return start if start == moment.replace(tzinfo=None) else start + DAY
+
+
+def histogram(x, y):
+    """Count the points falling on each cell of the grid, ignoring those off the puzzle.
+
+    The same as np.histogram2d(y, x) with one bin per pixel, which integer coordinates
+    allow to compute with a single bincount over the flattened cell indices.
+    """
+    x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+    inside = (x >= 0) & (x < GRID_SIZE) & (y >= 0) & (y < GRID_SIZE)
+    cells = y[inside] * GRID_SIZE + x[inside]
+    return np.bincount(cells, minlength=GRID_SIZE * GRID_SIZE).reshape(GRID_SIZE, GRID_SIZE)
+
+
+def encode_grid(grid):
+    """Pack a grid of counts as zlib-compressed little-endian uint32s."""
+    return zlib.compress(np.ascontiguousarray(grid, dtype='<u4').tobytes())
+
+
+def decode_grid(data):
+    """Unpack bytes from encode_grid() into an int64 grid, ready to be summed."""
+    return np.frombuffer(zlib.decompress(data), dtype='<u4').reshape(GRID_SIZE, GRID_SIZE).astype(np.int64)
+
+
+def bin_paths(rows):
+    """Return the number of (mouse_trajectory, mouse_movements) rows and the histogram of all their points."""
+    xs, ys = [], []
+    attempts = 0
+    for mouse_trajectory, mouse_movements in rows:
+        attempts += 1
+        trajectory = load_trajectory(mouse_trajectory, mouse_movements)
+        if trajectory is not None:
+            xs.append(trajectory.x)
+            ys.append(trajectory.y)
+    if not xs:
+        return attempts, np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int64)
+    return attempts, histogram(np.concatenate(xs), np.concatenate(ys))
+
+
+def _hourly_grids(rows):
+    """Bin (completed_at, mouse_trajectory, mouse_movements) rows ordered by completion time into (hour, attempts, grid)."""
+    hour = None
+    paths = []
+    for completed_at, mouse_trajectory, mouse_movements in rows:
+        start = floor_hour(completed_at)
+        if start != hour:
+            if paths:
+                yield (hour, *bin_paths(paths))
+            hour, paths = start, []
+        paths.append((mouse_trajectory, mouse_movements))
+    if paths:
+        yield (hour, *bin_paths(paths))
+
+
+def _first_completion(connection, since):
+    """Return when the first attempt completed at or after `since` was completed, or None."""
+    firsts = []
+    # One query per outcome, so each walks the (success, completed_at) index
+    for success in (True, False):
+        query = select(func.min(CAPTCHA_Attempt.completed_at)).where(CAPTCHA_Attempt.success == success)
+        if since is not None:
+            query = query.where(CAPTCHA_Attempt.completed_at >= since)
+        first = connection.execute(query).scalar()
+        if first is not None:
+            firsts.append(first)
+    return min(firsts, default=None)
+
+
+def _built_until(connection, period):
+    """Return the end of the last built grid of the period, or None if there is none."""
+    start = connection.execute(select(func.max(CAPTCHA_Heatmap.start)).where(CAPTCHA_Heatmap.period == period)).scalar()
+    if start is None:
+        return None
+    return start + (HOUR if period == 'hour' else DAY)
+
+
+def build_heatmaps(connection, until, max_hours=24 * 7, batch_size=1000):
+    """Bin the attempts of the hours before `until` that have no heatmap yet, then sum the days they complete.
+
+    Grids are only built for whole hours no attempt can be rewritten in any more, so `until`
+    must be far enough in the past for every CAPTCHA completed before it to have expired.
+    At most `max_hours` are built per call. Returns the number of grids written.
+    """
+    first = _first_completion(connection, _built_until(connection, 'hour'))
+    if first is None:
+        return 0
+    start = floor_hour(first)
+    end = min(floor_hour(until), start + max_hours * HOUR)
+    if start >= end:
+        return 0
+
+    rows = []
+    streaming = connection.execution_options(yield_per=batch_size)
+    for success in (True, False):
+        attempts = streaming.execute(
+            select(CAPTCHA_Attempt.completed_at, CAPTCHA_Attempt.mouse_trajectory, CAPTCHA_Attempt.mouse_movements)
+            .where(CAPTCHA_Attempt.success == success,
+                   CAPTCHA_Attempt.completed_at >= start,
+                   CAPTCHA_Attempt.completed_at < end)
+            .order_by(CAPTCHA_Attempt.completed_at)
+        )
+        for hour, count, grid in _hourly_grids(attempts):
+            rows.append({'period': 'hour', 'start': hour, 'success': success,
+                         'attempts': count, 'points': int(grid.sum()), 'grid': encode_grid(grid)})
+    if rows:
+        connection.execute(insert(CAPTCHA_Heatmap), rows)
+    return len(rows) + _build_days(connection, floor_day(end))
+
+
+def _build_days(connection, until):
+    """Sum the hourly grids of every day before `until` without a daily grid yet."""
+    query = select(CAPTCHA_Heatmap.start, CAPTCHA_Heatmap.success, CAPTCHA_Heatmap.attempts,
+                   CAPTCHA_Heatmap.points, CAPTCHA_Heatmap.grid
+                   ).where(CAPTCHA_Heatmap.period == 'hour', CAPTCHA_Heatmap.start < until)
+    days_built = _built_until(connection, 'day')
+    if days_built is not None:
+        query = query.where(CAPTCHA_Heatmap.start >= days_built)
+
+    days = {}
+    for start, success, attempts, points, grid in connection.execute(query):
+        day = days.setdefault((floor_day(start), success), [0, 0, 0])
+        day[0] += attempts
+        day[1] += points
+        day[2] = day[2] + decode_grid(grid)
+    rows = [
+        {'period': 'day', 'start': start, 'success': success, 'attempts': attempts, 'points': points, 'grid': encode_grid(grid)}
+        for (start, success), (attempts, points, grid) in days.items()
+    ]
+    if rows:
+        connection.execute(insert(CAPTCHA_Heatmap), rows)
+    return len(rows)
+
+
+def load_heatmap(connection, success=None, since=None, until=None, batch_size=1000):
+    """Sum the heatmap of the attempts completed in the hours from `since` to `until` and return (grid, attempts).
+
+    `success` selects solved (True) or failed (False) attempts, or both (None). Daily grids
+    are used for whole days, hourly grids for the rest, and attempts that have no grid yet
+    are binned on the spot.
+    """
+    since = floor_hour(since) if since is not None else None
+    until = ceil_hour(until if until is not None else datetime.datetime.now(datetime.timezone.utc))
+    grid = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int64)
+    attempts = 0
+
+    def add(query):
+        nonlocal grid, attempts
+        if success is not None:
+            query = query.where(CAPTCHA_Heatmap.success == success)
+        for count, data in connection.execute(query):
+            grid += decode_grid(data)
+            attempts += count
+
+    grids = select(CAPTCHA_Heatmap.attempts, CAPTCHA_Heatmap.grid)
+    hours_built = _built_until(connection, 'hour')
+    if hours_built is not None:
+        hours_end = min(until, hours_built)
+        hour_grids = grids.where(CAPTCHA_Heatmap.period == 'hour', CAPTCHA_Heatmap.start < hours_end)
+        if since is not None:
+            hour_grids = hour_grids.where(CAPTCHA_Heatmap.start >= since)
+
+        # Whole days inside the range come from their daily grids, as far as those are built
+        days_built = _built_until(connection, 'day')
+        days_start = ceil_day(since) if since is not None else None
+        days_end = min(floor_day(until), days_built) if days_built is not None else None
+        if days_end is not None and (days_start is None or days_start < days_end):
+            day_grids = grids.where(CAPTCHA_Heatmap.period == 'day', CAPTCHA_Heatmap.start < days_end)
+            if days_start is not None:
+                day_grids = day_grids.where(CAPTCHA_Heatmap.start >= days_start)
+                hour_grids = hour_grids.where(or_(CAPTCHA_Heatmap.start < days_start, CAPTCHA_Heatmap.start >= days_end))
+            else:
+                hour_grids = hour_grids.where(CAPTCHA_Heatmap.start >= days_end)
+            add(day_grids)
+        add(hour_grids)
+
+    # Attempts completed after the last hourly grid are binned on the spot
+    tail_start = max(since, hours_built) if since is not None and hours_built is not None else since or hours_built
+    if tail_start is None or tail_start < until:
+        query = select(CAPTCHA_Attempt.mouse_trajectory, CAPTCHA_Attempt.mouse_movements).where(
+            CAPTCHA_Attempt.completed_at < until
+        )
+        if tail_start is not None:
+            query = query.where(CAPTCHA_Attempt.completed_at >= tail_start)
+        if success is not None:
+            query = query.where(CAPTCHA_Attempt.success == success)
+        rows = connection.execution_options(yield_per=batch_size).execute(query)
+        for batch in rows.partitions():
+            count, batch_grid = bin_paths(batch)
+            grid += batch_grid
+            attempts += count
+    return grid, attempts
+
+
+def heatmap_palette():
+    """Return 256 colors going from black through red and yellow to white, as a uint8 array."""
+    level = np.linspace(0.0, 3.0, 256)
+    return np.rint(np.clip(np.column_stack((level, level - 1, level - 2)), 0, 1) * 255).astype(np.uint8)
+
+
+def render_heatmap(grid):
+    """Draw a grid of counts as a PNG, on a log scale so rarely visited cells still show."""
+    scaled = np.log1p(grid.astype(np.float64))
+    top = scaled.max()
+    indices = np.rint(scaled / top * 255) if top else scaled
+    image = Image.fromarray(indices.astype(np.uint8), mode='P')
+    image.putpalette(heatmap_palette().tobytes())
+    buf = io.BytesIO()
+    # Heatmaps are noisy and compress little better at higher levels, only slower
+    image.save(buf, format='PNG', compress_level=1)
+    return buf.getvalue()
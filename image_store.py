@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ImageStore:
+    """Keeps the encoded images of a puzzle, keyed by captcha id, until they expire."""
+
+    def put(self, key, images):
+        """Store a puzzle's images, a mapping of mimetype to encoded bytes."""
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return (images, seconds left) or None if missing or expired."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def add_encoding(self, key, mimetype, data):
+        """Keep an encoding made after the puzzle was stored, until the puzzle expires.
+
+        Optional: a store that does not keep them has the encoding made again on every request.
+        """
+
+
+class MemoryImageStore(ImageStore):
+    """In-process image store where every entry lives for the same fixed time.
+
+    At most `max_bytes` of images are kept; past that the oldest puzzles are dropped first,
+    even before they expire.
+    """
+
+    def __init__(self, ttl, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evicted = 0
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def put(self, key, images):
+        now = time.monotonic()
+        size = self._size(images)
+        with self._lock:
+            self._purge(now)
+            self._pop(key)
+            self._images[key] = (now + self.ttl, images)
+            self._bytes += size
+            self._evict()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._images.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        expires_at, images = entry
+        return images, expires_at - now
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def add_encoding(self, key, mimetype, data):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None or mimetype in entry[1]:
+                return
+            # A new mapping, so a reader of the old one never sees it change
+            self._images[key] = (entry[0], {**entry[1], mimetype: data})
+            self._bytes += len(data)
+            self._evict()
+
+    def purge(self):
+        """Drop every expired image and return how many were removed."""
+        with self._lock:
+            return self._purge(time.monotonic())
+
+    def stats(self):
+        """Return the store size in puzzles and bytes, and how many were evicted before expiring."""
+        with self._lock:
+            return {'puzzles': len(self._images), 'bytes': self._bytes, 'max_bytes': self.max_bytes, 'evicted': self.evicted}
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._images) > 1:
+            self._pop(next(iter(self._images)))
+            self.evicted += 1
+
+    def _pop(self, key):
+        entry = self._images.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._size(entry[1])
+
+    def _purge(self, now):
+        # Entries share one TTL, so insertion order is also expiry order
+        removed = 0
+        while self._images:
+            key, (expires_at, _) = next(iter(self._images.items()))
+            if expires_at > now:
+                break
+            self._pop(key)
+            removed += 1
+        return removed
+
+    @staticmethod
+    def _size(images):
+        return sum(len(data) for data in images.values())
@@ -1,65 +1,269 @@
 import os
-import random
-import datetime
-import jwt
-import requests
-import random
+import atexit
+import base64
+import importlib
+import json
+import math
+import threading
 import uuid
-from io import BytesIO
 from flask import Flask, jsonify, request, Response, session
-from PIL import Image, ImageDraw, ImageFilter
-from models import db, CAPTCHA, CAPTCHA_Analytics, CAPTCHA_Attempt
+from werkzeug.middleware.proxy_fix import ProxyFix
+from models import db, use_captcha, CAPTCHA, CAPTCHA_LIFETIME
+from analytics_writer import AnalyticsWriter
+from database import configure_database
+from migrations import migrate
+from challenge import ChallengeCodec, InvalidChallenge, ReplayFilter
+from backgrounds import create_background_source
+from image_store import MemoryImageStore
+from puzzle_pool import PuzzlePool
+from ratelimit import MemoryRateLimitStore, RateLimiter
+from reaper import Reaper
+from tokens import MemoryUsedTokenStore, TokenError, TokenVerifier
+from render_pool import RenderPool
+from pcaptcha_js import ScriptCache
+from trajectory import parse_movements, parse_packed_path, simplify
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///captchas.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
+configure_database(app)
 
 # Change both of these and keep them secure
 app.secret_key = 'your_secret_key' # Secret key for the Flask app
 SECRET_KEY = 'your_secret_key' # Secret key for JWT encoding/decoding
 
-# List of neon colors for the puzzle piece
-neon_colors = [
-    (255, 0, 0, 200),     # Neon Red
-    (0, 255, 0, 200),     # Neon Green
-    (0, 0, 255, 200),     # Neon Blue
-    (255, 255, 0, 200),   # Neon Yellow
-    (255, 0, 255, 200),   # Neon Pink
-    (0, 255, 255, 200),   # Neon Cyan
-    (255, 165, 0, 200),   # Neon Orange
-    (255, 20, 147, 200),  # Neon Hot Pink
-    (191, 255, 0, 200),   # Neon Lime
-    (57, 255, 20, 200),   # Neon Green 2
-    (255, 105, 180, 200), # Neon Hot Pink 2
-    (127, 255, 0, 200),   # Neon Chartreuse
-    (0, 191, 255, 200),   # Neon Sky Blue
-    (255, 69, 0, 200),    # Neon Orange Red
-    (255, 0, 127, 200),   # Neon Deep Pink
-    (199, 21, 133, 200),  # Neon Medium Violet Red
-    (32, 178, 170, 200),  # Neon Light Sea Green
-    (173, 255, 47, 200),  # Neon Green Yellow
-    (100, 149, 237, 200), # Neon Cornflower Blue
-    (0, 255, 127, 200),   # Neon Spring Green
-    (220, 20, 60, 200),   # Neon Crimson
-    (148, 0, 211, 200),   # Neon Dark Violet
-    (255, 215, 0, 200),   # Neon Gold
-    (238, 130, 238, 200), # Neon Violet
-    (64, 224, 208, 200),  # Neon Turquoise
-    (144, 238, 144, 200), # Neon Light Green
-    (186, 85, 211, 200),  # Neon Medium Orchid
-    (0, 206, 209, 200),   # Neon Dark Turquoise
-    (123, 104, 238, 200), # Neon Medium Slate Blue
-    (255, 140, 0, 200)    # Neon Dark Orange
-]
+# Background images: an optional local directory or tarball decoded once into memory,
+# refilled from the remote source every N picks (or whenever the cache is empty). With a
+# local corpus there is no remote source unless PCAPTCHA_BACKGROUND_URL is set explicitly.
+app.config['PCAPTCHA_BACKGROUND_PATH'] = os.environ.get('PCAPTCHA_BACKGROUND_PATH')
+app.config['PCAPTCHA_BACKGROUND_CACHE_BYTES'] = 64 * 1024 * 1024
+app.config['PCAPTCHA_BACKGROUND_URL'] = os.environ.get(
+    'PCAPTCHA_BACKGROUND_URL', None if app.config['PCAPTCHA_BACKGROUND_PATH'] else 'https://picsum.photos/250'
+)
+app.config['PCAPTCHA_BACKGROUND_TIMEOUT'] = 5.0
+app.config['PCAPTCHA_BACKGROUND_REFILL_EVERY'] = int(os.environ.get(
+    'PCAPTCHA_BACKGROUND_REFILL_EVERY', 0 if app.config['PCAPTCHA_BACKGROUND_PATH'] else 10
+))
+
+background_settings = {
+    'path': app.config['PCAPTCHA_BACKGROUND_PATH'],
+    'max_bytes': app.config['PCAPTCHA_BACKGROUND_CACHE_BYTES'],
+    'url': app.config['PCAPTCHA_BACKGROUND_URL'],
+    'timeout': app.config['PCAPTCHA_BACKGROUND_TIMEOUT'],
+    'refill_every': app.config['PCAPTCHA_BACKGROUND_REFILL_EVERY'],
+}
+background_source = create_background_source(**background_settings)
+
+# Puzzle images are kept in memory for as long as their CAPTCHA is valid, up to
+# PCAPTCHA_IMAGE_STORE_BYTES (oldest dropped first). Set PCAPTCHA_IMAGE_STORE to a shared
+# ImageStore to serve them from several nodes, or PCAPTCHA_INLINE_IMAGES to embed them
+# in the JSON response as data URIs.
+app.config['PCAPTCHA_IMAGE_STORE'] = os.environ.get('PCAPTCHA_IMAGE_STORE')
+app.config['PCAPTCHA_IMAGE_STORE_BYTES'] = 64 * 1024 * 1024
+app.config['PCAPTCHA_INLINE_IMAGES'] = False
+
+memory_image_store = MemoryImageStore(CAPTCHA_LIFETIME.total_seconds(), app.config['PCAPTCHA_IMAGE_STORE_BYTES'])
+# Replaced by the configured store, if any, before every request (see configure_stores)
+image_store = memory_image_store
+
+# Puzzles are rendered in batches on PCAPTCHA_RENDER_PROCESSES worker processes
+# (0 renders in the web process itself)
+app.config['PCAPTCHA_RENDER_PROCESSES'] = int(os.environ.get('PCAPTCHA_RENDER_PROCESSES', 0))
+app.config['PCAPTCHA_RENDER_CHUNK_SIZE'] = 4
+
+# Every puzzle is encoded up front in each of PCAPTCHA_IMAGE_ENCODINGS (png, jpeg or webp) with
+# their Pillow save options. The PCAPTCHA_FALLBACK_ENCODINGS are only made the first time a client
+# that accepts none of those asks for a puzzle. Clients get the first format their Accept header
+# allows, or the last fallback otherwise.
+app.config['PCAPTCHA_IMAGE_ENCODINGS'] = {
+    'webp': {'quality': 80, 'method': 4},
+}
+app.config['PCAPTCHA_FALLBACK_ENCODINGS'] = {
+    'jpeg': {'quality': 85},
+}
+
+render_pool = RenderPool(
+    background_source,
+    background_settings,
+    processes=app.config['PCAPTCHA_RENDER_PROCESSES'],
+    chunk_size=app.config['PCAPTCHA_RENDER_CHUNK_SIZE'],
+    encodings=app.config['PCAPTCHA_IMAGE_ENCODINGS'],
+    fallback_encodings=app.config['PCAPTCHA_FALLBACK_ENCODINGS']
+)
+
+# Pre-rendered puzzle pool, refilled in batches once it drops to the low watermark
+app.config['PCAPTCHA_POOL_LOW_WATERMARK'] = 16
+app.config['PCAPTCHA_POOL_HIGH_WATERMARK'] = 64
+app.config['PCAPTCHA_POOL_BATCH_SIZE'] = 16
+
+puzzle_pool = PuzzlePool(
+    render_pool.generate_puzzles,
+    low_watermark=app.config['PCAPTCHA_POOL_LOW_WATERMARK'],
+    high_watermark=app.config['PCAPTCHA_POOL_HIGH_WATERMARK'],
+    batch_size=app.config['PCAPTCHA_POOL_BATCH_SIZE']
+)
+
+# Stateless mode: CAPTCHA IDs are encrypted challenge tokens holding the solution, so
+# checking a position needs no database read and works on any node sharing SECRET_KEY.
+# Used challenges are remembered in-process until they expire, which only stops replays with
+# a single process; set PCAPTCHA_REPLAY_STORE to a challenge.DatabaseReplayStore() (or
+# 'challenge:DatabaseReplayStore') to share them between workers and nodes.
+app.config['PCAPTCHA_STATELESS'] = False
+app.config['PCAPTCHA_REPLAY_STORE'] = os.environ.get('PCAPTCHA_REPLAY_STORE')
+
+challenge_codec = ChallengeCodec(SECRET_KEY, CAPTCHA_LIFETIME.total_seconds())
+replay_filter = ReplayFilter()
+# Replaced by the configured store, if any, before every request (see configure_stores)
+replay_store = replay_filter
+
+# Tokens for solved CAPTCHAs are bound to the client's IP and user agent, expire after
+# PCAPTCHA_TOKEN_LIFETIME seconds and verify only once. Used tokens are remembered in-process;
+# set PCAPTCHA_USED_TOKEN_STORE to a tokens.DatabaseUsedTokenStore() to share them between workers.
+app.config['PCAPTCHA_TOKEN_LIFETIME'] = 300
+app.config['PCAPTCHA_USED_TOKEN_STORE'] = os.environ.get('PCAPTCHA_USED_TOKEN_STORE')
+app.config['PCAPTCHA_USED_TOKEN_CACHE_SIZE'] = 100000
+app.config['PCAPTCHA_MAX_BULK_VERIFY'] = 1000
+
+memory_used_token_store = MemoryUsedTokenStore(app.config['PCAPTCHA_USED_TOKEN_CACHE_SIZE'])
+# Replaced by the configured store, if any, before every request (see configure_stores)
+used_token_store = memory_used_token_store
+token_verifier = TokenVerifier(SECRET_KEY, app.config['PCAPTCHA_TOKEN_LIFETIME'], used_token_store)
+
+# pCaptcha.js is compiled once and cached by browsers and CDNs. It sends its requests to
+# PCAPTCHA_BASE_URL, or when that is not set to the server it was loaded from. The Host
+# header never goes into it, since a shared cache could replay a script built from a forged one.
+app.config['PCAPTCHA_SCRIPT_MAX_AGE'] = 86400
+app.config['PCAPTCHA_BASE_URL'] = os.environ.get('PCAPTCHA_BASE_URL')
+
+script_cache = ScriptCache()
+
+# Limits on /check_position: the request body, the mouse path points accepted, and
+# how far the path is downsampled before it is stored
+app.config['PCAPTCHA_MAX_CHECK_BODY_BYTES'] = 256 * 1024
+app.config['PCAPTCHA_MAX_TRAJECTORY_POINTS'] = 5000
+app.config['PCAPTCHA_TRAJECTORY_POINTS'] = 256
+app.config['PCAPTCHA_TRAJECTORY_EPSILON'] = 1.0
+
+# Token bucket rate limits per endpoint, for each client IP, session and CAPTCHA, checked before
+# any image or database work. Buckets live in-process, so every worker allows the full limit; set
+# PCAPTCHA_RATE_LIMIT_STORE to a ratelimit.DatabaseRateLimitStore() (or 'ratelimit:DatabaseRateLimitStore')
+# to enforce the limits across workers and nodes.
+app.config['PCAPTCHA_RATE_LIMITS'] = {
+    'generate_puzzle_piece': {'ip': '60/minute', 'session': '30/minute'},
+    'puzzle_image': {'ip': '120/minute'},
+    'check_position': {'ip': '120/minute', 'session': '60/minute', 'captcha': '5/minute'},
+}
+app.config['PCAPTCHA_RATE_LIMIT_STORE'] = os.environ.get('PCAPTCHA_RATE_LIMIT_STORE')
+
+memory_rate_limit_store = MemoryRateLimitStore()
+# Its store is replaced by the configured one, if any, before every request (see configure_stores)
+rate_limiter = RateLimiter(app.config['PCAPTCHA_RATE_LIMITS'], memory_rate_limit_store)
+
+# Behind PCAPTCHA_TRUSTED_PROXIES reverse proxies or CDNs, the client IP that rate limits and tokens
+# are bound to is taken from that many X-Forwarded-For entries; with none the header is ignored,
+# since clients could forge it
+app.config['PCAPTCHA_TRUSTED_PROXIES'] = int(os.environ.get('PCAPTCHA_TRUSTED_PROXIES', 0))
+if app.config['PCAPTCHA_TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app, x_for=app.config['PCAPTCHA_TRUSTED_PROXIES'], x_proto=app.config['PCAPTCHA_TRUSTED_PROXIES']
+    )
+
+# Expired CAPTCHAs, puzzle images and used tokens are removed in the background
+app.config['PCAPTCHA_REAPER_INTERVAL'] = 60.0
+app.config['PCAPTCHA_REAPER_BATCH_SIZE'] = 500
+# With several worker processes only one of them needs to run the reaper (see serve.py)
+app.config['PCAPTCHA_RUN_REAPER'] = os.environ.get('PCAPTCHA_RUN_REAPER', '1') != '0'
+
+reaper = Reaper(
+    app,
+    interval=app.config['PCAPTCHA_REAPER_INTERVAL'],
+    batch_size=app.config['PCAPTCHA_REAPER_BATCH_SIZE'],
+    image_store=image_store,
+    used_token_store=used_token_store,
+    replay_store=replay_store,
+    rate_limit_store=rate_limiter.store
+)
+
+# Analytics events are queued and written in batches so responses never wait on them
+app.config['PCAPTCHA_ANALYTICS_FLUSH_INTERVAL'] = 1.0
+app.config['PCAPTCHA_ANALYTICS_BATCH_SIZE'] = 500
+app.config['PCAPTCHA_ANALYTICS_QUEUE_SIZE'] = 10000
+
+analytics_writer = AnalyticsWriter(
+    app,
+    flush_interval=app.config['PCAPTCHA_ANALYTICS_FLUSH_INTERVAL'],
+    max_batch_size=app.config['PCAPTCHA_ANALYTICS_BATCH_SIZE'],
+    max_queue_size=app.config['PCAPTCHA_ANALYTICS_QUEUE_SIZE']
+)
+
+# Write whatever analytics are still queued when the process exits
+atexit.register(analytics_writer.stop)
+atexit.register(render_pool.stop)
+
+# Stores built from the PCAPTCHA_*_STORE settings, by setting, with the value they were built from
+_configured_stores = {}
+_configured_stores_lock = threading.Lock()
+
+def configured_store(setting, default):
+    """Return the store set as app.config[setting], or `default` when it is not set.
+
+    The setting holds a store, or a 'module:attribute' path (as set from the environment) to a
+    store or to a store class taking no arguments. Each value is only loaded once.
+    """
+    value = app.config.get(setting)
+    # Stores may define __len__, so an empty one must not count as unset
+    if value is None or value == '':
+        return default
+    built = _configured_stores.get(setting)
+    if built is not None and built[0] is value:
+        return built[1]
+    with _configured_stores_lock:
+        built = _configured_stores.get(setting)
+        if built is None or built[0] is not value:
+            store = value
+            if isinstance(value, str):
+                module_name, _, attribute = value.partition(':')
+                store = getattr(importlib.import_module(module_name), attribute)
+                if isinstance(store, type):
+                    store = store()
+            built = _configured_stores[setting] = (value, store)
+    return built[1]
+
+@app.before_request
+def configure_stores():
+    """Switch to the stores set in the config, which may change any time after this module is imported."""
+    global image_store, replay_store, used_token_store
+    image_store = reaper.image_store = configured_store('PCAPTCHA_IMAGE_STORE', memory_image_store)
+    replay_store = reaper.replay_store = configured_store('PCAPTCHA_REPLAY_STORE', replay_filter)
+    used_token_store = token_verifier.used_tokens = reaper.used_token_store = configured_store(
+        'PCAPTCHA_USED_TOKEN_STORE', memory_used_token_store
+    )
+    rate_limiter.store = reaper.rate_limit_store = configured_store('PCAPTCHA_RATE_LIMIT_STORE', memory_rate_limit_store)
+
+def too_many_requests(wait):
+    """Reject a rate limited request, telling the client when to retry."""
+    response = jsonify({'success': False, 'message': 'Too many requests'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response
+
+@app.before_request
+def enforce_rate_limits():
+    """Reject clients over their IP or session limit for the endpoint before it does any work."""
+    wait = rate_limiter.check(request.endpoint, {'ip': request.remote_addr, 'session': session.get('session_id')})
+    if wait:
+        return too_many_requests(wait)
+
+@app.before_request
+def start_background_workers():
+    """Make sure this worker process runs its background threads."""
+    if app.config['PCAPTCHA_RUN_REAPER']:
+        reaper.start()
+    analytics_writer.start()
 
 def init_captcha_analytics():
     """Initialize CAPTCHA Analytics if the session is new."""
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
-        analytics = CAPTCHA_Analytics(session_id=session['session_id'])
-        db.session.add(analytics)
-        db.session.commit()
+        analytics_writer.count('sessions_started')
 
 # Example usage
 @app.route('/')
@@ -80,140 +284,46 @@ def index():
 </html>
 '''
 
-# Return the dynamic pCaptcha.js file
+# Return the pCaptcha.js file, compiled once
 @app.route('/pCaptcha.js', methods=['GET'])
 def pCaptcha_js():
-    """Serve the dynamic pCaptcha.js file."""
-    # Initialize analytics on script load
-    init_captcha_analytics()
-    base_url = request.url_root
-    js_content = f'''
-(function() {{
-    const container = document.getElementById('captchaContainer');
-    const button = document.createElement('button');
-    button.innerText = 'Click to verify';
-    button.style.backgroundColor = '#4285f4'; 
-    button.style.color = 'white';
-    button.style.border = 'none';
-    button.style.padding = '10px 20px';
-    button.style.cursor = 'pointer';
-    button.style.borderRadius = '5px';
-    container.appendChild(button);
-
-    const canvas = document.createElement('canvas');
-    canvas.id = 'captchaCanvas';
-    canvas.width = 250;  
-    canvas.height = 250; 
-    canvas.style.border = '1px solid #ccc';
-    canvas.style.display = 'none'; 
-    container.appendChild(canvas);
-
-    let captchaId = null;
-    const pieceSize = 50; 
-    let isDragging = false;
-    let draggablePiecePosition = {{ x: 0, y: 0 }};
-    let mouseMovement = [];  // Array to store mouse movements with timestamps
-    let backgroundImage = new Image();
-
-    async function generatePuzzlePiece() {{
-        const response = await fetch('{base_url}generate_puzzle_piece', {{
-            method: 'GET',
-            headers: {{ 'Content-Type': 'application/json' }}
-        }});
-        const data = await response.json();
-        if (data.success) {{
-            captchaId = data.captcha_id;
-            backgroundImage.src = data.image;
-            backgroundImage.onload = drawCanvas;
-            canvas.style.display = 'block'; 
-        }} else {{
-            console.error(data.message);
-        }}
-    }}
-
-    function drawCanvas() {{
-        const ctx = canvas.getContext('2d');
-        ctx.clearRect(0, 0, canvas.width, canvas.height);
-        ctx.drawImage(backgroundImage, 0, 0, canvas.width, canvas.height);
-        drawDraggablePiece(draggablePiecePosition.x, draggablePiecePosition.y);
-    }}
-
-    function drawDraggablePiece(x, y) {{
-        const ctx = canvas.getContext('2d');
-        ctx.fillStyle = 'rgba(0, 255, 0, 1)'; 
-        ctx.fillRect(x, y, pieceSize, pieceSize);
-        ctx.strokeStyle = 'black';
-        ctx.strokeRect(x, y, pieceSize, pieceSize);
-    }}
-
-    button.onclick = function() {{
-        generatePuzzlePiece(); 
-    }};
-
-    canvas.onmousedown = function(event) {{
-        const mouseX = event.offsetX;
-        const mouseY = event.offsetY;
-        const isInPiece = (mouseX >= draggablePiecePosition.x && mouseX <= draggablePiecePosition.x + pieceSize &&
-                           mouseY >= draggablePiecePosition.y && mouseY <= draggablePiecePosition.y + pieceSize);
-
-        if (isInPiece) {{
-            isDragging = true;
-            canvas.style.cursor = 'grabbing';
-            canvas.onmousemove = onMouseMove;
-        }}
-    }};
-
-    function onMouseMove(event) {{
-        if (isDragging) {{
-            const mouseX = event.offsetX;
-            const mouseY = event.offsetY;
-
-            const ctx = canvas.getContext('2d');
-            ctx.clearRect(0, 0, canvas.width, canvas.height);
-            ctx.drawImage(backgroundImage, 0, 0, canvas.width, canvas.height); 
-
-            draggablePiecePosition.x = mouseX - pieceSize / 2;
-            draggablePiecePosition.y = mouseY - pieceSize / 2;
-
-            const timestamp = Date.now();
-            mouseMovement.push({{ x: mouseX, y: mouseY, time: timestamp }});
-
-            drawDraggablePiece(draggablePiecePosition.x, draggablePiecePosition.y);
-        }}
-    }}
-
-    canvas.onmouseup = function(event) {{
-        if (isDragging) {{
-            const finalX = draggablePiecePosition.x;
-            const finalY = draggablePiecePosition.y;
-            checkPosition(finalX, finalY);
-            isDragging = false;
-            canvas.onmousemove = null;  
-            canvas.style.cursor = 'default';
-        }}
-    }};
-
-    async function checkPosition(finalX, finalY) {{
-        const response = await fetch('{base_url}check_position', {{
-            method: 'POST',
-            headers: {{ 'Content-Type': 'application/json' }},
-            body: JSON.stringify({{
-                captcha_id: captchaId,
-                x: finalX,
-                y: finalY,
-                mouse_movements: mouseMovement
-            }})
-        }});
-        const data = await response.json();
-        alert(data.message);
-        if (data.success) {{
-            console.log("Token:", data.token);
-            document.cookie = "captcha_token=" + data.token;
-        }}
-    }}
-}})();
-'''
-    return Response(js_content, mimetype='application/javascript')
+    """Serve the pCaptcha.js file with a strong ETag and pre-compressed variants."""
+    # Visitors who never ask for a CAPTCHA are only counted, they never get a session row
+    analytics_writer.count('script_loads')
+    script = script_cache.get(app.config['PCAPTCHA_BASE_URL'])
+
+    # Pick the smallest variant the client accepts, each with its own ETag
+    if script.brotli is not None and request.accept_encodings['br']:
+        body, encoding, etag = script.brotli, 'br', f'{script.etag}-br'
+    elif request.accept_encodings['gzip']:
+        body, encoding, etag = script.gzip, 'gzip', f'{script.etag}-gz'
+    else:
+        body, encoding, etag = script.body, None, script.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/javascript')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={app.config['PCAPTCHA_SCRIPT_MAX_AGE']}"
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def negotiate_image():
+    """Pick the most preferred encoding the client accepts, falling back to the last one."""
+    mimetypes = render_pool.mimetypes()
+    return request.accept_mimetypes.best_match(mimetypes, default=mimetypes[-1])
+
+def puzzle_image_data(captcha_id, images, mimetype):
+    """Return a puzzle's image in `mimetype`, encoding a fallback (and keeping it, if stored) on first use."""
+    data = images.get(mimetype)
+    if data is None:
+        data = render_pool.encode_fallback(images, mimetype)
+        if captcha_id is not None:
+            image_store.add_encoding(captcha_id, mimetype, data)
+    return data
 
 @app.route('/generate_puzzle_piece', methods=['GET'])
 def generate_puzzle_piece():
@@ -221,81 +331,109 @@ def generate_puzzle_piece():
     # Ensure analytics is initialized for the session
     init_captcha_analytics()
 
-    # Generate a random position for the puzzle piece
-    correct_x = random.randint(25, 200)  
-    correct_y = random.randint(25, 200)  
-
-    # Save the CAPTCHA instance to the database to be later checked
-    captcha = CAPTCHA(correct_x=correct_x, correct_y=correct_y)
-    db.session.add(captcha)
-
-    # Increment captchas_generated count for the analytics
-    analytics = db.session.query(CAPTCHA_Analytics).filter_by(session_id=session['session_id']).first()
-    analytics.captchas_generated += 1
-
-    # Create a new attempt for the CAPTCHA
-    new_attempt = CAPTCHA_Attempt(session_id=session['session_id'], captcha_id=captcha.id)
-
-    db.session.add(new_attempt)
-    
-    # Get the uuid of the newly added captcha
-    captcha_uuid = captcha.id
-    db.session.commit()
-
-    # Retrieve a random background image for the puzzle with a size of 250x250
-    response = requests.get("https://picsum.photos/250")
-    background = Image.open(BytesIO(response.content)).convert('RGBA')
-
-    # Piece data
-    piece_size = 50
-    outline_color = random.choice(neon_colors)
-    fill = random.choice(neon_colors)[:3] + (15,)
-
-    # Create the puzzle piece
-    piece_layer = Image.new('RGBA', background.size, (0, 0, 0, 0))
-    draw_piece = ImageDraw.Draw(piece_layer)
-
-    # Draw the puzzle piece on the layer
-    draw_piece.rectangle(
-        [correct_x, correct_y,
-         correct_x + piece_size,
-         correct_y + piece_size],
-        fill=fill,  
-        outline=outline_color,
-        width=5
-    )
+    # Take a ready-made puzzle from the pool (rendered synchronously if it ran dry)
+    puzzle = puzzle_pool.get()
 
-    # Apply a Gaussian blur to the piece layer to fight against sharp edges
-    blurred_piece = piece_layer.filter(ImageFilter.GaussianBlur(radius=5))  
+    if app.config['PCAPTCHA_STATELESS']:
+        # The solution travels encrypted inside the CAPTCHA ID instead of the database
+        challenge, captcha_token = challenge_codec.issue(puzzle.correct_x, puzzle.correct_y)
+        captcha_uuid = challenge.id
+    else:
+        # Save the CAPTCHA instance to the database to be later checked
+        captcha = CAPTCHA(correct_x=puzzle.correct_x, correct_y=puzzle.correct_y)
+        db.session.add(captcha)
+        db.session.commit()
+        captcha_uuid = captcha_token = captcha.id
 
-    # Combine the background and the blurred piece
-    img = Image.alpha_composite(background, blurred_piece)
+    # Count the generation and create a new attempt for the CAPTCHA in the background
+    analytics_writer.captcha_generated(session['session_id'], captcha_uuid)
 
-    # Save the image to the static folder
-    if not os.path.exists('static'):
-        os.mkdir('static')
-    img_path = os.path.join('static', f'puzzle_{captcha_uuid}.png')
-    img.save(img_path)
+    # Return the image (inline, or where to fetch it) and the CAPTCHA ID to later be sent by the client
+    if app.config['PCAPTCHA_INLINE_IMAGES']:
+        mimetype = negotiate_image()
+        data = puzzle_image_data(None, puzzle.images, mimetype)
+        image = f'data:{mimetype};base64,' + base64.b64encode(data).decode('ascii')
+    else:
+        image_store.put(captcha_uuid, puzzle.images)
+        base_url = app.config['PCAPTCHA_BASE_URL'] or request.url_root
+        image = f"{base_url.rstrip('/')}/puzzle/{captcha_uuid}"
 
-    # Return the image path and the CAPTCHA ID to later be sent by the client
     return jsonify({
         'success': True,
-        'captcha_id': captcha_uuid,
-        'image': f'{request.url_root}{img_path}'
+        'captcha_id': captcha_token,
+        'image': image
     })
 
+@app.route('/puzzle/<captcha_id>', methods=['GET'])
+def puzzle_image(captcha_id):
+    """Serve the puzzle image of a CAPTCHA until it expires."""
+    stored = image_store.get(captcha_id)
+    if stored is None:
+        return jsonify({'success': False, 'message': 'Puzzle image not found'}), 404
+
+    images, seconds_left = stored
+    mimetype = negotiate_image()
+    response = Response(puzzle_image_data(captcha_id, images, mimetype), mimetype=mimetype)
+    # The image never changes, but must not outlive its CAPTCHA or be shared between users
+    response.headers['Cache-Control'] = f'private, max-age={int(seconds_left)}, immutable'
+    response.vary.add('Accept')
+    return response
+
 @app.route('/check_position', methods=['POST'])
 def check_position():
     """Check the position of the dragged puzzle piece."""
+    # Reject oversized bodies before reading (or while reading) them, never after decoding
+    max_body = app.config['PCAPTCHA_MAX_CHECK_BODY_BYTES']
+    if request.content_length is not None and request.content_length > max_body:
+        return jsonify({'success': False, 'message': 'Request too large'}), 413
+    body = request.stream.read(max_body + 1)
+    if len(body) > max_body:
+        return jsonify({'success': False, 'message': 'Request too large'}), 413
+
     # Get the data from the request
-    data = request.get_json()
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Invalid request'}), 400
     captcha_id = data.get('captcha_id')
     x = data.get('x')
     y = data.get('y')
-    mouse_movements = data.get('mouse_movements')
-
-    # Retrieve the CAPTCHA from the database
-    captcha = CAPTCHA.query.get(captcha_id)
+    if not isinstance(captcha_id, str) or not all(
+        isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value) for value in (x, y)
+    ):
+        return jsonify({'success': False, 'message': 'Invalid request'}), 400
+
+    # Limit guesses per CAPTCHA, however many sessions or addresses they come from
+    wait = rate_limiter.check('check_position', {'captcha': captcha_id}, count=False)
+    if wait:
+        return too_many_requests(wait)
+
+    # Keep a bounded, shape-preserving sample of the mouse path
+    if 'mouse_path' in data:
+        trajectory = parse_packed_path(data.get('mouse_path'), app.config['PCAPTCHA_MAX_TRAJECTORY_POINTS'])
+    else:
+        # Older clients send a list of {x, y, time} points
+        trajectory = parse_movements(data.get('mouse_movements'), app.config['PCAPTCHA_MAX_TRAJECTORY_POINTS'])
+    if trajectory is not None:
+        trajectory = simplify(
+            trajectory,
+            epsilon=app.config['PCAPTCHA_TRAJECTORY_EPSILON'],
+            max_points=app.config['PCAPTCHA_TRAJECTORY_POINTS']
+        )
+
+    if app.config['PCAPTCHA_STATELESS']:
+        # Decrypt the challenge and make sure it is only ever checked once
+        try:
+            captcha = challenge_codec.open(captcha_id)
+        except InvalidChallenge:
+            captcha = None
+        if captcha is not None and not replay_store.add(captcha.id, captcha.expires_at):
+            captcha = None
+    else:
+        # Retrieve the CAPTCHA from the database
+        captcha = db.session.get(CAPTCHA, captcha_id)
 
     if not captcha:
         return jsonify({'success': False, 'message': 'CAPTCHA not found'}), 404
@@ -306,83 +444,85 @@ def check_position():
 
     # Check if the piece is within the allowed tolerance of the correct position
     if abs(x - correct_x) <= tolerance and abs(y - correct_y) <= tolerance:
-        # Success! Generate a JWT token
-        token = jwt.encode({'captcha_id': captcha_id, 'session_id': session['session_id']}, SECRET_KEY, algorithm='HS256')
-
-        # Increment captchas_solved count for the analytics
-        analytics = db.session.query(CAPTCHA_Analytics).filter_by(session_id=session['session_id']).first()
-
-        if analytics is not None:
-            analytics.captchas_solved += 1
-
-            # Update the last attempt with the new data
-            attempt = db.session.query(CAPTCHA_Attempt).filter_by(session_id=session['session_id'], captcha_id=captcha_id).first()
-            if attempt:
-                attempt.completed_at = datetime.datetime.now(datetime.timezone.utc)
-                attempt.success = True
-                attempt.mouse_movements = mouse_movements
-                
-                # Calculate the time taken to solve the CAPTCHA
-                attempt.time_taken = (attempt.completed_at.replace(tzinfo=None) - attempt.presented_at.replace(tzinfo=None)).total_seconds()
-  
-            db.session.commit()
+        # Use the CAPTCHA up, so that only the first of concurrent or repeated solves gets a token
+        solved_id = captcha.id
+        if not app.config['PCAPTCHA_STATELESS']:
+            if not use_captcha(db.session, solved_id):
+                return jsonify({'success': False, 'message': 'CAPTCHA not found'}), 404
+            image_store.delete(solved_id)
 
-        return jsonify({'success': True, 'message': 'CAPTCHA solved!', 'token': token})
+        # Success! Generate a single-use token bound to this client
+        token = token_verifier.issue(
+            solved_id, session['session_id'], request.remote_addr, request.headers.get('User-Agent', '')
+        )
 
-    else:
-        # Increment captchas_failed count for the analytics
-        analytics = db.session.query(CAPTCHA_Analytics).filter_by(session_id=session['session_id']).first()
+        # Increment captchas_solved count and update the attempt
+        record_attempt(solved_id, True, trajectory)
 
-        if analytics is not None:
-            analytics.captchas_failed += 1
+        return jsonify({'success': True, 'message': 'CAPTCHA solved!', 'token': token})
 
-            # Update the last attempt with the completion time and success status
-            attempt = db.session.query(CAPTCHA_Attempt).filter_by(session_id=session['session_id'], captcha_id=captcha_id).first()
-            if attempt:
-                attempt.completed_at = datetime.datetime.now(datetime.timezone.utc)
-                attempt.success = False
-                attempt.mouse_movements = mouse_movements
+    else:
+        # Increment captchas_failed count and update the attempt
+        record_attempt(captcha.id, False, trajectory)
 
-                # Calculate the time taken to fail the CAPTCHA
-                attempt.time_taken = (attempt.completed_at.replace(tzinfo=None) - attempt.presented_at.replace(tzinfo=None)).total_seconds()
+        return jsonify({'success': False, 'message': 'CAPTCHA failed. Please try again.'})
 
-            db.session.commit()
+def record_attempt(captcha_id, success, trajectory):
+    """Count a solve or fail for the session and complete its attempt in the background."""
+    analytics_writer.attempt_completed(session['session_id'], captcha_id, success, trajectory)
 
-        return jsonify({'success': False, 'message': 'CAPTCHA failed. Please try again.'})
+def verify_token(data):
+    """Verify one token for the IP address and user agent a backend saw, and return the result."""
+    token = data.get('token')
 
-@app.route('/verify_captcha', methods=['POST'])
-def verify_captcha():
-    """Verify the CAPTCHA token."""
-    # Get the token, IP address, and user agent from the request
-    token = request.json.get('token')
-    ip_address = request.json.get('ip-address')
-    user_agent = request.json.get('user-agent')
-    
     # Check if the token is provided
     if not token:
-        return jsonify({"success": False, "message": "No token provided!"})
+        return {"success": False, "message": "No token provided!"}
 
     try:
-        # Decode the JWT
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        captcha_id = payload['captcha_id']
-        user_ip = payload['user_ip']
-        user_agent = payload['user_agent']
+        # Check the signature, expiry and client, then mark the token used
+        claims = token_verifier.verify(token, data.get('ip-address'), data.get('user-agent'))
+    except TokenError as exc:
+        return {"success": False, "message": str(exc)}
 
-        # Check if the IP address and user agent match the ones in the token
-        if user_ip != ip_address and user_agent != user_agent:
-            return jsonify({"success": False, "message": "Identity mismatch!"})
+    return {"success": True, "message": "CAPTCHA verified!", "captcha_id": claims['captcha_id']}
 
-        return jsonify({"success": True, "message": "CAPTCHA verified!", "captcha_id": captcha_id})
-
-    except jwt.ExpiredSignatureError:
-        return jsonify({"success": False, "message": "Token has expired!"})
-    except jwt.InvalidTokenError:
-        return jsonify({"success": False, "message": "Invalid token!"})
+@app.route('/verify_captcha', methods=['POST'])
+def verify_captcha():
+    """Verify the CAPTCHA token."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'Invalid request'}), 400
+    return jsonify(verify_token(data))
+
+@app.route('/verify_captcha/bulk', methods=['POST'])
+def verify_captcha_bulk():
+    """Verify a list of CAPTCHA tokens at once, returning one result per token in the same order."""
+    data = request.get_json(silent=True)
+    tokens = data.get('tokens') if isinstance(data, dict) else None
+    if not isinstance(tokens, list) or not all(isinstance(item, dict) for item in tokens):
+        return jsonify({'success': False, 'message': 'Invalid request'}), 400
+    if len(tokens) > app.config['PCAPTCHA_MAX_BULK_VERIFY']:
+        return jsonify({'success': False, 'message': 'Too many tokens'}), 413
+    return jsonify({'success': True, 'results': [verify_token(item) for item in tokens]})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Report internal counters of the puzzle pool, rate limiter, image encoding and store, background cache, reaper and analytics writer."""
+    return jsonify({
+        'puzzle_pool': puzzle_pool.stats(),
+        'rate_limiter': rate_limiter.stats(),
+        'image_encoding': render_pool.stats(),
+        'image_store': image_store.stats() if hasattr(image_store, 'stats') else None,
+        'background_cache': background_source.stats(),
+        'reaper': reaper.stats(),
+        'analytics_writer': analytics_writer.stats()
+    })
 
 # Database and app initialization
 with app.app_context():
     db.create_all()
+    migrate(db.engine, app.logger)
 
 if __name__ == '__main__':
     # Run the Flask app
@@ -0,0 +1,103 @@
+from sqlalchemy import Column, Integer, MetaData, Table, bindparam, inspect, null, select, text, update
+from models import db, CAPTCHA, CAPTCHA_Analytics, CAPTCHA_Attempt, CAPTCHA_Rollup
+from rollups import rebuild_rollups
+from trajectory import pack_movements
+
+# Records which migrations have been applied to a database
+schema_version = Table('schema_version', MetaData(), Column('version', Integer, primary_key=True))
+
+
+def add_lookup_indexes(connection):
+    """Index the columns used by expiry, attempt lookups and the dashboard."""
+    tables = [CAPTCHA.__table__, CAPTCHA_Attempt.__table__]
+    for table in tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def pack_mouse_movements(connection, batch_size=1000):
+    """Add the mouse_trajectory column and move the JSON mouse_movements rows into it."""
+    table = CAPTCHA_Attempt.__table__
+    columns = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    if 'mouse_trajectory' not in columns:
+        column_type = table.c.mouse_trajectory.type.compile(connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN mouse_trajectory {column_type}'))
+
+    # Walk the legacy rows by id so every batch is a short range scan
+    backfill = (
+        update(table)
+        .where(table.c.id == bindparam('attempt_id'))
+        .values(mouse_trajectory=bindparam('packed'), mouse_movements=null())
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.mouse_movements)
+            .where(table.c.id > last_id, table.c.mouse_movements.isnot(None))
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        connection.execute(backfill, [
+            {'attempt_id': attempt_id, 'packed': pack_movements(movements)} for attempt_id, movements in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def build_rollups(connection):
+    """Fill the hourly and daily rollups from the history recorded so far."""
+    CAPTCHA_Rollup.__table__.create(connection, checkfirst=True)
+    rebuild_rollups(connection)
+
+
+def add_session_listing_index(connection):
+    """Index sessions by creation time for the dashboard's paged session listing."""
+    for index in CAPTCHA_Analytics.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+# Every migration in order, as (version, description, function taking a connection)
+MIGRATIONS = [
+    (1, 'Add indexes for expiry, attempt lookups and dashboard queries', add_lookup_indexes),
+    (2, 'Store mouse movements as packed trajectories', pack_mouse_movements),
+    (3, 'Build hourly and daily analytics rollups', build_rollups),
+    (4, 'Index sessions by creation time for the dashboard listing', add_session_listing_index),
+]
+
+
+def current_version(connection):
+    """Return the highest migration version applied to the database."""
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+    return connection.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
+
+
+def migrate(engine, logger=None):
+    """Apply every pending migration, each in its own transaction, and return the new version."""
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        version = current_version(connection)
+
+    for migration_version, description, upgrade in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        with engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(schema_version.insert().values(version=migration_version))
+        if logger is not None:
+            logger.info('Applied migration %d: %s', migration_version, description)
+        version = migration_version
+    return version
+
+
+if __name__ == '__main__':
+    # Upgrade the configured database without starting either app
+    from flask import Flask
+    from database import configure_database
+
+    app = Flask(__name__)
+    configure_database(app)
+    with app.app_context():
+        db.create_all()
+        print(f'Database is at version {migrate(db.engine)}')
@@ -1,16 +1,18 @@
 from flask_sqlalchemy import SQLAlchemy
 import uuid
 import datetime
-from sqlalchemy import event
 
 db = SQLAlchemy()
 
+# How long a CAPTCHA (and its puzzle image) stays valid
+CAPTCHA_LIFETIME = datetime.timedelta(minutes=5)
+
 class CAPTCHA(db.Model):
     """Model to represent a CAPTCHA instance."""
     id = db.Column(db.String(36), primary_key=True)
     correct_x = db.Column(db.Integer, nullable=False)
     correct_y = db.Column(db.Integer, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc), index=True)
 
     def __init__(self, correct_x, correct_y):
         self.id = str(uuid.uuid4())
@@ -25,6 +27,11 @@ class CAPTCHA_Analytics(db.Model):
     captchas_failed = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc), nullable=False)
 
+    __table_args__ = (
+        # Dashboard session listing, paged through newest or oldest first
+        db.Index('ix_captcha_analytics_created_at_session', 'created_at', 'session_id'),
+    )
+
 class CAPTCHA_Attempt(db.Model):
     """Model to store CAPTCHA solving attempts."""
     id = db.Column(db.Integer, primary_key=True)
@@ -34,16 +41,83 @@ class CAPTCHA_Attempt(db.Model):
     completed_at = db.Column(db.DateTime, nullable=True)
     time_taken = db.Column(db.Float, default=0.0)
     success = db.Column(db.Boolean, default=False)
-    mouse_movements = db.Column(db.JSON, nullable=True)
-
-def delete_old_captchas(session):
-    """Delete CAPTCHAs older than a certain cutoff time."""
-    # Define the cutoff time to be older than 5 minutes
-    cutoff_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
-    # Delete records older than the cutoff time
-    session.query(CAPTCHA).filter(CAPTCHA.created_at < cutoff_time).delete(synchronize_session=False)
-
-# Use the event listener to trigger the cleanup before flushing
-@event.listens_for(db.Session, 'before_flush')
-def before_flush(session, flush_context, instances):
-    delete_old_captchas(session)
+    mouse_movements = db.Column(db.JSON, nullable=True)  # Legacy rows, see mouse_trajectory
+    mouse_trajectory = db.Column(db.LargeBinary, nullable=True)  # Packed by trajectory.encode()
+
+    __table_args__ = (
+        # check_position and the analytics writer look attempts up by CAPTCHA and session
+        db.Index('ix_captcha_attempt_captcha_session', 'captcha_id', 'session_id'),
+        # Dashboard hour histograms, read straight from the index
+        db.Index('ix_captcha_attempt_presented_at', 'presented_at'),
+        db.Index('ix_captcha_attempt_success_completed_at', 'success', 'completed_at'),
+        # Average solve and fail times, covered without touching the table
+        db.Index('ix_captcha_attempt_success_time_taken', 'success', 'time_taken'),
+    )
+
+class CAPTCHA_Traffic(db.Model):
+    """Model to store hourly counters for visitors that do not get an analytics session of their own."""
+    hour = db.Column(db.DateTime, primary_key=True)
+    script_loads = db.Column(db.Integer, default=0, nullable=False)
+    sessions_started = db.Column(db.Integer, default=0, nullable=False)
+
+class CAPTCHA_Rollup(db.Model):
+    """Model to store analytics totals per hour and per day, kept up to date by the analytics writer."""
+    period = db.Column(db.String(4), primary_key=True)  # 'hour' or 'day'
+    start = db.Column(db.DateTime, primary_key=True)  # UTC
+    sessions = db.Column(db.Integer, default=0, nullable=False)
+    generated = db.Column(db.Integer, default=0, nullable=False)  # By presentation time
+    solved = db.Column(db.Integer, default=0, nullable=False)  # By completion time, as are the rest
+    failed = db.Column(db.Integer, default=0, nullable=False)
+    timed_solves = db.Column(db.Integer, default=0, nullable=False)
+    timed_fails = db.Column(db.Integer, default=0, nullable=False)
+    solve_seconds = db.Column(db.Float, default=0.0, nullable=False)
+    fail_seconds = db.Column(db.Float, default=0.0, nullable=False)
+
+class CAPTCHA_Heatmap(db.Model):
+    """Model to store how many mouse path points fell on each pixel of the puzzle, per hour and per day."""
+    period = db.Column(db.String(4), primary_key=True)  # 'hour' or 'day'
+    start = db.Column(db.DateTime, primary_key=True)  # UTC, by completion time
+    success = db.Column(db.Boolean, primary_key=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    points = db.Column(db.Integer, default=0, nullable=False)
+    grid = db.Column(db.LargeBinary, nullable=False)  # Packed by heatmaps.encode_grid()
+
+class CAPTCHA_UsedToken(db.Model):
+    """Model to remember verified tokens until they expire, so each can only be used once."""
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.Integer, nullable=False, index=True)  # Unix time
+
+class CAPTCHA_UsedChallenge(db.Model):
+    """Model to remember checked stateless challenges until they expire, so each can only be checked once."""
+    id = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.Integer, nullable=False, index=True)  # Unix time
+
+class CAPTCHA_RateLimit(db.Model):
+    """Model to keep the rate limiter's token buckets, so every worker and node enforces the same limits."""
+    key = db.Column(db.String(64), primary_key=True)  # SHA-256 of endpoint:scope:client
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # Unix time
+    full_at = db.Column(db.Float, nullable=False, index=True)  # Unix time the bucket has refilled
+
+def use_captcha(session, captcha_id):
+    """Delete a solved CAPTCHA so it can only be solved once, and return whether this call deleted it."""
+    deleted = session.query(CAPTCHA).filter(CAPTCHA.id == captcha_id).delete(synchronize_session=False)
+    session.commit()
+    return deleted == 1
+
+def delete_old_captchas(session, batch_size=500):
+    """Delete CAPTCHAs older than a certain cutoff time, one batch per transaction, and return their ids."""
+    # Define the cutoff time to be older than the CAPTCHA lifetime
+    cutoff_time = datetime.datetime.utcnow() - CAPTCHA_LIFETIME
+    deleted_ids = []
+    while True:
+        # Walk the created_at index so each batch only touches expired rows
+        ids = [row[0] for row in session.query(CAPTCHA.id).filter(CAPTCHA.created_at < cutoff_time).limit(batch_size)]
+        if not ids:
+            break
+        session.query(CAPTCHA).filter(CAPTCHA.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+        deleted_ids.extend(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted_ids
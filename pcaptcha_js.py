@@ -0,0 +1,238 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+try:
+    import brotli
+except ImportError:  # Optional, only used to pre-compress a brotli variant
+    brotli = None
+
+# Source of pCaptcha.js, formatted with the configured base URL of the CAPTCHA server as a
+# JavaScript string literal, or null to use the URL the script itself was loaded from
+SCRIPT_TEMPLATE = '''
+(function() {{
+    const baseUrl = {base_url} || new URL('.', document.currentScript.src).href;
+    const container = document.getElementById('captchaContainer');
+    const button = document.createElement('button');
+    button.innerText = 'Click to verify';
+    button.style.backgroundColor = '#4285f4'; 
+    button.style.color = 'white';
+    button.style.border = 'none';
+    button.style.padding = '10px 20px';
+    button.style.cursor = 'pointer';
+    button.style.borderRadius = '5px';
+    container.appendChild(button);
+
+    const canvas = document.createElement('canvas');
+    canvas.id = 'captchaCanvas';
+    canvas.width = 250;  
+    canvas.height = 250; 
+    canvas.style.border = '1px solid #ccc';
+    canvas.style.display = 'none'; 
+    container.appendChild(canvas);
+
+    let captchaId = null;
+    const pieceSize = 50; 
+    let isDragging = false;
+    let draggablePiecePosition = {{ x: 0, y: 0 }};
+    let backgroundImage = new Image();
+
+    // Mouse path ring buffer of [x, y, ms since the previous sample], one sample per frame
+    const maxSamples = 1024;
+    const samples = new Int16Array(maxSamples * 3);
+    let sampleCount = 0;
+    let lastSampleTime = 0;
+    let pendingPosition = null;
+    let frameRequested = false;
+
+    async function generatePuzzlePiece() {{
+        const response = await fetch(baseUrl + 'generate_puzzle_piece', {{
+            method: 'GET',
+            headers: {{ 'Content-Type': 'application/json' }}
+        }});
+        const data = await response.json();
+        if (data.success) {{
+            captchaId = data.captcha_id;
+            backgroundImage.src = data.image;
+            backgroundImage.onload = drawCanvas;
+            canvas.style.display = 'block'; 
+        }} else {{
+            console.error(data.message);
+        }}
+    }}
+
+    function drawCanvas() {{
+        const ctx = canvas.getContext('2d');
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.drawImage(backgroundImage, 0, 0, canvas.width, canvas.height);
+        drawDraggablePiece(draggablePiecePosition.x, draggablePiecePosition.y);
+    }}
+
+    function drawDraggablePiece(x, y) {{
+        const ctx = canvas.getContext('2d');
+        ctx.fillStyle = 'rgba(0, 255, 0, 1)'; 
+        ctx.fillRect(x, y, pieceSize, pieceSize);
+        ctx.strokeStyle = 'black';
+        ctx.strokeRect(x, y, pieceSize, pieceSize);
+    }}
+
+    button.onclick = function() {{
+        generatePuzzlePiece(); 
+    }};
+
+    canvas.onmousedown = function(event) {{
+        const mouseX = event.offsetX;
+        const mouseY = event.offsetY;
+        const isInPiece = (mouseX >= draggablePiecePosition.x && mouseX <= draggablePiecePosition.x + pieceSize &&
+                           mouseY >= draggablePiecePosition.y && mouseY <= draggablePiecePosition.y + pieceSize);
+
+        if (isInPiece) {{
+            isDragging = true;
+            canvas.style.cursor = 'grabbing';
+            canvas.onmousemove = onMouseMove;
+        }}
+    }};
+
+    function onMouseMove(event) {{
+        if (isDragging) {{
+            // Only remember the latest position, it is drawn on the next animation frame
+            pendingPosition = {{ x: event.offsetX, y: event.offsetY }};
+            if (!frameRequested) {{
+                frameRequested = true;
+                requestAnimationFrame(renderFrame);
+            }}
+        }}
+    }}
+
+    function renderFrame() {{
+        frameRequested = false;
+        if (pendingPosition === null) {{
+            return;
+        }}
+        const mouseX = pendingPosition.x;
+        const mouseY = pendingPosition.y;
+        pendingPosition = null;
+
+        draggablePiecePosition.x = mouseX - pieceSize / 2;
+        draggablePiecePosition.y = mouseY - pieceSize / 2;
+        recordSample(mouseX, mouseY);
+        drawCanvas();
+    }}
+
+    function recordSample(x, y) {{
+        const now = performance.now();
+        const offset = (sampleCount % maxSamples) * 3;
+        samples[offset] = x;
+        samples[offset + 1] = y;
+        samples[offset + 2] = sampleCount ? Math.min(Math.round(now - lastSampleTime), 32767) : 0;
+        lastSampleTime = now;
+        sampleCount++;
+    }}
+
+    function packSamples() {{
+        // Oldest to newest as little-endian int16 triples, base64 encoded
+        const count = Math.min(sampleCount, maxSamples);
+        const first = sampleCount - count;
+        const view = new DataView(new ArrayBuffer(count * 6));
+        for (let i = 0; i < count; i++) {{
+            const offset = ((first + i) % maxSamples) * 3;
+            view.setInt16(i * 6, samples[offset], true);
+            view.setInt16(i * 6 + 2, samples[offset + 1], true);
+            view.setInt16(i * 6 + 4, i ? samples[offset + 2] : 0, true);
+        }}
+        const bytes = new Uint8Array(view.buffer);
+        let binary = '';
+        for (let i = 0; i < bytes.length; i++) {{
+            binary += String.fromCharCode(bytes[i]);
+        }}
+        sampleCount = 0;
+        return btoa(binary);
+    }}
+
+    canvas.onmouseup = function(event) {{
+        if (isDragging) {{
+            // Apply a position still waiting for its frame
+            renderFrame();
+            const finalX = draggablePiecePosition.x;
+            const finalY = draggablePiecePosition.y;
+            checkPosition(finalX, finalY);
+            isDragging = false;
+            canvas.onmousemove = null;  
+            canvas.style.cursor = 'default';
+        }}
+    }};
+
+    async function checkPosition(finalX, finalY) {{
+        const response = await fetch(baseUrl + 'check_position', {{
+            method: 'POST',
+            headers: {{ 'Content-Type': 'application/json' }},
+            body: JSON.stringify({{
+                captcha_id: captchaId,
+                x: finalX,
+                y: finalY,
+                mouse_path: packSamples()
+            }})
+        }});
+        const data = await response.json();
+        alert(data.message);
+        if (data.success) {{
+            console.log("Token:", data.token);
+            document.cookie = "captcha_token=" + data.token;
+        }}
+    }}
+}})();
+'''
+
+# A compiled script: the minified source, its strong ETag and its pre-compressed variants
+CompiledScript = namedtuple('CompiledScript', ['body', 'etag', 'gzip', 'brotli'])
+
+
+def minify(source):
+    """Drop indentation, blank lines and comments, leaving strings alone."""
+    lines = []
+    for line in source.splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        # Trailing comments only ever follow a statement or a block opening
+        line = re.sub(r'([;{])\s+//.*$', r'\1', line)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def compile_script(base_url=None):
+    """Build, minify and pre-compress pCaptcha.js for a configured base URL, or for none."""
+    literal = json.dumps(base_url.rstrip('/') + '/' if base_url else None)
+    body = minify(SCRIPT_TEMPLATE.format(base_url=literal)).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return CompiledScript(
+        body,
+        etag,
+        gzip.compress(body, compresslevel=9, mtime=0),
+        brotli.compress(body) if brotli is not None else None
+    )
+
+
+class ScriptCache:
+    """Compiled scripts by configured base URL, which never comes from the request."""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._scripts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, base_url):
+        with self._lock:
+            script = self._scripts.get(base_url)
+            if script is not None:
+                self._scripts.move_to_end(base_url)
+                return script
+        script = compile_script(base_url)
+        with self._lock:
+            self._scripts[base_url] = script
+            while len(self._scripts) > self.max_entries:
+                self._scripts.popitem(last=False)
+        return script
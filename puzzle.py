@@ -0,0 +1,141 @@
+import functools
+import random
+import time
+from collections import namedtuple
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# List of neon colors for the puzzle piece
+neon_colors = [
+    (255, 0, 0, 200),     # Neon Red
+    (0, 255, 0, 200),     # Neon Green
+    (0, 0, 255, 200),     # Neon Blue
+    (255, 255, 0, 200),   # Neon Yellow
+    (255, 0, 255, 200),   # Neon Pink
+    (0, 255, 255, 200),   # Neon Cyan
+    (255, 165, 0, 200),   # Neon Orange
+    (255, 20, 147, 200),  # Neon Hot Pink
+    (191, 255, 0, 200),   # Neon Lime
+    (57, 255, 20, 200),   # Neon Green 2
+    (255, 105, 180, 200), # Neon Hot Pink 2
+    (127, 255, 0, 200),   # Neon Chartreuse
+    (0, 191, 255, 200),   # Neon Sky Blue
+    (255, 69, 0, 200),    # Neon Orange Red
+    (255, 0, 127, 200),   # Neon Deep Pink
+    (199, 21, 133, 200),  # Neon Medium Violet Red
+    (32, 178, 170, 200),  # Neon Light Sea Green
+    (173, 255, 47, 200),  # Neon Green Yellow
+    (100, 149, 237, 200), # Neon Cornflower Blue
+    (0, 255, 127, 200),   # Neon Spring Green
+    (220, 20, 60, 200),   # Neon Crimson
+    (148, 0, 211, 200),   # Neon Dark Violet
+    (255, 215, 0, 200),   # Neon Gold
+    (238, 130, 238, 200), # Neon Violet
+    (64, 224, 208, 200),  # Neon Turquoise
+    (144, 238, 144, 200), # Neon Light Green
+    (186, 85, 211, 200),  # Neon Medium Orchid
+    (0, 206, 209, 200),   # Neon Dark Turquoise
+    (123, 104, 238, 200), # Neon Medium Slate Blue
+    (255, 140, 0, 200)    # Neon Dark Orange
+]
+
+# Size of the square puzzle piece in pixels
+piece_size = 50
+
+# Outline width and blur radius of the piece
+piece_outline_width = 5
+piece_blur_radius = 5
+
+# Transparent margin around a piece patch, wide enough to hold everything the blur spreads out
+piece_padding = 4 * piece_blur_radius
+
+# Pillow format name and mimetype of every encoding a puzzle can be served in
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+# Encodings to produce and their Pillow save options, most preferred first
+DEFAULT_ENCODINGS = {'png': {}}
+
+# A rendered puzzle: its encoded images keyed by mimetype (most preferred first), where the
+# piece belongs, and how many seconds each encoding took
+Puzzle = namedtuple('Puzzle', ['images', 'correct_x', 'correct_y', 'encode_seconds'], defaults=(None,))
+
+@functools.lru_cache(maxsize=len(neon_colors) ** 2)
+def blurred_piece(outline_color, fill):
+    """Draw and blur the piece once per colour pair, on a patch only as big as its bounding box."""
+    patch_size = piece_size + 1 + 2 * piece_padding
+    piece_layer = Image.new('RGBA', (patch_size, patch_size), (0, 0, 0, 0))
+    ImageDraw.Draw(piece_layer).rectangle(
+        [piece_padding, piece_padding,
+         piece_padding + piece_size,
+         piece_padding + piece_size],
+        fill=fill,
+        outline=outline_color,
+        width=piece_outline_width
+    )
+
+    # Apply a Gaussian blur to the piece to fight against sharp edges
+    patch = np.asarray(piece_layer.filter(ImageFilter.GaussianBlur(radius=piece_blur_radius)))
+    patch.flags.writeable = False
+    return patch
+
+def render_puzzle(background, correct_x, correct_y):
+    """Blend the blurred puzzle piece onto the background and return the combined image."""
+    # Piece data
+    outline_color = random.choice(neon_colors)
+    fill = random.choice(neon_colors)[:3] + (15,)
+    patch = blurred_piece(outline_color, fill)
+
+    # Only the patch area of the background is touched, clipped to the image
+    canvas = np.array(background if background.mode == 'RGBA' else background.convert('RGBA'))
+    left, top = correct_x - piece_padding, correct_y - piece_padding
+    x0, y0 = max(left, 0), max(top, 0)
+    x1 = min(left + patch.shape[1], canvas.shape[1])
+    y1 = min(top + patch.shape[0], canvas.shape[0])
+
+    # Porter-Duff "over", the same blend Image.alpha_composite applies
+    src = patch[y0 - top:y1 - top, x0 - left:x1 - left].astype(np.float32) / 255
+    dst = canvas[y0:y1, x0:x1].astype(np.float32) / 255
+    src_alpha, dst_alpha = src[..., 3:], dst[..., 3:]
+    out_alpha = src_alpha + dst_alpha * (1 - src_alpha)
+    out_color = (src[..., :3] * src_alpha + dst[..., :3] * dst_alpha * (1 - src_alpha)) / np.maximum(out_alpha, 1e-6)
+    canvas[y0:y1, x0:x1, :3] = np.rint(out_color * 255)
+    canvas[y0:y1, x0:x1, 3:] = np.rint(out_alpha * 255)
+
+    return Image.fromarray(canvas, 'RGBA')
+
+def encode_image(image, image_format, **options):
+    """Encode an image in one of IMAGE_FORMATS with the given Pillow save options."""
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    if pil_format == 'JPEG':
+        # JPEG has no alpha channel, and the rendered puzzle is opaque anyway
+        image = image.convert('RGB')
+    buf = BytesIO()
+    image.save(buf, format=pil_format, **options)
+    return buf.getvalue()
+
+def transcode_image(data, image_format, **options):
+    """Decode an encoded puzzle and encode it again in another of IMAGE_FORMATS."""
+    with Image.open(BytesIO(data)) as image:
+        return encode_image(image, image_format, **options)
+
+def generate_puzzle(background_source, encodings=DEFAULT_ENCODINGS):
+    """Render a complete puzzle at a random position and encode it in every requested format."""
+    # Generate a random position for the puzzle piece
+    correct_x = random.randint(25, 200)
+    correct_y = random.randint(25, 200)
+
+    img = render_puzzle(background_source.get(), correct_x, correct_y)
+
+    images = {}
+    encode_seconds = {}
+    for image_format, options in encodings.items():
+        mimetype = IMAGE_FORMATS[image_format][1]
+        started = time.perf_counter()
+        images[mimetype] = encode_image(img, image_format, **options)
+        encode_seconds[mimetype] = time.perf_counter() - started
+    return Puzzle(images, correct_x, correct_y, encode_seconds)
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PuzzlePool:
+    """Bounded pool of pre-rendered puzzles kept topped up by a background thread.
+
+    `factory(count)` returns a list of `count` freshly rendered puzzles.
+    """
+
+    def __init__(self, factory, low_watermark=16, high_watermark=64, batch_size=8, retry_delay=1.0):
+        if not 0 <= low_watermark < high_watermark:
+            raise ValueError('low_watermark must be below high_watermark')
+        self.factory = factory
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self._puzzles = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._stats = {
+            'served_from_pool': 0,
+            'served_synchronously': 0,
+            'rendered': 0,
+            'render_errors': 0,
+            'refills': 0,
+            'last_refill_seconds': 0.0,
+            'total_refill_seconds': 0.0,
+        }
+
+    def start(self):
+        """Start the producer thread (again, if this process was forked)."""
+        with self._condition:
+            # Threads do not survive a fork, so a worker must start its own producer
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stopped = False
+            self._puzzles.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='puzzle-pool', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Ask the producer thread to exit."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def get(self):
+        """Pop a ready puzzle, or render one synchronously if the pool has run dry."""
+        self.start()
+        with self._condition:
+            if self._puzzles:
+                puzzle = self._puzzles.popleft()
+                self._stats['served_from_pool'] += 1
+            else:
+                puzzle = None
+                self._stats['served_synchronously'] += 1
+            if len(self._puzzles) <= self.low_watermark:
+                self._condition.notify()
+
+        if puzzle is None:
+            puzzle = self.factory(1)[0]
+        return puzzle
+
+    def stats(self):
+        """Return a snapshot of the pool size and refill metrics."""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = len(self._puzzles)
+        stats['low_watermark'] = self.low_watermark
+        stats['high_watermark'] = self.high_watermark
+        return stats
+
+    def _run(self):
+        """Wait until the pool drops to the low watermark, then refill it to the high watermark."""
+        while True:
+            with self._condition:
+                while not self._stopped and len(self._puzzles) > self.low_watermark:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+
+            started = time.perf_counter()
+            while not self._stopped and len(self._puzzles) < self.high_watermark:
+                try:
+                    puzzles = self.factory(min(self.batch_size, self.high_watermark - len(self._puzzles)))
+                except Exception:
+                    # Back off so a failing image source does not spin the CPU
+                    with self._condition:
+                        self._stats['render_errors'] += 1
+                    time.sleep(self.retry_delay)
+                    continue
+                with self._condition:
+                    self._puzzles.extend(puzzles)
+                    self._stats['rendered'] += len(puzzles)
+
+            elapsed = time.perf_counter() - started
+            with self._condition:
+                self._stats['refills'] += 1
+                self._stats['last_refill_seconds'] = elapsed
+                self._stats['total_refill_seconds'] += elapsed
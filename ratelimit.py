@@ -0,0 +1,147 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from sqlalchemy import case, select
+from sqlalchemy.exc import IntegrityError
+from models import db, CAPTCHA_RateLimit
+
+# A token bucket refilled with `rate` tokens per second and holding at most `burst` of them
+Limit = namedtuple('Limit', ['rate', 'burst'])
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(spec):
+    """Parse a limit such as '30/minute' into a Limit allowing bursts of the full amount."""
+    try:
+        amount, period = spec.split('/')
+        amount = int(amount)
+        seconds = PERIODS[period.strip()]
+    except (AttributeError, KeyError, ValueError):
+        raise ValueError(f'Invalid rate limit {spec!r}, expected e.g. "30/minute"')
+    if amount <= 0:
+        raise ValueError(f'Invalid rate limit {spec!r}, the amount must be positive')
+    return Limit(amount / seconds, amount)
+
+
+class RateLimitStore:
+    """Keeps the token buckets of the rate limiter, keyed by endpoint, scope and client."""
+
+    def take(self, key, limit):
+        """Take a token from the bucket and return 0, or the seconds until one is available."""
+        raise NotImplementedError
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """In-process token buckets for at most `max_keys` clients, least recently seen dropped first."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, limit):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.burst, now))
+            tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            # An idle client's bucket refills anyway, so forgetting it loses nothing
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class DatabaseRateLimitStore(RateLimitStore):
+    """Token buckets in the database, shared by every worker and node. Needs an app context."""
+
+    def take(self, key, limit):
+        key = hashlib.sha256(key.encode()).hexdigest()
+        table = CAPTCHA_RateLimit.__table__
+        now = time.time()
+        refilled = table.c.tokens + (now - table.c.updated_at) * limit.rate
+        refilled = case((refilled > limit.burst, limit.burst), else_=refilled)
+        while True:
+            try:
+                with db.engine.begin() as connection:
+                    # Take the token first, which locks the bucket until the transaction ends
+                    taken = connection.execute(table.update().where(table.c.key == key).values(
+                        tokens=refilled - 1, updated_at=now, full_at=now + (limit.burst - refilled + 1) / limit.rate
+                    ))
+                    if not taken.rowcount:
+                        connection.execute(table.insert().values(
+                            key=key, tokens=limit.burst - 1, updated_at=now, full_at=now + 1 / limit.rate
+                        ))
+                        return 0.0
+                    tokens = connection.execute(select(table.c.tokens).where(table.c.key == key)).scalar_one()
+                    if tokens >= 0:
+                        return 0.0
+                    # There was no whole token to take, so put it back
+                    connection.execute(table.update().where(table.c.key == key).values(
+                        tokens=tokens + 1, full_at=now + (limit.burst - tokens - 1) / limit.rate
+                    ))
+                    return -tokens / limit.rate
+            except IntegrityError:
+                # Another worker created the bucket at the same time, take from that one
+                continue
+
+    def purge(self):
+        """Delete the buckets that have refilled, which are no different from missing ones."""
+        with db.engine.begin() as connection:
+            result = connection.execute(CAPTCHA_RateLimit.__table__.delete().where(CAPTCHA_RateLimit.full_at <= time.time()))
+        return result.rowcount
+
+
+class RateLimiter:
+    """Per-endpoint token bucket limits for each client IP, session and CAPTCHA.
+
+    `limits` maps endpoint names to {scope: '30/minute'}, where scope is 'ip', 'session' or 'captcha'.
+    """
+
+    def __init__(self, limits, store):
+        self.limits = {
+            endpoint: {scope: parse_limit(spec) for scope, spec in scopes.items()}
+            for endpoint, scopes in limits.items()
+        }
+        self.store = store
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._limited = Counter()
+
+    def check(self, endpoint, keys, count=True):
+        """Take a token for every scope of `keys` limited on the endpoint.
+
+        Returns 0 if the request may go ahead, or the seconds to wait before retrying.
+        Pass count=False when re-checking a request that was already counted as allowed.
+        """
+        for scope, limit in self.limits.get(endpoint, {}).items():
+            key = keys.get(scope)
+            if key is None:
+                continue
+            wait = self.store.take(f'{endpoint}:{scope}:{key}', limit)
+            if wait:
+                with self._lock:
+                    self._limited[f'{endpoint}:{scope}'] += 1
+                return wait
+        if count:
+            with self._lock:
+                self._allowed += 1
+        return 0
+
+    def stats(self):
+        """Return how many checks passed and how many were limited, by endpoint and scope."""
+        with self._lock:
+            return {
+                'allowed': self._allowed,
+                'limited': sum(self._limited.values()),
+                'limited_by': dict(self._limited),
+            }
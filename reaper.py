@@ -0,0 +1,129 @@
+import datetime
+import glob
+import os
+import threading
+import time
+from heatmaps import build_heatmaps
+from models import db, delete_old_captchas, CAPTCHA_LIFETIME
+
+
+class Reaper:
+    """Background thread that expires CAPTCHAs, puzzle images, used tokens, used challenges and refilled
+    rate limit buckets in batches.
+
+    Each pass also bins the mouse paths of the hours that can no longer change into heatmaps.
+    """
+
+    def __init__(self, app, interval=60.0, batch_size=500, image_store=None, static_folder='static', used_token_store=None,
+                 replay_store=None, rate_limit_store=None):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.image_store = image_store
+        self.static_folder = static_folder
+        self.used_token_store = used_token_store
+        self.replay_store = replay_store
+        self.rate_limit_store = rate_limit_store
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'errors': 0,
+            'captchas_deleted': 0,
+            'images_deleted': 0,
+            'tokens_deleted': 0,
+            'challenges_deleted': 0,
+            'buckets_deleted': 0,
+            'heatmaps_built': 0,
+            'last_run_seconds': 0.0,
+        }
+
+    def start(self):
+        """Start the reaper thread (again, if this process was forked)."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='captcha-reaper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Ask the reaper thread to exit."""
+        self._stop.set()
+
+    def reap(self):
+        """Run one expiry pass and return what it removed."""
+        started = time.perf_counter()
+        with self.app.app_context():
+            captcha_ids = delete_old_captchas(db.session, self.batch_size)
+            tokens_deleted = self.used_token_store.purge() if self.used_token_store is not None else 0
+            challenges_deleted = self.replay_store.purge() if self.replay_store is not None else 0
+            # In-memory buckets are bounded on their own, only shared stores need purging
+            buckets_deleted = self.rate_limit_store.purge() if hasattr(self.rate_limit_store, 'purge') else 0
+            # An attempt is rewritten if its CAPTCHA is checked again, which can happen until the CAPTCHA is reaped
+            settled = datetime.datetime.utcnow() - CAPTCHA_LIFETIME - datetime.timedelta(seconds=self.interval)
+            with db.engine.begin() as connection:
+                heatmaps_built = build_heatmaps(connection, settled)
+
+        images_deleted = 0
+        if self.image_store is not None:
+            for captcha_id in captcha_ids:
+                self.image_store.delete(captcha_id)
+            if hasattr(self.image_store, 'purge'):
+                images_deleted += self.image_store.purge()
+        images_deleted += self._delete_static_puzzles()
+
+        result = {
+            'captchas_deleted': len(captcha_ids),
+            'images_deleted': images_deleted,
+            'tokens_deleted': tokens_deleted,
+            'challenges_deleted': challenges_deleted,
+            'buckets_deleted': buckets_deleted,
+            'heatmaps_built': heatmaps_built,
+            'seconds': time.perf_counter() - started,
+        }
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['captchas_deleted'] += result['captchas_deleted']
+            self._stats['images_deleted'] += result['images_deleted']
+            self._stats['tokens_deleted'] += result['tokens_deleted']
+            self._stats['challenges_deleted'] += result['challenges_deleted']
+            self._stats['buckets_deleted'] += result['buckets_deleted']
+            self._stats['heatmaps_built'] += result['heatmaps_built']
+            self._stats['last_run_seconds'] = result['seconds']
+        self.app.logger.info(
+            'Reaped %(captchas_deleted)d captchas, %(images_deleted)d images, %(tokens_deleted)d used tokens, '
+            '%(challenges_deleted)d used challenges and %(buckets_deleted)d rate limit buckets and built '
+            '%(heatmaps_built)d heatmaps in %(seconds).3fs', result
+        )
+        return result
+
+    def stats(self):
+        """Return a snapshot of the reaper counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    def _delete_static_puzzles(self):
+        # Puzzle images used to be written to static/, remove any that have expired
+        cutoff = time.time() - CAPTCHA_LIFETIME.total_seconds()
+        deleted = 0
+        for path in glob.glob(os.path.join(self.static_folder, 'puzzle_*.png')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    deleted += 1
+            except OSError:
+                continue
+        return deleted
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reap()
+            except Exception:
+                with self._lock:
+                    self._stats['errors'] += 1
+                self.app.logger.exception('CAPTCHA reaper pass failed')
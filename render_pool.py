@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from backgrounds import create_background_source
+from puzzle import DEFAULT_ENCODINGS, IMAGE_FORMATS, Puzzle, generate_puzzle, transcode_image
+
+# Background source of a render worker process, built by _init_worker
+_worker_background_source = None
+
+
+def _init_worker(background_settings):
+    global _worker_background_source
+    _worker_background_source = create_background_source(**background_settings)
+
+
+def _render_batch(count, encodings):
+    """Render puzzles in a worker and copy their encoded images into one shared memory block.
+
+    Returns the block name and a (correct_x, correct_y, images) entry per puzzle, where images
+    lists (mimetype, offset, length, encode seconds), so only a few numbers go back through the pipe.
+    """
+    puzzles = [generate_puzzle(_worker_background_source, encodings) for _ in range(count)]
+    size = sum(len(data) for puzzle in puzzles for data in puzzle.images.values())
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layout = []
+    offset = 0
+    for puzzle in puzzles:
+        images = []
+        for mimetype, data in puzzle.images.items():
+            block.buf[offset:offset + len(data)] = data
+            images.append((mimetype, offset, len(data), puzzle.encode_seconds[mimetype]))
+            offset += len(data)
+        layout.append((puzzle.correct_x, puzzle.correct_y, images))
+    name = block.name
+    block.close()
+    return name, layout
+
+
+def _collect_batch(name, layout):
+    """Copy the puzzles out of a worker's shared memory block and free it."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return [
+            Puzzle(
+                {mimetype: bytes(block.buf[offset:offset + length]) for mimetype, offset, length, _ in images},
+                x,
+                y,
+                {mimetype: seconds for mimetype, _, _, seconds in images}
+            )
+            for x, y, images in layout
+        ]
+    finally:
+        block.close()
+        block.unlink()
+
+
+class RenderPool:
+    """Render puzzles in batches on a persistent pool of worker processes.
+
+    Each worker builds its own background source from `background_settings` (the keyword
+    arguments of create_background_source). With `processes=0` puzzles are rendered in
+    the calling thread from `background_source` instead. Every puzzle is encoded in each of
+    `encodings`, a mapping of IMAGE_FORMATS names to Pillow save options. `fallback_encodings`
+    are only made when a client asks for them, transcoded from the first of `encodings`.
+    """
+
+    def __init__(self, background_source, background_settings, processes=0, chunk_size=4, encodings=DEFAULT_ENCODINGS,
+                 fallback_encodings=None):
+        fallback_encodings = fallback_encodings or {}
+        unknown = (set(encodings) | set(fallback_encodings)) - set(IMAGE_FORMATS)
+        if unknown or not encodings:
+            raise ValueError(f'Unsupported image formats: {sorted(unknown) or "none given"}')
+        self.background_source = background_source
+        self.background_settings = background_settings
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.encodings = encodings
+        # Fallbacks by mimetype, leaving out the formats encoded up front anyway
+        self.fallbacks = {
+            IMAGE_FORMATS[image_format][1]: (image_format, options)
+            for image_format, options in fallback_encodings.items() if image_format not in encodings
+        }
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def start(self):
+        """Start the worker processes (again, if this process was forked)."""
+        with self._lock:
+            # A forked child cannot use its parent's workers, so it starts its own
+            if not self.processes or (self._executor is not None and self._pid == os.getpid()):
+                return
+            self._pid = os.getpid()
+            # Spawned workers do not inherit the threads and locks of the web process
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.background_settings,)
+            )
+
+    def stop(self):
+        """Shut the worker processes down."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(cancel_futures=True)
+
+    def generate_puzzles(self, count):
+        """Render `count` puzzles, spread over the workers in chunks of `chunk_size`."""
+        if not self.processes:
+            puzzles = [generate_puzzle(self.background_source, self.encodings) for _ in range(count)]
+            self._record(puzzles)
+            return puzzles
+
+        self.start()
+        chunks = [min(self.chunk_size, count - start) for start in range(0, count, self.chunk_size)]
+        futures = [self._executor.submit(_render_batch, chunk, self.encodings) for chunk in chunks]
+        puzzles = []
+        error = None
+        for future in futures:
+            # Collect every chunk even after a failure so no shared memory block is left behind
+            try:
+                puzzles.extend(_collect_batch(*future.result()))
+            except Exception as exc:
+                error = error or exc
+        self._record(puzzles)
+        if error is not None:
+            raise error
+        return puzzles
+
+    def mimetypes(self):
+        """Return the mimetypes a puzzle can be served in, most preferred first and fallbacks last."""
+        return [IMAGE_FORMATS[image_format][1] for image_format in self.encodings] + list(self.fallbacks)
+
+    def encode_fallback(self, images, mimetype):
+        """Transcode a puzzle's preferred image into one of the fallback formats, in the calling thread."""
+        image_format, options = self.fallbacks[mimetype]
+        started = time.perf_counter()
+        data = transcode_image(next(iter(images.values())), image_format, **options)
+        self._record_image(mimetype, data, time.perf_counter() - started)
+        return data
+
+    def stats(self):
+        """Return the number, total and average size and encode time of the images of each format."""
+        with self._lock:
+            stats = {mimetype: dict(totals) for mimetype, totals in self._stats.items()}
+        for totals in stats.values():
+            totals['average_bytes'] = totals['bytes'] / totals['images']
+            totals['average_encode_ms'] = 1000 * totals['encode_seconds'] / totals['images']
+        return stats
+
+    def _record(self, puzzles):
+        for puzzle in puzzles:
+            for mimetype, data in puzzle.images.items():
+                self._record_image(mimetype, data, puzzle.encode_seconds[mimetype])
+
+    def _record_image(self, mimetype, data, seconds):
+        with self._lock:
+            totals = self._stats.setdefault(mimetype, {'images': 0, 'bytes': 0, 'encode_seconds': 0.0})
+            totals['images'] += 1
+            totals['bytes'] += len(data)
+            totals['encode_seconds'] += seconds
@@ -0,0 +1,57 @@
+from collections import Counter, defaultdict
+from sqlalchemy import delete, insert, select
+from models import CAPTCHA_Analytics, CAPTCHA_Attempt, CAPTCHA_Rollup
+
+# Columns every rollup row adds up
+ROLLUP_COLUMNS = ('sessions', 'generated', 'solved', 'failed', 'timed_solves', 'timed_fails', 'solve_seconds', 'fail_seconds')
+
+
+def bucket_starts(moment):
+    """Return the (period, start) keys of the hour and day a UTC timestamp falls in."""
+    hour = moment.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    return ('hour', hour), ('day', hour.replace(hour=0))
+
+
+def add_to_rollups(rollups, moment, **counts):
+    """Add counts to the hour and day buckets of `moment` in a defaultdict(Counter)."""
+    for key in bucket_starts(moment):
+        rollups[key].update(counts)
+
+
+def rollup_rows(rollups):
+    """Turn accumulated counts into CAPTCHA_Rollup rows with every column set."""
+    return [
+        {'period': period, 'start': start, **{name: counts.get(name, 0) for name in ROLLUP_COLUMNS}}
+        for (period, start), counts in rollups.items()
+    ]
+
+
+def rebuild_rollups(connection, batch_size=10000):
+    """Recompute every rollup from the raw sessions and attempts and return how many rows were written.
+
+    Solves and fails are counted from the attempts, so a CAPTCHA checked several times only
+    counts with its final outcome, unlike the per-check counts kept while live.
+    """
+    rollups = defaultdict(Counter)
+    streaming = connection.execution_options(yield_per=batch_size)
+
+    for (created_at,) in streaming.execute(select(CAPTCHA_Analytics.created_at)):
+        add_to_rollups(rollups, created_at, sessions=1)
+
+    attempts = streaming.execute(select(
+        CAPTCHA_Attempt.presented_at, CAPTCHA_Attempt.completed_at, CAPTCHA_Attempt.success, CAPTCHA_Attempt.time_taken
+    ))
+    for presented_at, completed_at, success, time_taken in attempts:
+        add_to_rollups(rollups, presented_at, generated=1)
+        if completed_at is None:
+            continue
+        if success:
+            add_to_rollups(rollups, completed_at, solved=1, timed_solves=1, solve_seconds=time_taken or 0.0)
+        else:
+            add_to_rollups(rollups, completed_at, failed=1, timed_fails=1, fail_seconds=time_taken or 0.0)
+
+    connection.execute(delete(CAPTCHA_Rollup))
+    rows = rollup_rows(rollups)
+    if rows:
+        connection.execute(insert(CAPTCHA_Rollup), rows)
+    return len(rows)
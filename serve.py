@@ -0,0 +1,269 @@
+"""Run pCAPTCHA with a master process and a pool of forked worker processes.
+
+Usage: python serve.py [main:app | dashboard:app] [--bind 0.0.0.0:5007] [--workers N] [--threads N]
+
+The master binds the socket and forks the workers, which then import the app, so every
+worker builds its own background cache, compiled script and database engine. The master
+restarts workers that die, reloads them on SIGHUP (new workers first, then the old ones are
+drained, or the old ones keep serving if the new ones fail to boot), and on SIGTERM or SIGINT lets every worker finish its requests before exiting.
+"""
+import argparse
+import atexit
+import importlib
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+logger = logging.getLogger('pcaptcha.serve')
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Werkzeug request handler that closes idle keep-alive connections and logs only errors."""
+
+    # Seconds a connection may sit idle before its thread is freed for another one
+    timeout = 5
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """Werkzeug WSGI server handling connections on a fixed pool of threads."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self._executor.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        # Same as socketserver.ThreadingMixIn, minus the thread per connection
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def drain(self):
+        """Wait for every connection already accepted to be handled."""
+        self._executor.shutdown(wait=True)
+
+
+def load_app(app_path):
+    """Import 'module:attribute' and return the WSGI app."""
+    module_name, _, attribute = app_path.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+def run_worker(app_path, listener, threads, index, ready_fd):
+    """Load the app in a freshly forked worker and serve until told to stop."""
+    # Only the master reloads or interrupts workers; SIGTERM drains them
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # One worker is enough to expire old CAPTCHAs
+    os.environ['PCAPTCHA_RUN_REAPER'] = '1' if index == 0 else '0'
+    app = load_app(app_path)
+    host, port = listener.getsockname()[:2]
+    server = PoolWSGIServer(host, port, app, threads, listener.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs in this very thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+
+    server.serve_forever()
+    server.drain()
+    server.server_close()
+
+
+class Master:
+    """Keep `workers` worker processes serving `app_path` on a shared listening socket."""
+
+    def __init__(self, app_path, listener, workers, threads, graceful_timeout=30.0, boot_timeout=120.0):
+        self.app_path = app_path
+        self.listener = listener
+        self.worker_count = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.boot_timeout = boot_timeout
+        # Serving workers by pid, with their index, and old workers still draining
+        self.workers = {}
+        self.retiring = set()
+        self._signals = []
+
+    def run(self):
+        """Start the workers and supervise them until SIGTERM or SIGINT."""
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+
+        logger.info('Listening on %s:%s with %d workers of %d threads',
+                    *self.listener.getsockname()[:2], self.worker_count, self.threads)
+        try:
+            self.spawn_workers()
+            while True:
+                self.reap_workers()
+                signum = self._signals.pop(0) if self._signals else None
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    logger.info('Shutting down')
+                    return
+                if signum == signal.SIGHUP:
+                    self.reload()
+                elif len(self.workers) < self.worker_count:
+                    self.spawn_workers()
+                time.sleep(0.5)
+        finally:
+            self.stop()
+
+    def reload(self):
+        """Replace every worker with a new one, keeping the old workers if the new ones fail to boot."""
+        logger.info('Reloading workers')
+        old_workers = self.workers
+        self.retiring.update(old_workers)
+        self.workers = {}
+        try:
+            self.spawn_workers()
+        except RuntimeError as exc:
+            logger.error('Reload failed, keeping the old workers: %s', exc)
+            self.retiring.difference_update(old_workers)
+            self.retiring.update(self.workers)
+            self.signal_workers(self.workers, signal.SIGTERM)
+            self.workers = old_workers
+            return
+        self.signal_workers(self.retiring, signal.SIGTERM)
+
+    def spawn_workers(self):
+        """Fork the missing workers, the first one alone so it applies migrations before the rest start."""
+        missing = [index for index in range(self.worker_count) if index not in self.workers.values()]
+        if not self.workers and missing:
+            self._await_ready([self.spawn_worker(missing.pop(0))])
+        self._await_ready([self.spawn_worker(index) for index in missing])
+
+    def spawn_worker(self, index):
+        """Fork one worker and return its pid and the pipe it reports readiness on."""
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(ready_write)
+            self.workers[pid] = index
+            return pid, ready_read
+
+        # Worker process: never return into the master's code
+        os.close(ready_read)
+        code = 0
+        try:
+            run_worker(self.app_path, self.listener, self.threads, index, ready_write)
+        except SystemExit as exc:
+            code = exc.code if isinstance(exc.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            # Flush analytics and stop background workers like a normal interpreter exit would
+            atexit._run_exitfuncs()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _await_ready(self, pending):
+        """Wait until every new worker has loaded the app, or fail if one of them died first."""
+        deadline = time.monotonic() + self.boot_timeout
+        pending = dict((fd, pid) for pid, fd in pending)
+        try:
+            while pending:
+                ready, _, _ = select.select(list(pending), [], [], max(deadline - time.monotonic(), 0))
+                if not ready:
+                    raise RuntimeError('Timed out waiting for workers to boot')
+                for fd in ready:
+                    pid = pending.pop(fd)
+                    booted = os.read(fd, 1)
+                    os.close(fd)
+                    if not booted:
+                        raise RuntimeError(f'Worker {pid} failed to boot')
+                    logger.info('Worker %d (pid %d) ready', self.workers[pid], pid)
+        finally:
+            for fd in pending:
+                os.close(fd)
+
+    def reap_workers(self):
+        """Collect exited workers; the run loop replaces the ones that were still serving."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif self.workers.pop(pid, None) is not None:
+                logger.warning('Worker (pid %d) exited with status %d', pid, os.waitstatus_to_exitcode(status))
+
+    def signal_workers(self, pids, signum):
+        for pid in list(pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(self):
+        """Drain every worker, killing the ones still busy after the graceful timeout."""
+        self.retiring.update(self.workers)
+        self.workers = {}
+        self.signal_workers(self.retiring, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.retiring and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        if self.retiring:
+            logger.warning('Killing %d workers still busy after %.0fs', len(self.retiring), self.graceful_timeout)
+            self.signal_workers(self.retiring, signal.SIGKILL)
+        self.listener.close()
+
+
+def create_listener(bind, backlog=2048):
+    """Bind the listening socket the workers will share."""
+    host, _, port = bind.rpartition(':')
+    listener = socket.create_server((host or '0.0.0.0', int(port)), backlog=backlog)
+    listener.set_inheritable(True)
+    return listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('app', nargs='?', default='main:app', help='module:attribute of the WSGI app')
+    parser.add_argument('--bind', default=os.environ.get('PCAPTCHA_BIND', '0.0.0.0:5007'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PCAPTCHA_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('PCAPTCHA_THREADS', 8)))
+    parser.add_argument('--graceful-timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(process)d] %(message)s')
+    # The app modules are imported by the workers, relative to this file
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    master = Master(args.app, create_listener(args.bind), args.workers, args.threads, args.graceful_timeout)
+    try:
+        master.run()
+    except RuntimeError as exc:
+        logger.error('%s', exc)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,25 @@
 import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import asyncio
+import json
+import tempfile
+from PIL import Image
 
-from main import app
+# Serve backgrounds from a local corpus so the tests do not need network access
+background_dir = tempfile.mkdtemp()
+Image.new('RGB', (250, 250), (40, 90, 160)).save(os.path.join(background_dir, 'background.png'))
+os.environ['PCAPTCHA_BACKGROUND_PATH'] = background_dir
+# As if behind one reverse proxy, which sets X-Forwarded-For
+os.environ['PCAPTCHA_TRUSTED_PROXIES'] = '1'
+
+import main
+from main import app, background_source, challenge_codec, rate_limiter
+from image_store import MemoryImageStore
+from tokens import DatabaseUsedTokenStore
+from ratelimit import DatabaseRateLimitStore, Limit
+from models import db, CAPTCHA, CAPTCHA_RateLimit
+from asgi import app as asgi_app
 
 def test_index_page():
     with app.test_client() as test_client:
@@ -19,6 +36,44 @@ def test_javascript_file():
         assert response.status_code == 200
         assert b'captchaContainer' in response.data
 
+def test_javascript_file_caching():
+    with app.test_client() as test_client:
+        response = test_client.get('/pCaptcha.js')
+        etag = response.headers['ETag']
+
+        assert 'max-age' in response.headers['Cache-Control']
+        assert 'Set-Cookie' not in response.headers
+
+        response = test_client.get('/pCaptcha.js', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+
+        response = test_client.get('/pCaptcha.js', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['ETag'] != etag
+
+def test_local_backgrounds_need_no_network():
+    assert background_source.refill_source is None
+    assert background_source.refill_every == 0
+
+def test_javascript_file_ignores_host_header():
+    with app.test_client() as test_client:
+        response = test_client.get('/pCaptcha.js')
+        forged = test_client.get('/pCaptcha.js', headers={'Host': "evil.example');alert(1);//"})
+
+        assert b'evil.example' not in forged.data
+        assert forged.headers['ETag'] == response.headers['ETag']
+        assert b'document.currentScript.src' in response.data
+
+def test_javascript_file_base_url():
+    app.config['PCAPTCHA_BASE_URL'] = 'https://captcha.example/"quoted"'
+    try:
+        with app.test_client() as test_client:
+            response = test_client.get('/pCaptcha.js')
+    finally:
+        app.config['PCAPTCHA_BASE_URL'] = None
+
+    assert b'const baseUrl = "https://captcha.example/\\"quoted\\"/" ||' in response.data
+
 def test_captcha_generation():
     with app.test_client() as test_client:
         response = test_client.get('/generate_puzzle_piece')
@@ -28,18 +83,249 @@ def test_captcha_generation():
         assert b'captcha_id' in response.data
         assert b'image' in response.data
 
+def test_puzzle_image():
+    with app.test_client() as test_client:
+        captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+        response = test_client.get(f'/puzzle/{captcha_id}', headers={'Accept': 'image/webp,*/*;q=0.8'})
+
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert 'private' in response.headers['Cache-Control']
+        assert 'Accept' in response.headers['Vary']
+
+        # Only the preferred format is encoded up front, the fallback on first request
+        assert list(main.image_store.get(captcha_id)[0]) == ['image/webp']
+        response = test_client.get(f'/puzzle/{captcha_id}', headers={'Accept': 'image/png'})
+        assert response.status_code == 200
+        assert response.mimetype == 'image/jpeg'
+        assert response.data.startswith(b'\xff\xd8')
+        assert list(main.image_store.get(captcha_id)[0]) == ['image/webp', 'image/jpeg']
+
+def test_configured_image_store():
+    shared_store = MemoryImageStore(ttl=300)
+    app.config['PCAPTCHA_IMAGE_STORE'] = shared_store
+    try:
+        with app.test_client() as test_client:
+            captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+
+            assert shared_store.get(captcha_id) is not None
+            assert main.reaper.image_store is shared_store
+            assert test_client.get(f'/puzzle/{captcha_id}').status_code == 200
+    finally:
+        app.config['PCAPTCHA_IMAGE_STORE'] = None
+
+    with app.test_client() as test_client:
+        test_client.get('/')
+    assert main.image_store is main.memory_image_store
+
+def test_missing_puzzle_image():
+    with app.test_client() as test_client:
+        response = test_client.get('/puzzle/captchaId')
+
+        assert response.status_code == 404
+
 def test_position_check():
     with app.test_client() as test_client:
-        response = test_client.post('/check_position', json={'captcha_id':'captchaId','x':'20','y':'30','mouse_movements':{}})
+        response = test_client.post('/check_position', json={'captcha_id':'captchaId','x':20,'y':30,'mouse_movements':{}})
         
         assert response.status_code == 404
         assert b'"success":false' in response.data
         assert b'"message":"CAPTCHA not found"' in response.data
 
+def test_position_check_invalid():
+    with app.test_client() as test_client:
+        captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+        for body in [[1, 2], {'captcha_id': captcha_id, 'x': None, 'y': 30}, {'captcha_id': captcha_id, 'x': '5', 'y': 30},
+                     {'captcha_id': captcha_id, 'x': 20, 'y': True}, {'captcha_id': {'id': captcha_id}, 'x': 20, 'y': 30},
+                     {'captcha_id': None, 'x': 20, 'y': 30}, {'x': 20, 'y': 30}]:
+            response = test_client.post('/check_position', json=body)
+
+            assert response.status_code == 400
+            assert b'"message":"Invalid request"' in response.data
+
+def test_position_check_too_large():
+    with app.test_client() as test_client:
+        movements = [{'x': 1, 'y': 2, 'time': 3}] * 20000
+        response = test_client.post('/check_position', json={'captcha_id': 'captchaId', 'x': 20, 'y': 30, 'mouse_movements': movements})
+
+        assert response.status_code == 413
+        assert b'"success":false' in response.data
+
+def test_stateless_challenge():
+    app.config['PCAPTCHA_STATELESS'] = True
+    try:
+        with app.test_client() as test_client:
+            captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+            challenge = challenge_codec.open(captcha_id)
+            position = {'captcha_id': captcha_id, 'x': challenge.correct_x, 'y': challenge.correct_y, 'mouse_movements': []}
+
+            response = test_client.post('/check_position', json=position)
+            assert response.status_code == 200
+            assert b'"success":true' in response.data
+
+            # A challenge can only be checked once
+            response = test_client.post('/check_position', json=position)
+            assert response.status_code == 404
+    finally:
+        app.config['PCAPTCHA_STATELESS'] = False
+
+def test_stateless_challenge_shared_replay_store():
+    app.config['PCAPTCHA_STATELESS'] = True
+    app.config['PCAPTCHA_REPLAY_STORE'] = 'challenge:DatabaseReplayStore'
+    try:
+        remembered_in_process = len(main.replay_filter)
+        with app.test_client() as test_client:
+            captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+            position = {'captcha_id': captcha_id, 'x': 0, 'y': 0}
+            assert test_client.post('/check_position', json=position).status_code == 200
+            assert test_client.post('/check_position', json=position).status_code == 404
+
+        # The replay was caught by the database every worker shares, not by this process's filter
+        assert len(main.replay_filter) == remembered_in_process
+        assert main.reaper.replay_store is main.replay_store is not main.replay_filter
+    finally:
+        app.config['PCAPTCHA_STATELESS'] = False
+        app.config['PCAPTCHA_REPLAY_STORE'] = None
+
 def test_captcha_verification():
     with app.test_client() as test_client:
         response = test_client.post('/verify_captcha', json={'token':'0','ip_address':'0.0.0.0','user_agent':''})
         
         assert response.status_code == 200
         assert b'"success":false' in response.data
-        assert b'"message":"Invalid token!"' in response.data
\ No newline at end of file
+        assert b'"message":"Invalid token!"' in response.data
+
+def test_rate_limit():
+    rate_limiter.limits['metrics'] = {'ip': Limit(rate=0.001, burst=1)}
+    try:
+        with app.test_client() as test_client:
+            assert test_client.get('/metrics').status_code == 200
+            response = test_client.get('/metrics')
+
+            assert response.status_code == 429
+            assert int(response.headers['Retry-After']) > 0
+    finally:
+        del rate_limiter.limits['metrics']
+
+def test_rate_limit_forwarded_client():
+    rate_limiter.limits['metrics'] = {'ip': Limit(rate=0.001, burst=1)}
+    try:
+        with app.test_client() as test_client:
+            assert test_client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.1'}).status_code == 200
+            assert test_client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.1'}).status_code == 429
+            assert test_client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.2'}).status_code == 200
+    finally:
+        del rate_limiter.limits['metrics']
+
+def test_configured_rate_limit_store():
+    rate_limiter.limits['metrics'] = {'ip': Limit(rate=0.001, burst=1)}
+    app.config['PCAPTCHA_RATE_LIMIT_STORE'] = 'ratelimit:DatabaseRateLimitStore'
+    # The database outlives the test run, and so would the bucket emptied last time
+    with app.app_context():
+        db.session.query(CAPTCHA_RateLimit).delete()
+        db.session.commit()
+    try:
+        with app.test_client() as test_client:
+            assert test_client.get('/metrics').status_code == 200
+            assert test_client.get('/metrics').status_code == 429
+            assert isinstance(rate_limiter.store, DatabaseRateLimitStore)
+            assert main.reaper.rate_limit_store is rate_limiter.store
+    finally:
+        del rate_limiter.limits['metrics']
+        app.config['PCAPTCHA_RATE_LIMIT_STORE'] = None
+
+def solve_captcha(test_client):
+    """Solve a CAPTCHA the honest way and return the verification token."""
+    captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+    with app.app_context():
+        captcha = db.session.get(CAPTCHA, captcha_id)
+        x, y = captcha.correct_x, captcha.correct_y
+    response = test_client.post('/check_position', json={'captcha_id': captcha_id, 'x': x, 'y': y},
+                                headers={'User-Agent': 'Browser'})
+    return response.get_json()['token']
+
+def test_solved_captcha_is_used_up():
+    with app.test_client() as test_client:
+        captcha_id = test_client.get('/generate_puzzle_piece').get_json()['captcha_id']
+        with app.app_context():
+            captcha = db.session.get(CAPTCHA, captcha_id)
+            position = {'captcha_id': captcha_id, 'x': captcha.correct_x, 'y': captcha.correct_y}
+
+        assert test_client.post('/check_position', json=position).get_json()['success'] is True
+        response = test_client.post('/check_position', json=position)
+        assert response.status_code == 404
+        assert 'token' not in response.get_json()
+
+def test_token_verifies_once():
+    with app.test_client() as test_client:
+        token = solve_captcha(test_client)
+        identity = {'token': token, 'ip-address': '127.0.0.1', 'user-agent': 'Browser'}
+
+        assert test_client.post('/verify_captcha', json={**identity, 'user-agent': 'Other'}).get_json()['message'] == 'Identity mismatch!'
+        assert test_client.post('/verify_captcha', json=identity).get_json()['success'] is True
+        assert test_client.post('/verify_captcha', json=identity).get_json()['message'] == 'Token already used!'
+
+def test_token_verifies_once_with_shared_store():
+    app.config['PCAPTCHA_USED_TOKEN_STORE'] = 'tokens:DatabaseUsedTokenStore'
+    remembered_in_process = len(main.memory_used_token_store)
+    try:
+        with app.test_client() as test_client:
+            token = solve_captcha(test_client)
+            identity = {'token': token, 'ip-address': '127.0.0.1', 'user-agent': 'Browser'}
+
+            assert test_client.post('/verify_captcha', json=identity).get_json()['success'] is True
+            assert test_client.post('/verify_captcha', json=identity).get_json()['message'] == 'Token already used!'
+            assert isinstance(main.token_verifier.used_tokens, DatabaseUsedTokenStore)
+            assert main.reaper.used_token_store is main.token_verifier.used_tokens
+            assert len(main.memory_used_token_store) == remembered_in_process
+    finally:
+        app.config['PCAPTCHA_USED_TOKEN_STORE'] = None
+
+def test_bulk_token_verification():
+    with app.test_client() as test_client:
+        tokens = [solve_captcha(test_client) for _ in range(2)]
+        items = [{'token': token, 'ip-address': '127.0.0.1', 'user-agent': 'Browser'} for token in tokens]
+        response = test_client.post('/verify_captcha/bulk', json={'tokens': items + [items[0], {'token': '0'}]})
+
+        assert response.status_code == 200
+        assert [result['success'] for result in response.get_json()['results']] == [True, True, False, False]
+        assert test_client.post('/verify_captcha/bulk', json={'tokens': 'nope'}).status_code == 400
+
+def asgi_request(method, path, body=b'', headers=()):
+    """Send one request through the ASGI app and return its status, headers and body."""
+    scope = {
+        'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'localhost')] + list(headers),
+        'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+def test_asgi_generation_and_check():
+    status, headers, body = asgi_request('GET', '/generate_puzzle_piece')
+    assert status == 200
+    captcha_id = json.loads(body)['captcha_id']
+    cookie = headers[b'set-cookie'].split(b';', 1)[0]
+
+    status, _, body = asgi_request(
+        'POST', '/check_position',
+        json.dumps({'captcha_id': captcha_id, 'x': 0, 'y': 0}).encode(),
+        [(b'content-type', b'application/json'), (b'cookie', cookie)]
+    )
+    assert status == 200
+    assert json.loads(body)['success'] is False
+
+def test_asgi_rejects_oversized_body():
+    status, _, _ = asgi_request('POST', '/check_position', b'x' * (2 * 1024 * 1024))
+
+    assert status == 413
@@ -0,0 +1,115 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import datetime
+import html
+import re
+import tempfile
+import pytest
+
+# The dashboard reads its database from the environment when it is imported
+database_dir = tempfile.mkdtemp()
+os.environ['PCAPTCHA_DATABASE_URI'] = f"sqlite:///{os.path.join(database_dir, 'dashboard.db')}"
+os.environ['PCAPTCHA_THUMBNAIL_PROCESSES'] = '0'
+
+from dashboard import app
+from models import db, CAPTCHA_Analytics
+
+PAGE_SIZE = 5
+START = datetime.datetime(2024, 1, 1, 12, 0)
+
+# Twelve sessions whose counts and creation times repeat, so every sort key has ties
+SESSIONS = [
+    {
+        'session_id': f's{number:02d}',
+        'captchas_generated': number % 3,
+        'captchas_solved': number % 2,
+        'captchas_failed': number // 4,
+        'created_at': START + datetime.timedelta(minutes=number // 2),
+    }
+    for number in range(12)
+]
+SORT_KEYS = {
+    'created_at': 'created_at',
+    'generated': 'captchas_generated',
+    'solved': 'captchas_solved',
+    'failed': 'captchas_failed',
+}
+
+app.config['PCAPTCHA_SESSIONS_PAGE_SIZE'] = PAGE_SIZE
+with app.app_context():
+    db.session.add_all(CAPTCHA_Analytics(**values) for values in SESSIONS)
+    db.session.commit()
+
+def expected_order(sort, order, sessions=SESSIONS):
+    key = SORT_KEYS[sort]
+    ordered = sorted(sessions, key=lambda values: (values[key], values['session_id']), reverse=order == 'desc')
+    return [values['session_id'] for values in ordered]
+
+def read_page(test_client, url):
+    response = test_client.get(url)
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    links = {label: html.unescape(href) for href, label in re.findall(r'href="([^"]+)">(Next page|Previous page|First page)<', page)}
+    return re.findall(r'>(s\d\d)<', page), links
+
+def walk(test_client, url, link):
+    pages = []
+    while url:
+        rows, links = read_page(test_client, url)
+        pages.append(rows)
+        url = links.get(link)
+    return pages, links
+
+@pytest.mark.parametrize('sort', SORT_KEYS)
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_sessions_pages_follow_on(sort, order):
+    with app.test_client() as test_client:
+        pages, last_links = walk(test_client, f'/sessions?sort={sort}&order={order}', 'Next page')
+
+        assert [len(rows) for rows in pages] == [5, 5, 2]
+        assert sum(pages, []) == expected_order(sort, order)
+
+        previous_pages, first_links = walk(test_client, last_links['Previous page'], 'Previous page')
+        assert previous_pages == pages[-2::-1]
+        assert 'First page' not in first_links and 'Next page' in first_links
+
+        rows, links = read_page(test_client, last_links['First page'])
+        assert rows == pages[0]
+        assert 'Previous page' not in links
+
+def test_sessions_filters_carry_over_pages():
+    filtered = [values for values in SESSIONS if values['session_id'].startswith('s0') and values['created_at'] >= START + datetime.timedelta(minutes=1)]
+    with app.test_client() as test_client:
+        pages, _ = walk(test_client, '/sessions?session=s0&since=2024-01-01T12:01&sort=generated&order=desc', 'Next page')
+
+        assert [len(rows) for rows in pages] == [5, 3]
+        assert sum(pages, []) == expected_order('generated', 'desc', filtered)
+
+        _, links = read_page(test_client, '/sessions?session=s0&since=2024-01-01T12:01&sort=generated&order=desc')
+        assert 'session=s0' in links['Next page'] and 'since=2024-01-01T12:01' in links['Next page']
+
+@pytest.mark.parametrize('query', [
+    'after=yesterday&after_id=s01',
+    'sort=generated&after=2024-01-01T12:00:00&after_id=s01',
+    'after=2024-01-01T12:00:00',
+    'before_id=s01',
+    'after=2024-01-01T12:00:00&after_id=s01&before=2024-01-01T12:00:00&before_id=s01',
+    'sort=session_id',
+    'order=sideways',
+])
+def test_sessions_rejects_invalid_cursors(query):
+    with app.test_client() as test_client:
+        response = test_client.get(f'/sessions?{query}')
+
+        assert response.status_code == 400
+
+def test_sessions_page_is_streamed():
+    with app.test_client() as test_client:
+        response = test_client.get('/sessions?order=asc')
+
+        assert response.is_streamed
+        page = response.get_data(as_text=True)
+        assert page.rstrip().endswith('</html>')
+        assert re.findall(r'>(s\d\d)<', page) == expected_order('created_at', 'asc')[:PAGE_SIZE]
+        assert 'Next page' in page
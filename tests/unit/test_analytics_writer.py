@@ -0,0 +1,41 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from flask import Flask
+from analytics_writer import AnalyticsWriter
+from models import db, CAPTCHA_Analytics, CAPTCHA_Attempt, CAPTCHA_Traffic
+from trajectory import Trajectory, decode
+
+def test_writer_batches_and_coalesces_events():
+    """
+    GIVEN an AnalyticsWriter
+    WHEN a session generates two CAPTCHAs, solves one and fails the other
+    THEN check the session row, its counters, its attempts and the traffic counters are written
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    writer = AnalyticsWriter(app, flush_interval=60)
+    writer.count('script_loads', 3)
+    writer.count('sessions_started')
+    writer.captcha_generated('session', 'first')
+    writer.captcha_generated('session', 'second')
+    writer.attempt_completed('session', 'first', True, Trajectory([1], [2], [3]))
+    writer.attempt_completed('session', 'second', False, None)
+    writer.stop()
+
+    with app.app_context():
+        analytics = db.session.get(CAPTCHA_Analytics, 'session')
+        attempts = {attempt.captcha_id: attempt for attempt in db.session.query(CAPTCHA_Attempt)}
+
+        assert (analytics.captchas_generated, analytics.captchas_solved, analytics.captchas_failed) == (2, 1, 1)
+        assert attempts['first'].success is True
+        assert decode(attempts['first'].mouse_trajectory).x.tolist() == [1]
+        assert attempts['second'].success is False
+        assert attempts['second'].completed_at is not None
+        traffic = db.session.query(CAPTCHA_Traffic).one()
+        assert (traffic.script_loads, traffic.sessions_started) == (3, 1)
+    assert writer.stats()['written'] == 4
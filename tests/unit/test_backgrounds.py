@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import tarfile
+import pytest
+from PIL import Image
+from backgrounds import CachedBackgroundSource
+
+def test_load_directory_corpus(tmp_path):
+    """
+    GIVEN a directory holding a differently sized image and a non-image file
+    WHEN it is loaded into a CachedBackgroundSource
+    THEN check only the image is cached, decoded as 250x250 RGBA
+    """
+    Image.new('RGB', (400, 300), (255, 0, 0)).save(tmp_path / 'red.jpg')
+    (tmp_path / 'notes.txt').write_text('not an image')
+
+    source = CachedBackgroundSource()
+    source.load(str(tmp_path))
+    background = source.get()
+
+    assert len(source) == 1
+    assert background.size == (250, 250)
+    assert background.mode == 'RGBA'
+
+def test_load_tarball_corpus(tmp_path):
+    """
+    GIVEN a tarball holding two images
+    WHEN it is loaded into a CachedBackgroundSource
+    THEN check both images are cached
+    """
+    for name in ('a.png', 'b.png'):
+        Image.new('RGB', (250, 250)).save(tmp_path / name)
+    tarball = tmp_path / 'corpus.tar.gz'
+    with tarfile.open(tarball, 'w:gz') as archive:
+        archive.add(tmp_path / 'a.png', arcname='a.png')
+        archive.add(tmp_path / 'b.png', arcname='b.png')
+
+    source = CachedBackgroundSource()
+    source.load(str(tarball))
+
+    assert len(source) == 2
+
+def test_cache_evicts_least_recently_used():
+    """
+    GIVEN a CachedBackgroundSource with room for two backgrounds
+    WHEN a third background is added
+    THEN check the oldest background is evicted and the memory limit is kept
+    """
+    source = CachedBackgroundSource(max_bytes=2 * 250 * 250 * 4)
+    for key in ('a', 'b', 'c'):
+        source.add(key, Image.new('RGBA', (250, 250)))
+
+    assert len(source) == 2
+    assert source.stats()['bytes'] == 2 * 250 * 250 * 4
+
+def test_empty_cache_without_refill_source():
+    """
+    GIVEN an empty CachedBackgroundSource without a refill source
+    WHEN a background is requested
+    THEN check a LookupError is raised instead of blocking on I/O
+    """
+    with pytest.raises(LookupError):
+        CachedBackgroundSource().get()
@@ -0,0 +1,79 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import time
+import pytest
+from flask import Flask
+from challenge import ChallengeCodec, DatabaseReplayStore, InvalidChallenge, ReplayFilter
+from models import db
+
+def test_challenge_round_trip():
+    """
+    GIVEN a ChallengeCodec
+    WHEN a challenge is issued and its token opened again
+    THEN check the same challenge is recovered
+    """
+    codec = ChallengeCodec('secret', lifetime=300)
+    challenge, token = codec.issue(48, 153)
+
+    assert codec.open(token) == challenge
+    assert (challenge.correct_x, challenge.correct_y) == (48, 153)
+
+def test_challenge_rejects_tampering_and_other_keys():
+    """
+    GIVEN a token issued by one ChallengeCodec
+    WHEN it is altered, or opened with a different secret
+    THEN check an InvalidChallenge is raised
+    """
+    _, token = ChallengeCodec('secret', lifetime=300).issue(48, 153)
+    tampered = token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')
+
+    with pytest.raises(InvalidChallenge):
+        ChallengeCodec('secret', lifetime=300).open(tampered)
+    with pytest.raises(InvalidChallenge):
+        ChallengeCodec('other secret', lifetime=300).open(token)
+    with pytest.raises(InvalidChallenge):
+        ChallengeCodec('secret', lifetime=300).open('captchaId')
+
+def test_challenge_expiry():
+    """
+    GIVEN a ChallengeCodec issuing challenges that have already expired
+    WHEN the token is opened
+    THEN check an InvalidChallenge is raised
+    """
+    codec = ChallengeCodec('secret', lifetime=-1)
+    _, token = codec.issue(48, 153)
+
+    with pytest.raises(InvalidChallenge):
+        codec.open(token)
+
+def test_replay_filter():
+    """
+    GIVEN a ReplayFilter
+    WHEN the same challenge is added twice
+    THEN check only the first use is accepted
+    """
+    replay_filter = ReplayFilter()
+    expires_at = time.time() + 300
+
+    assert replay_filter.add('challenge', expires_at)
+    assert not replay_filter.add('challenge', expires_at)
+    assert replay_filter.add('other challenge', expires_at)
+
+def test_database_replay_store():
+    """
+    GIVEN a DatabaseReplayStore, shared by every worker using the database
+    WHEN the same challenge is added twice, from two stores, and expired ones are purged
+    THEN check the second use is rejected and only expired challenges are forgotten
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        assert DatabaseReplayStore().add('challenge', time.time() + 300)
+        assert not DatabaseReplayStore().add('challenge', time.time() + 300)
+        assert DatabaseReplayStore().add('expired', time.time() - 1)
+        assert DatabaseReplayStore().purge() == 1
+        assert not DatabaseReplayStore().add('challenge', time.time() + 300)
@@ -0,0 +1,31 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from database import configure_database, create_read_session
+from models import db, CAPTCHA_Analytics
+
+def test_sqlite_is_tuned_and_reads_are_read_only(tmp_path):
+    """
+    GIVEN an app configured with a SQLite database file
+    WHEN connections are opened on the write engine and the read session
+    THEN check WAL mode is enabled and the read session cannot write
+    """
+    app = Flask(__name__)
+    app.config['PCAPTCHA_DATABASE_URI'] = f'sqlite:///{tmp_path / "captchas.db"}'
+    configure_database(app)
+    read_session = create_read_session(app)
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(CAPTCHA_Analytics(session_id='session'))
+        db.session.commit()
+
+        assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert db.session.execute(text('PRAGMA synchronous')).scalar() == 1
+        assert read_session.query(CAPTCHA_Analytics).count() == 1
+        with pytest.raises(OperationalError):
+            read_session.execute(text("DELETE FROM captcha__analytics"))
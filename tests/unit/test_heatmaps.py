@@ -0,0 +1,154 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import datetime
+import io
+import numpy as np
+import pytest
+from flask import Flask
+from PIL import Image
+from heatmaps import build_heatmaps, decode_grid, encode_grid, histogram, load_heatmap, render_heatmap
+from models import db, CAPTCHA_Attempt, CAPTCHA_Heatmap
+from trajectory import Trajectory, encode
+
+START = datetime.datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+
+
+@pytest.fixture
+def attempts(app):
+    """Attempts spread over three days, returned as (completed_at, success, x, y)."""
+    rng = np.random.default_rng(0)
+    rows = []
+    for index in range(300):
+        completed_at = START + datetime.timedelta(minutes=int(rng.integers(0, 3 * 24 * 60)))
+        points = int(rng.integers(0, 20))
+        x, y = rng.integers(-5, 255, points), rng.integers(-5, 255, points)
+        rows.append((completed_at, index % 3 == 0, x, y))
+        db.session.add(CAPTCHA_Attempt(
+            session_id='session', captcha_id=str(index), presented_at=completed_at, completed_at=completed_at,
+            success=index % 3 == 0, mouse_trajectory=encode(Trajectory(x, y, np.arange(points)))
+        ))
+    db.session.commit()
+    return rows
+
+
+def expected_heatmap(attempts, success=None, since=None, until=None):
+    selected = [
+        (x, y) for completed_at, solved, x, y in attempts
+        if (success is None or solved == success)
+        and (since is None or completed_at >= since) and (until is None or completed_at < until)
+    ]
+    grid = np.zeros((250, 250), dtype=np.int64)
+    for x, y in selected:
+        grid += histogram(x, y)
+    return grid, len(selected)
+
+
+def test_histogram_matches_histogram2d():
+    """
+    GIVEN points on and off the puzzle
+    WHEN they are binned
+    THEN the grid is the one np.histogram2d gives with a bin per pixel
+    """
+    rng = np.random.default_rng(1)
+    x, y = rng.integers(-20, 270, 5000), rng.integers(-20, 270, 5000)
+    expected, _, _ = np.histogram2d(y, x, bins=250, range=((-0.5, 249.5), (-0.5, 249.5)))
+    grid = histogram(x, y)
+    assert np.array_equal(grid, expected.astype(np.int64))
+    assert np.array_equal(decode_grid(encode_grid(grid)), grid)
+
+
+def test_build_heatmaps_writes_hourly_and_daily_grids(app, attempts):
+    """
+    GIVEN three days of attempts
+    WHEN the heatmaps are built up to the middle of the third day
+    THEN every hour before it has a grid, the two whole days have daily grids, and nothing is built twice
+    """
+    until = START + datetime.timedelta(days=2, hours=12, minutes=30)
+    with db.engine.begin() as connection:
+        assert build_heatmaps(connection, until) > 0
+    with db.engine.begin() as connection:
+        assert build_heatmaps(connection, until) == 0
+
+    days = db.session.query(CAPTCHA_Heatmap).filter_by(period='day').all()
+    assert sorted({day.start for day in days}) == [START, START + datetime.timedelta(days=1)]
+    built = db.session.query(db.func.sum(CAPTCHA_Heatmap.attempts)).filter_by(period='hour').scalar()
+    assert built == sum(1 for completed_at, *_ in attempts if completed_at < START + datetime.timedelta(days=2, hours=12))
+    first_day = [day for day in days if day.start == START and day.success]
+    assert np.array_equal(
+        decode_grid(first_day[0].grid),
+        expected_heatmap(attempts, True, START, START + datetime.timedelta(days=1))[0]
+    )
+
+
+def test_build_heatmaps_in_steps(app, attempts):
+    """
+    GIVEN three days of attempts
+    WHEN the heatmaps are built a few hours per call
+    THEN the grids end up the same as the attempts they were binned from
+    """
+    calls = 0
+    while True:
+        with db.engine.begin() as connection:
+            if not build_heatmaps(connection, START + datetime.timedelta(days=4), max_hours=5):
+                break
+        calls += 1
+    assert calls > 3
+
+    with db.engine.connect() as connection:
+        grid, count = load_heatmap(connection, until=START + datetime.timedelta(days=4))
+    expected, expected_count = expected_heatmap(attempts)
+    assert count == expected_count == 300
+    assert np.array_equal(grid, expected)
+
+
+@pytest.mark.parametrize('built_until', [None, START + datetime.timedelta(days=1, hours=5), START + datetime.timedelta(days=5)])
+@pytest.mark.parametrize('success, since, until', [
+    (None, None, None),
+    (True, START + datetime.timedelta(hours=3), START + datetime.timedelta(days=2, hours=7)),
+    (False, START + datetime.timedelta(days=1), START + datetime.timedelta(days=2)),
+    (None, START + datetime.timedelta(days=2, hours=20), None),
+])
+def test_load_heatmap_combines_grids_and_recent_attempts(app, attempts, built_until, success, since, until):
+    """
+    GIVEN attempts with heatmaps built for none, some or all of them
+    WHEN the heatmap of a range of hours is loaded
+    THEN daily, hourly and not yet built attempts add up to the heatmap of exactly the attempts in the range
+    """
+    if built_until is not None:
+        with db.engine.begin() as connection:
+            while build_heatmaps(connection, built_until):
+                pass
+
+    with db.engine.connect() as connection:
+        grid, count = load_heatmap(connection, success, since, until)
+    expected, expected_count = expected_heatmap(attempts, success, since, until)
+    assert count == expected_count
+    assert np.array_equal(grid, expected)
+
+
+def test_render_heatmap():
+    """
+    GIVEN a grid with a few visited cells
+    WHEN it is rendered
+    THEN the busiest cell is white, unvisited cells are black and a visited one is in between
+    """
+    grid = np.zeros((250, 250), dtype=np.int64)
+    grid[10, 20] = 100
+    grid[30, 40] = 2
+    image = Image.open(io.BytesIO(render_heatmap(grid))).convert('RGB')
+    assert image.size == (250, 250)
+    assert image.getpixel((20, 10)) == (255, 255, 255)
+    assert image.getpixel((0, 0)) == (0, 0, 0)
+    assert image.getpixel((40, 30)) not in ((0, 0, 0), (255, 255, 255))
+    assert render_heatmap(np.zeros((250, 250), dtype=np.int64)).startswith(b'\x89PNG')
@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import time
+from image_store import MemoryImageStore
+
+def test_memory_image_store_round_trip():
+    """
+    GIVEN a MemoryImageStore
+    WHEN an image is stored
+    THEN check its encodings are returned with the remaining lifetime
+    """
+    store = MemoryImageStore(ttl=300)
+    store.put('captcha', {'image/webp': b'webp', 'image/png': b'png'})
+    images, seconds_left = store.get('captcha')
+
+    assert images == {'image/webp': b'webp', 'image/png': b'png'}
+    assert 0 < seconds_left <= 300
+
+def test_memory_image_store_expiry():
+    """
+    GIVEN a MemoryImageStore with a very short lifetime
+    WHEN an image has expired
+    THEN check it is no longer served and is purged
+    """
+    store = MemoryImageStore(ttl=0.01)
+    store.put('captcha', {'image/png': b'png'})
+    time.sleep(0.02)
+
+    assert store.get('captcha') is None
+    assert store.purge() == 1
+    assert len(store) == 0
+
+def test_memory_image_store_byte_limit():
+    """
+    GIVEN a MemoryImageStore holding at most 10 bytes of images
+    WHEN more puzzles are stored than fit
+    THEN check the oldest ones are dropped first and the newest are still served
+    """
+    store = MemoryImageStore(ttl=300, max_bytes=10)
+    for index in range(4):
+        store.put(f'captcha-{index}', {'image/webp': b'web', 'image/jpeg': b'j'})
+
+    assert len(store) == 2
+    assert store.get('captcha-0') is None and store.get('captcha-1') is None
+    assert store.get('captcha-3') is not None
+    assert store.stats() == {'puzzles': 2, 'bytes': 8, 'max_bytes': 10, 'evicted': 2}
+
+    store.delete('captcha-3')
+    assert store.stats()['bytes'] == 4
+
+def test_memory_image_store_add_encoding():
+    """
+    GIVEN a stored puzzle
+    WHEN an encoding made later is added to it
+    THEN check it is served alongside the others, counts towards the byte limit and keeps the expiry
+    """
+    store = MemoryImageStore(ttl=300, max_bytes=100)
+    store.put('captcha', {'image/webp': b'webp'})
+    _, seconds_left = store.get('captcha')
+    store.add_encoding('captcha', 'image/jpeg', b'jpeg')
+    store.add_encoding('expired', 'image/jpeg', b'jpeg')
+
+    images, seconds_left_after = store.get('captcha')
+    assert images == {'image/webp': b'webp', 'image/jpeg': b'jpeg'}
+    assert seconds_left_after <= seconds_left
+    assert store.stats()['bytes'] == 8
+    assert store.get('expired') is None
@@ -0,0 +1,51 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+from sqlalchemy import create_engine, insert, inspect, select
+from migrations import MIGRATIONS, migrate
+from models import db, CAPTCHA_Analytics, CAPTCHA_Attempt
+from trajectory import decode
+
+def test_migrate_adds_indexes_to_existing_database():
+    """
+    GIVEN a database created before the lookup indexes existed
+    WHEN it is migrated twice
+    THEN check the indexes are created and the version is recorded once
+    """
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for index in [*CAPTCHA_Attempt.__table__.indexes, *CAPTCHA_Analytics.__table__.indexes]:
+            index.drop(connection)
+
+    assert migrate(engine) == MIGRATIONS[-1][0]
+    assert migrate(engine) == MIGRATIONS[-1][0]
+
+    index_names = {index['name'] for index in inspect(engine).get_indexes('captcha__attempt')}
+    assert 'ix_captcha_attempt_captcha_session' in index_names
+    assert 'ix_captcha_attempt_success_time_taken' in index_names
+    assert 'ix_captcha_analytics_created_at_session' in {index['name'] for index in inspect(engine).get_indexes('captcha__analytics')}
+
+def test_migrate_packs_legacy_mouse_movements():
+    """
+    GIVEN an attempt whose mouse movements are stored as JSON
+    WHEN the database is migrated
+    THEN check they are moved into the packed trajectory column
+    """
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    table = CAPTCHA_Attempt.__table__
+    with engine.begin() as connection:
+        connection.execute(insert(table).values(
+            session_id='session', captcha_id='captcha',
+            mouse_movements=[{'x': 121, 'y': 224, 'time': 10}, {'x': 151, 'y': 226, 'time': 26}]
+        ))
+
+    migrate(engine)
+
+    with engine.connect() as connection:
+        mouse_movements, mouse_trajectory = connection.execute(
+            select(table.c.mouse_movements, table.c.mouse_trajectory)
+        ).one()
+    assert mouse_movements is None
+    assert decode(mouse_trajectory).x.tolist() == [121, 151]
@@ -0,0 +1,22 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import numpy as np
+from PIL import Image
+from puzzle import piece_padding, render_puzzle
+
+def test_render_puzzle_only_touches_the_piece():
+    """
+    GIVEN a plain background
+    WHEN a puzzle piece is rendered at the bottom right corner
+    THEN check the piece is drawn there, clipped to the image, and nothing else changes
+    """
+    background = Image.new('RGBA', (250, 250), (40, 90, 160, 255))
+    rendered = np.asarray(render_puzzle(background, 200, 200))
+    original = np.asarray(background)
+
+    assert rendered.shape == (250, 250, 4)
+    assert not np.array_equal(rendered[200:250, 200:250], original[200:250, 200:250])
+    untouched = 200 - piece_padding
+    assert np.array_equal(rendered[:untouched], original[:untouched])
+    assert np.array_equal(rendered[:, :untouched], original[:, :untouched])
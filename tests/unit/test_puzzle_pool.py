@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import time
+import pytest
+from puzzle import Puzzle
+from puzzle_pool import PuzzlePool
+
+def make_puzzle():
+    return Puzzle({'image/png': b'png'}, 30, 40)
+
+def make_puzzles(count):
+    return [make_puzzle() for _ in range(count)]
+
+def wait_for_size(pool, size, timeout=5):
+    deadline = time.monotonic() + timeout
+    while pool.stats()['size'] < size and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_pool_refills_to_high_watermark():
+    """
+    GIVEN a PuzzlePool with a low watermark of 1 and a high watermark of 4
+    WHEN the pool is started
+    THEN check it is filled to the high watermark and puzzles are served from it
+    """
+    pool = PuzzlePool(make_puzzles, low_watermark=1, high_watermark=4, batch_size=3)
+    pool.start()
+    wait_for_size(pool, 4)
+
+    assert pool.stats()['size'] == 4
+    assert pool.get() == Puzzle({'image/png': b'png'}, 30, 40)
+    assert pool.stats()['served_from_pool'] == 1
+    pool.stop()
+
+def test_pool_falls_back_to_synchronous_rendering():
+    """
+    GIVEN an empty PuzzlePool whose producer is still rendering
+    WHEN a puzzle is requested
+    THEN check the puzzle is rendered synchronously and counted as such
+    """
+    def slow_puzzles(count):
+        time.sleep(0.2)
+        return make_puzzles(count)
+
+    pool = PuzzlePool(slow_puzzles, low_watermark=0, high_watermark=1)
+
+    assert pool.get() == make_puzzle()
+    assert pool.stats()['served_synchronously'] == 1
+    pool.stop()
+
+def test_pool_rejects_invalid_watermarks():
+    """
+    GIVEN watermarks where the low watermark is not below the high watermark
+    WHEN a PuzzlePool is created
+    THEN check a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        PuzzlePool(make_puzzles, low_watermark=8, high_watermark=8)
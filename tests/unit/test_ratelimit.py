@@ -0,0 +1,98 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import time
+import pytest
+from flask import Flask
+from models import db
+from ratelimit import DatabaseRateLimitStore, Limit, MemoryRateLimitStore, RateLimiter, parse_limit
+
+def test_parse_limit():
+    """
+    GIVEN rate limit strings
+    WHEN they are parsed
+    THEN check valid ones become a rate and burst and invalid ones raise ValueError
+    """
+    assert parse_limit('30/minute') == Limit(0.5, 30)
+    assert parse_limit('2/second') == Limit(2, 2)
+    for spec in ('30', '30/fortnight', 'many/minute', '0/minute', None):
+        with pytest.raises(ValueError):
+            parse_limit(spec)
+
+def test_rate_limiter_buckets_per_scope():
+    """
+    GIVEN a limiter allowing two requests per IP and one per CAPTCHA
+    WHEN requests exceed those limits
+    THEN check they are limited per key with a wait time and counted
+    """
+    limiter = RateLimiter({'check': {'ip': '2/minute', 'captcha': '1/minute'}}, MemoryRateLimitStore())
+
+    assert limiter.check('check', {'ip': 'a', 'captcha': 'x'}) == 0
+    assert limiter.check('check', {'ip': 'a', 'captcha': 'x'}) == pytest.approx(60, abs=1)
+    assert limiter.check('check', {'ip': 'b', 'captcha': 'y'}) == 0
+    assert limiter.check('check', {'ip': 'a', 'captcha': 'z'}) > 0
+    assert limiter.check('other', {'ip': 'a'}) == 0
+
+    stats = limiter.stats()
+    assert stats['allowed'] == 3
+    assert stats['limited_by'] == {'check:captcha': 1, 'check:ip': 1}
+
+def test_rate_limiter_recheck_is_not_counted():
+    """
+    GIVEN a request checked once per IP and re-checked per CAPTCHA without counting
+    WHEN the CAPTCHA scope is then exhausted
+    THEN check the request is allowed once and only the rejection is counted
+    """
+    limiter = RateLimiter({'check': {'ip': '5/minute', 'captcha': '1/minute'}}, MemoryRateLimitStore())
+
+    assert limiter.check('check', {'ip': 'a'}) == 0
+    assert limiter.check('check', {'captcha': 'x'}, count=False) == 0
+    assert limiter.stats()['allowed'] == 1
+
+    assert limiter.check('check', {'ip': 'a'}) == 0
+    assert limiter.check('check', {'captcha': 'x'}, count=False) > 0
+
+    stats = limiter.stats()
+    assert stats['allowed'] == 2
+    assert stats['limited_by'] == {'check:captcha': 1}
+
+def test_memory_rate_limit_store_refills_and_is_bounded():
+    """
+    GIVEN a MemoryRateLimitStore for at most two clients
+    WHEN a bucket is emptied and more clients arrive
+    THEN check the bucket refills over time and the least recent client is dropped
+    """
+    store = MemoryRateLimitStore(max_keys=2)
+    fast = Limit(rate=1000, burst=1)
+
+    assert store.take('a', fast) == 0
+    assert 0 < store.take('a', fast) <= 0.001
+    store.take('b', fast)
+    store.take('c', fast)
+    assert len(store) == 2
+
+def test_database_rate_limit_store_is_shared():
+    """
+    GIVEN two limiters, as in two workers, each with its own DatabaseRateLimitStore on one database
+    WHEN they take from the same client's bucket and refilled buckets are purged
+    THEN check the limit holds across both and only refilled buckets are deleted
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    limits = {'check': {'captcha': '2/minute'}, 'fast': {'ip': '1000/second'}}
+    first = RateLimiter(limits, DatabaseRateLimitStore())
+    second = RateLimiter(limits, DatabaseRateLimitStore())
+
+    with app.app_context():
+        db.create_all()
+        assert first.check('check', {'captcha': 'x'}) == 0
+        assert second.check('check', {'captcha': 'x'}) == 0
+        assert first.check('check', {'captcha': 'x'}) == pytest.approx(30, abs=1)
+        assert second.check('check', {'captcha': 'x'}) == pytest.approx(30, abs=1)
+        assert second.check('check', {'captcha': 'y'}) == 0
+
+        assert first.check('fast', {'ip': 'a'}) == 0
+        time.sleep(0.01)
+        assert first.store.purge() == 1
+        assert second.check('check', {'captcha': 'x'}) > 0
@@ -0,0 +1,46 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import datetime
+from flask import Flask
+from image_store import MemoryImageStore
+from models import db, CAPTCHA, CAPTCHA_Analytics, CAPTCHA_Attempt
+from reaper import Reaper
+
+def test_reaper_deletes_expired_rows_and_images(tmp_path):
+    """
+    GIVEN an expired CAPTCHA and a fresh CAPTCHA, each with an attempt
+    WHEN the reaper runs once
+    THEN check only the expired CAPTCHA and its image are removed, and the attempts are kept for analytics
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    image_store = MemoryImageStore(ttl=300)
+
+    with app.app_context():
+        db.create_all()
+        expired = CAPTCHA(correct_x=30, correct_y=40)
+        expired.created_at = datetime.datetime.utcnow() - datetime.timedelta(minutes=10)
+        fresh = CAPTCHA(correct_x=50, correct_y=60)
+        db.session.add_all([
+            expired,
+            fresh,
+            CAPTCHA_Analytics(session_id='kept'),
+            CAPTCHA_Attempt(session_id='kept', captcha_id=fresh.id),
+            CAPTCHA_Attempt(session_id='kept', captcha_id=expired.id),
+        ])
+        db.session.commit()
+        expired_id, fresh_id = expired.id, fresh.id
+
+    image_store.put(expired_id, {'image/png': b'png'})
+    image_store.put(fresh_id, {'image/png': b'png'})
+
+    result = Reaper(app, batch_size=1, image_store=image_store, static_folder=str(tmp_path)).reap()
+
+    assert result['captchas_deleted'] == 1
+    assert image_store.get(expired_id) is None
+    assert image_store.get(fresh_id) is not None
+    with app.app_context():
+        assert db.session.get(CAPTCHA, fresh_id) is not None
+        assert db.session.query(CAPTCHA_Attempt).count() == 2
@@ -0,0 +1,93 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import tempfile
+import pytest
+from PIL import Image
+from backgrounds import create_background_source
+from render_pool import RenderPool
+
+
+@pytest.fixture(scope='module')
+def corpus():
+    with tempfile.TemporaryDirectory() as path:
+        Image.new('RGB', (250, 250), (40, 80, 120)).save(os.path.join(path, 'plain.png'))
+        yield path
+
+
+def test_generate_puzzles_in_process(corpus):
+    """
+    GIVEN a RenderPool without worker processes
+    WHEN a batch of puzzles is requested
+    THEN it renders that many PNG puzzles in the calling process
+    """
+    settings = {'path': corpus}
+    pool = RenderPool(create_background_source(**settings), settings, processes=0)
+    puzzles = pool.generate_puzzles(3)
+    assert len(puzzles) == 3
+    assert all(puzzle.images['image/png'].startswith(b'\x89PNG') for puzzle in puzzles)
+
+
+def test_generate_puzzles_records_encoding_stats(corpus):
+    """
+    GIVEN a RenderPool encoding puzzles as WebP and PNG
+    WHEN puzzles are rendered
+    THEN both encodings are produced in that order and their sizes and encode times are counted
+    """
+    settings = {'path': corpus}
+    pool = RenderPool(create_background_source(**settings), settings, encodings={'webp': {'quality': 80}, 'png': {}})
+    puzzles = pool.generate_puzzles(2)
+    assert [list(puzzle.images) for puzzle in puzzles] == [['image/webp', 'image/png']] * 2
+
+    stats = pool.stats()
+    assert stats['image/webp']['images'] == stats['image/png']['images'] == 2
+    assert stats['image/png']['bytes'] == sum(len(puzzle.images['image/png']) for puzzle in puzzles)
+    assert stats['image/webp']['average_encode_ms'] > 0
+
+
+def test_fallback_encoding_is_made_on_demand(corpus):
+    """
+    GIVEN a RenderPool encoding puzzles as WebP, with JPEG as a fallback
+    WHEN a puzzle is rendered and then asked for as JPEG
+    THEN only WebP is encoded up front, and the JPEG is transcoded from it and counted
+    """
+    settings = {'path': corpus}
+    pool = RenderPool(create_background_source(**settings), settings, encodings={'webp': {}}, fallback_encodings={'jpeg': {}})
+    puzzle = pool.generate_puzzles(1)[0]
+    assert list(puzzle.images) == ['image/webp']
+    assert pool.mimetypes() == ['image/webp', 'image/jpeg']
+
+    assert pool.encode_fallback(puzzle.images, 'image/jpeg').startswith(b'\xff\xd8')
+    assert pool.stats()['image/jpeg']['images'] == 1
+
+
+def test_unknown_image_format_is_rejected():
+    """
+    GIVEN an image format Pillow is not set up to encode puzzles in
+    WHEN a RenderPool is created with it
+    THEN a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        RenderPool(None, {}, encodings={'gif': {}})
+    with pytest.raises(ValueError):
+        RenderPool(None, {}, fallback_encodings={'gif': {}})
+
+
+def test_generate_puzzles_in_workers(corpus):
+    """
+    GIVEN a RenderPool with a worker process
+    WHEN a batch larger than the chunk size is requested
+    THEN every puzzle comes back through shared memory with its encodings and solution
+    """
+    settings = {'path': corpus}
+    pool = RenderPool(None, settings, processes=1, chunk_size=2, encodings={'png': {}, 'jpeg': {'quality': 70}})
+    try:
+        puzzles = pool.generate_puzzles(5)
+    finally:
+        pool.stop()
+    assert len(puzzles) == 5
+    assert pool.stats()['image/jpeg']['images'] == 5
+    for puzzle in puzzles:
+        assert puzzle.images['image/png'].startswith(b'\x89PNG')
+        assert puzzle.images['image/jpeg'].startswith(b'\xff\xd8')
+        assert 25 <= puzzle.correct_x <= 200 and 25 <= puzzle.correct_y <= 200
@@ -0,0 +1,141 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import re
+import signal
+import sqlite3
+import subprocess
+import threading
+import time
+import urllib.request
+from serve import PoolWSGIServer, create_listener, load_app
+
+
+def hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'hello']
+
+
+def test_pool_server_serves_and_drains():
+    """
+    GIVEN a PoolWSGIServer on an already bound listening socket
+    WHEN it serves a request and is shut down
+    THEN the response arrives and the server drains its threads cleanly
+    """
+    listener = create_listener('127.0.0.1:0')
+    host, port = listener.getsockname()
+    server = PoolWSGIServer(host, port, hello_app, threads=2, fd=listener.fileno())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with urllib.request.urlopen(f'http://{host}:{port}/') as response:
+            assert response.read() == b'hello'
+    finally:
+        server.shutdown()
+        thread.join()
+        server.drain()
+        server.server_close()
+        listener.close()
+
+
+def test_load_app():
+    """
+    GIVEN a module:attribute path
+    WHEN it is loaded
+    THEN the attribute of the imported module is returned
+    """
+    assert load_app('serve:load_app') is load_app
+
+
+# Tables of a database last used by the very first version, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE captcha (id VARCHAR(36) PRIMARY KEY, correct_x INTEGER NOT NULL, correct_y INTEGER NOT NULL, created_at DATETIME);
+CREATE TABLE captcha__analytics (session_id VARCHAR(36) PRIMARY KEY, captchas_generated INTEGER, captchas_solved INTEGER,
+                                 captchas_failed INTEGER, created_at DATETIME NOT NULL);
+CREATE TABLE captcha__attempt (id INTEGER PRIMARY KEY, session_id VARCHAR(36) NOT NULL, captcha_id VARCHAR(36) NOT NULL,
+                               presented_at DATETIME NOT NULL, completed_at DATETIME, time_taken FLOAT, success BOOLEAN,
+                               mouse_movements JSON);
+INSERT INTO captcha__analytics VALUES ('baseline-session', 1, 1, 0, '2026-01-01 12:00:00');
+INSERT INTO captcha__attempt VALUES (1, 'baseline-session', 'captcha', '2026-01-01 12:00:00', '2026-01-01 12:00:05', 5.0, 1,
+                                     '[{"x": 10, "y": 20, "time": 0}]');
+"""
+
+# Run in a fresh interpreter, the way a forked worker imports the app
+BOOT_DASHBOARD = """
+from serve import load_app
+app = load_app('dashboard:app')
+client = app.test_client()
+# Each page, with something it can only show once the legacy rows have been migrated
+for path, migrated in [('/', b'</html>'), ('/sessions', b'baseline-session'),
+                       ('/mouse-movement', b'/mouse-movement/1.png'), ('/heatmap', b'/heatmap.png')]:
+    response = client.get(path)
+    print(path, response.status_code, migrated in response.data)
+"""
+
+
+def test_dashboard_boots_on_unmigrated_database(tmp_path):
+    """
+    GIVEN a database created by the first version of pCAPTCHA
+    WHEN dashboard:app is loaded the way serve.py's workers load it and its pages are requested
+    THEN the database is migrated on import and every page renders
+    """
+    database = tmp_path / 'captchas.db'
+    with sqlite3.connect(database) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+    env = {**os.environ, 'PCAPTCHA_DATABASE_URI': f'sqlite:///{database}', 'PCAPTCHA_THUMBNAIL_PROCESSES': '0'}
+    result = subprocess.run([sys.executable, '-c', BOOT_DASHBOARD], cwd=root, env=env,
+                            capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.split('\n')[:4] == [
+        '/ 200 True', '/sessions 200 True', '/mouse-movement 200 True', '/heatmap 200 True'
+    ]
+
+
+def test_failed_reload_keeps_old_workers(tmp_path):
+    """
+    GIVEN serve.py running an app whose module then breaks
+    WHEN the master is told to reload with SIGHUP and the new workers fail to import it
+    THEN the old workers keep serving and the master still shuts down cleanly
+    """
+    module = tmp_path / 'reloadable.py'
+    module.write_text(
+        'def app(environ, start_response):\n'
+        '    start_response("200 OK", [("Content-Type", "text/plain")])\n'
+        '    return [b"hello"]\n'
+    )
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+    env = {**os.environ, 'PYTHONPATH': str(tmp_path)}
+    master = subprocess.Popen(
+        [sys.executable, os.path.join(root, 'serve.py'), 'reloadable:app', '--bind', '127.0.0.1:0', '--workers', '2',
+         '--threads', '2'], cwd=tmp_path, env=env, stderr=subprocess.PIPE, text=True
+    )
+    lines = []
+    reader = threading.Thread(target=lambda: lines.extend(master.stderr), daemon=True)
+    reader.start()
+
+    def wait_for(text):
+        deadline = time.monotonic() + 60
+        while not any(text in line for line in lines):
+            assert time.monotonic() < deadline, ''.join(lines)
+            time.sleep(0.1)
+        return next(line for line in lines if text in line)
+
+    try:
+        port = re.search(r'Listening on 127\.0\.0\.1:(\d+)', wait_for('Listening on')).group(1)
+        wait_for('Worker 1 ')
+        module.write_text('raise ImportError("broken deploy")\n')
+        master.send_signal(signal.SIGHUP)
+        wait_for('Reload failed')
+
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=10) as response:
+            assert response.read() == b'hello'
+        assert master.poll() is None
+    finally:
+        master.terminate()
+        master.wait(timeout=60)
+        reader.join(timeout=10)
+
+    assert master.returncode == 0, ''.join(lines)
@@ -0,0 +1,176 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import datetime
+import io
+import multiprocessing
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from thumbnails import ThumbnailCache, ThumbnailRenderer, palette, rasterize, render_thumbnail, speed_colors, svg_thumbnail
+from trajectory import Trajectory, encode_movements
+
+COMPLETED_AT = datetime.datetime(2026, 1, 1, 12)
+
+
+def path(points):
+    return encode_movements([{'x': 20 + i, 'y': 30 + i, 'time': 10 * i} for i in range(points)])
+
+
+def test_render_thumbnail_draws_path_on_outcome_color():
+    """
+    GIVEN a solved attempt's packed mouse path and a failed attempt's legacy movements
+    WHEN their thumbnails are rendered
+    THEN each is a PNG on green or red with the path drawn in blue
+    """
+    solved = Image.open(io.BytesIO(render_thumbnail(path(5), None, True))).convert('RGB')
+    assert solved.size == (250, 250)
+    assert solved.getpixel((200, 200)) == (0, 255, 0)
+    assert solved.getpixel((20, 30)) == (0, 0, 255)
+
+    failed = Image.open(io.BytesIO(render_thumbnail(None, [{'x': 100, 'y': 100, 'time': 0}], False))).convert('RGB')
+    assert failed.getpixel((200, 200)) == (255, 0, 0)
+    assert failed.getpixel((100, 100)) == (0, 0, 255)
+
+
+def test_rasterize_matches_drawn_dots():
+    """
+    GIVEN random points on and around the puzzle
+    WHEN they are rasterized as dots
+    THEN the image is pixel for pixel the one ImageDraw drew an ellipse per point for
+    """
+    rng = np.random.default_rng(0)
+    x, y = rng.integers(-10, 260, 500), rng.integers(-10, 260, 500)
+    expected = Image.new('RGB', (250, 250), (255, 0, 0))
+    draw = ImageDraw.Draw(expected)
+    for x_coord, y_coord in zip(x.tolist(), y.tolist()):
+        if 0 <= x_coord < 250 and 0 <= y_coord < 250:
+            draw.ellipse((x_coord - 2, y_coord - 2, x_coord + 2, y_coord + 2), fill='blue')
+
+    drawn = palette(False)[rasterize(Trajectory(x, y, np.arange(500)))]
+    assert np.array_equal(drawn, np.asarray(expected))
+
+
+def test_rasterize_velocity_colors_segments_by_speed():
+    """
+    GIVEN a path moving slowly and then fast
+    WHEN it is rasterized with velocity coloring
+    THEN the line is drawn continuously, in the slowest color first and the fastest after
+    """
+    trajectory = Trajectory(np.array([10, 50, 200]), np.array([100, 100, 100]), np.array([0, 400, 410]))
+    drawn = palette(True)[rasterize(trajectory, 'velocity')]
+    colors = speed_colors()
+    assert (drawn[100, 10:48] == colors[0]).all()
+    assert (drawn[100, 52:201] == colors[-1]).all()
+    assert (drawn[99, 30] == colors[0]).all() and (drawn[97, 30] == (0, 255, 0)).all()
+
+
+def test_svg_thumbnail():
+    """
+    GIVEN an attempt's mouse path
+    WHEN it is described as an SVG in either style
+    THEN the outcome color fills the background and the path is drawn by the browser
+    """
+    points = svg_thumbnail(path(3), None, True)
+    assert points.startswith('<svg xmlns="http://www.w3.org/2000/svg"')
+    assert 'fill="#00ff00"' in points and 'M20 30h0M21 31h0M22 32h0' in points
+
+    velocity = svg_thumbnail(path(3), None, False, style='velocity')
+    assert 'fill="#ff0000"' in velocity and 'M20 30L21 31M21 31L22 32' in velocity
+    assert svg_thumbnail(None, None, True) is None
+
+
+def test_render_thumbnail_without_path():
+    """
+    GIVEN attempts without mouse data or with an empty path
+    WHEN their thumbnails are rendered
+    THEN there is nothing to draw
+    """
+    assert render_thumbnail(None, None, True) is None
+    assert render_thumbnail(path(0), None, True) is None
+
+
+def test_cache_is_stamped_with_completion_time():
+    """
+    GIVEN a cached thumbnail
+    WHEN it is looked up with the same or a later completion time
+    THEN only the same completion time is a hit, since checking again rewrites the attempt
+    """
+    cache = ThumbnailCache()
+    cache.put(1, COMPLETED_AT, b'png')
+    assert cache.get(1, COMPLETED_AT) == (True, b'png')
+    assert cache.get(1, COMPLETED_AT + datetime.timedelta(seconds=1)) == (False, None)
+    assert cache.get(2, COMPLETED_AT) == (False, None)
+
+
+def test_cache_drops_least_recently_used():
+    """
+    GIVEN a cache holding two thumbnails
+    WHEN the older one is read and a third is added
+    THEN the one not read is dropped
+    """
+    cache = ThumbnailCache(max_entries=2)
+    cache.put(1, COMPLETED_AT, b'one')
+    cache.put(2, COMPLETED_AT, b'two')
+    cache.get(1, COMPLETED_AT)
+    cache.put(3, COMPLETED_AT, b'three')
+    assert len(cache) == 2
+    assert cache.get(2, COMPLETED_AT) == (False, None)
+    assert cache.get(1, COMPLETED_AT) == (True, b'one')
+
+
+def test_renderer_caches_what_it_renders():
+    """
+    GIVEN a renderer without worker processes
+    WHEN a batch of attempts is rendered
+    THEN every thumbnail, including the missing one of an attempt without a path, is cached
+    """
+    renderer = ThumbnailRenderer(ThumbnailCache(), processes=0)
+    rows = [(1, COMPLETED_AT, path(5), None, True), (2, COMPLETED_AT, None, None, False)]
+    keys = [(1, COMPLETED_AT), (2, COMPLETED_AT)]
+    assert renderer.missing(keys) == keys
+
+    thumbnails = renderer.render(rows)
+    assert thumbnails[0].startswith(b'\x89PNG') and thumbnails[1] is None
+    assert renderer.missing(keys) == []
+    assert renderer.cache.get(2, COMPLETED_AT) == (True, None)
+
+
+def test_renderer_rejects_unknown_style():
+    """
+    GIVEN a thumbnail style that does not exist
+    WHEN a renderer is created with it
+    THEN it is rejected up front
+    """
+    with pytest.raises(ValueError):
+        ThumbnailRenderer(ThumbnailCache(), style='sparkles')
+
+
+def test_renderer_with_worker_processes():
+    """
+    GIVEN a renderer with a worker process
+    WHEN more attempts than one chunk are rendered
+    THEN the thumbnails come back in order, the same as rendered in process
+    """
+    renderer = ThumbnailRenderer(ThumbnailCache(), processes=1, chunk_size=2, style='velocity')
+    rows = [(i, COMPLETED_AT, path(i), None, i % 2 == 0) for i in range(1, 6)]
+    try:
+        thumbnails = renderer.render(rows)
+    finally:
+        renderer.stop()
+    assert thumbnails == [render_thumbnail(*row[2:], style='velocity') for row in rows]
+
+
+def test_renderer_starts_every_process():
+    """
+    GIVEN a renderer with two worker processes
+    WHEN it is started, before anything is rendered
+    THEN check both processes are already running
+    """
+    running = len(multiprocessing.active_children())
+    renderer = ThumbnailRenderer(ThumbnailCache(), processes=2)
+    renderer.start()
+    try:
+        assert len(multiprocessing.active_children()) == running + 2
+    finally:
+        renderer.stop()
@@ -0,0 +1,105 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import time
+import jwt
+import pytest
+from flask import Flask
+from models import db
+from tokens import (DatabaseUsedTokenStore, ExpiredToken, IdentityMismatch, InvalidToken,
+                    MemoryUsedTokenStore, TokenAlreadyUsed, TokenVerifier)
+
+def make_verifier(lifetime=300):
+    return TokenVerifier('secret', lifetime, MemoryUsedTokenStore())
+
+def test_token_verifies_once():
+    """
+    GIVEN a token issued for a client
+    WHEN it is verified twice for that client
+    THEN check the first verification returns its claims and the second is rejected as a replay
+    """
+    verifier = make_verifier()
+    token = verifier.issue('captcha', 'session', '10.0.0.1', 'Browser')
+
+    assert verifier.verify(token, '10.0.0.1', 'Browser')['captcha_id'] == 'captcha'
+    with pytest.raises(TokenAlreadyUsed):
+        verifier.verify(token, '10.0.0.1', 'Browser')
+
+def test_token_is_a_standard_jwt():
+    """
+    GIVEN a token issued by the verifier
+    WHEN it is decoded with PyJWT
+    THEN check the claims are bound to the client and expire
+    """
+    token = make_verifier().issue('captcha', 'session', '10.0.0.1', 'Browser')
+    claims = jwt.decode(token, 'secret', algorithms=['HS256'])
+
+    assert claims['user_ip'] == '10.0.0.1'
+    assert claims['user_agent'] == 'Browser'
+    assert claims['exp'] > time.time()
+    assert claims['jti']
+
+def test_token_rejections():
+    """
+    GIVEN tokens that are tampered with, expired, foreign or for another client
+    WHEN they are verified
+    THEN check each is rejected with the matching error and none is marked used
+    """
+    verifier = make_verifier()
+    token = verifier.issue('captcha', 'session', '10.0.0.1', 'Browser')
+    header, payload, signature = token.split('.')
+
+    with pytest.raises(InvalidToken):
+        verifier.verify('0', '10.0.0.1', 'Browser')
+    with pytest.raises(InvalidToken):
+        verifier.verify(f'{header}.{payload}.{signature[::-1]}', '10.0.0.1', 'Browser')
+    with pytest.raises(InvalidToken):
+        verifier.verify(jwt.encode({'exp': 2 ** 40, 'jti': 'x'}, 'other', algorithm='HS256'), '10.0.0.1', 'Browser')
+    with pytest.raises(ExpiredToken):
+        make_verifier(lifetime=-1).verify(
+            make_verifier(lifetime=-1).issue('captcha', 'session', '10.0.0.1', 'Browser'), '10.0.0.1', 'Browser'
+        )
+    with pytest.raises(IdentityMismatch):
+        verifier.verify(token, '10.0.0.2', 'Browser')
+    with pytest.raises(IdentityMismatch):
+        verifier.verify(token, '10.0.0.1', 'Other')
+    assert len(verifier.used_tokens) == 0
+
+def test_memory_used_token_store_is_bounded():
+    """
+    GIVEN a MemoryUsedTokenStore holding at most two ids
+    WHEN three tokens are used and expired ones purged
+    THEN check the oldest is evicted, and expired ids are forgotten
+    """
+    store = MemoryUsedTokenStore(max_entries=2)
+    now = time.time()
+
+    assert store.add('a', now + 60)
+    assert not store.add('a', now + 60)
+    assert store.add('b', now + 60)
+    assert store.add('c', now + 60)
+    assert len(store) == 2 and store.evicted == 1
+
+    store = MemoryUsedTokenStore()
+    store.add('expired', now - 1)
+    store.add('fresh', now + 60)
+    assert len(store) == 1
+
+def test_database_used_token_store():
+    """
+    GIVEN a DatabaseUsedTokenStore
+    WHEN the same token id is added twice and expired ids are purged
+    THEN check the second add is rejected and only expired ids are deleted
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    store = DatabaseUsedTokenStore()
+
+    with app.app_context():
+        db.create_all()
+        assert store.add('fresh', int(time.time()) + 60)
+        assert not store.add('fresh', int(time.time()) + 60)
+        assert store.add('expired', int(time.time()) - 1)
+        assert store.purge() == 1
+        assert not store.add('fresh', int(time.time()) + 60)
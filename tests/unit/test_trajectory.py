@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
+import base64
+import json
+import struct
+import numpy as np
+import pytest
+from trajectory import Trajectory, decode, encode, encode_movements, pack_movements, parse_movements, parse_packed_path, simplify
+
+def test_trajectory_round_trip():
+    """
+    GIVEN mouse movements as sent by the client, including a long pause
+    WHEN they are packed and unpacked
+    THEN check the same points come back in a fraction of the JSON size
+    """
+    movements = [{'x': 100 + i % 7, 'y': 50 + i % 3, 'time': 1700000000000 + i * 16} for i in range(300)]
+    movements[150]['time'] += 60000
+    packed = encode_movements(movements)
+    trajectory = decode(packed)
+
+    assert trajectory.x.tolist() == [m['x'] for m in movements]
+    assert trajectory.y.tolist() == [m['y'] for m in movements]
+    assert trajectory.t.tolist() == [m['time'] for m in movements]
+    assert len(packed) * 10 < len(json.dumps(movements))
+
+def test_trajectory_without_compression():
+    """
+    GIVEN a short trajectory
+    WHEN it is packed without compression
+    THEN check it still decodes to the same arrays
+    """
+    trajectory = decode(encode(Trajectory([1, 2, 3], [4, 5, 6], [7, 8, 9]), compress=False))
+
+    assert trajectory.x.tolist() == [1, 2, 3]
+    assert trajectory.t.tolist() == [7, 8, 9]
+
+def test_trajectory_rejects_mismatched_arrays():
+    """
+    GIVEN x, y and t arrays of different lengths
+    WHEN they are packed
+    THEN check a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        encode(Trajectory([1, 2], [3], [4, 5]))
+
+def test_pack_movements_ignores_malformed_input():
+    """
+    GIVEN missing or malformed mouse movements
+    WHEN they are packed for storage
+    THEN check nothing is stored instead of raising
+    """
+    assert pack_movements(None) is None
+    assert pack_movements({}) is None
+    assert pack_movements([{'x': 1}]) is None
+    assert pack_movements([{'x': 'a', 'y': 2, 'time': 3}]) is None
+
+def test_simplify_keeps_shape_and_timing():
+    """
+    GIVEN a trajectory along two straight lines with a corner
+    WHEN it is simplified
+    THEN check only the ends and the corner are kept, with their timestamps
+    """
+    x = list(range(0, 101)) + [100] * 100
+    y = [0] * 101 + list(range(1, 101))
+    t = [1000 + 8 * i for i in range(201)]
+    simplified = simplify(Trajectory(*(np.array(values) for values in (x, y, t))), epsilon=0.5)
+
+    assert simplified.x.tolist() == [0, 100, 100]
+    assert simplified.y.tolist() == [0, 0, 100]
+    assert simplified.t.tolist() == [1000, 1800, 2600]
+
+def test_simplify_caps_point_count():
+    """
+    GIVEN a noisy trajectory that cannot be simplified much
+    WHEN it is simplified to at most 50 points
+    THEN check the first and last points are kept
+    """
+    rng = np.random.default_rng(0)
+    trajectory = Trajectory(rng.integers(0, 250, 1000), rng.integers(0, 250, 1000), np.arange(1000))
+    simplified = simplify(trajectory, epsilon=0.5, max_points=50)
+
+    assert len(simplified.x) == 50
+    assert simplified.t[0] == 0 and simplified.t[-1] == 999
+
+def test_parse_movements_enforces_point_limit():
+    """
+    GIVEN more mouse movements than allowed
+    WHEN they are parsed
+    THEN check they are discarded
+    """
+    movements = [{'x': 1, 'y': 2, 'time': 3}] * 11
+
+    assert parse_movements(movements, max_points=10) is None
+    assert len(parse_movements(movements, max_points=11).x) == 11
+
+def test_parse_packed_path():
+    """
+    GIVEN a mouse path packed by pCaptcha.js as int16 [x, y, ms since previous point] triples
+    WHEN it is parsed
+    THEN check the points come back with cumulative timestamps
+    """
+    path = base64.b64encode(struct.pack('<9h', 10, 20, 0, 12, 21, 16, 15, 23, 17)).decode('ascii')
+    trajectory = parse_packed_path(path, max_points=10)
+
+    assert trajectory.x.tolist() == [10, 12, 15]
+    assert trajectory.y.tolist() == [20, 21, 23]
+    assert trajectory.t.tolist() == [0, 16, 33]
+    assert parse_packed_path(path, max_points=2) is None
+    assert parse_packed_path('not base64!', max_points=10) is None
+    assert parse_packed_path(path[:-4], max_points=10) is None
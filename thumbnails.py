@@ -0,0 +1,250 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from PIL import Image
+from trajectory import decode as decode_trajectory, from_movements
+
+# Width and height of a thumbnail, the size of the puzzle the path was drawn on
+THUMBNAIL_SIZE = 250
+
+# 'points' draws a dot per recorded point, 'velocity' joins them with lines colored by speed
+THUMBNAIL_STYLES = ('points', 'velocity')
+
+SOLVED_COLOR = (0, 255, 0)
+FAILED_COLOR = (255, 0, 0)
+POINT_COLOR = (0, 0, 255)
+# Velocity lines fade from SLOW_COLOR to FAST_COLOR at FAST_SPEED pixels per millisecond and above
+SLOW_COLOR = (0, 0, 255)
+FAST_COLOR = (255, 255, 0)
+FAST_SPEED = 2.0
+# Velocity colors are rounded to this many steps, so an SVG needs one path per step at most
+SPEED_STEPS = 8
+
+
+def _stamp(radius_squared):
+    """Pixel offsets of a dot: the same 5x5 disc ImageDraw.ellipse drew around each point."""
+    dy, dx = np.mgrid[-2:3, -2:3]
+    inside = dx * dx + dy * dy <= radius_squared
+    return dx[inside], dy[inside]
+
+
+_DOT = _stamp(5)
+# Velocity lines are three pixels wide
+_PEN = _stamp(1)
+# Margin drawn around the canvas so stamps near an edge need no clipping
+_MARGIN = 2
+
+
+def load_trajectory(mouse_trajectory, mouse_movements):
+    """Return an attempt's mouse path, or None when it has none."""
+    if mouse_trajectory is not None:
+        trajectory = decode_trajectory(mouse_trajectory)
+    elif mouse_movements:
+        # Rows not yet moved to the packed format by the migration
+        trajectory = from_movements(mouse_movements)
+    else:
+        return None
+    return trajectory if len(trajectory.x) else None
+
+
+def segment_speeds(trajectory):
+    """Return the speed of each segment of the path as a step from 0 (slow) to SPEED_STEPS - 1 (fast)."""
+    distance = np.hypot(np.diff(trajectory.x), np.diff(trajectory.y))
+    # Points recorded in the same millisecond count as one apart
+    elapsed = np.maximum(np.diff(trajectory.t), 1)
+    fraction = np.minimum(distance / elapsed / FAST_SPEED, 1.0)
+    return np.rint(fraction * (SPEED_STEPS - 1)).astype(np.int64)
+
+
+def speed_colors():
+    """Return the RGB color of every speed step as a uint8 array."""
+    fraction = np.linspace(0.0, 1.0, SPEED_STEPS)[:, None]
+    colors = np.array(SLOW_COLOR) + (np.array(FAST_COLOR) - np.array(SLOW_COLOR)) * fraction
+    return np.rint(colors).astype(np.uint8)
+
+
+def palette(success):
+    """Return the RGB colors of the indices drawn by rasterize() as a uint8 array."""
+    return np.vstack([
+        np.array([SOLVED_COLOR if success else FAILED_COLOR, POINT_COLOR], dtype=np.uint8),
+        speed_colors(),
+    ])
+
+
+def _plot(canvas, x, y, values, stamp):
+    """Stamp every (x, y) point with its value on a canvas with a margin, in one indexed write."""
+    dx, dy = stamp
+    reach = _MARGIN - int(np.abs(dx).max())
+    inside = (x >= -reach) & (x < THUMBNAIL_SIZE + reach) & (y >= -reach) & (y < THUMBNAIL_SIZE + reach)
+    width = canvas.shape[1]
+    centers = (y[inside] + _MARGIN) * width + x[inside] + _MARGIN
+    canvas.ravel()[(centers[:, None] + dy * width + dx).ravel()] = np.repeat(values[inside], len(dx))
+
+
+def rasterize(trajectory, style='points'):
+    """Draw a mouse path as a THUMBNAIL_SIZE square uint8 array of indices into palette()."""
+    canvas = np.zeros((THUMBNAIL_SIZE + 2 * _MARGIN,) * 2, dtype=np.uint8)
+    x, y = trajectory.x, trajectory.y
+
+    if style == 'points' or len(x) < 2:
+        # Like the dots drawn before, only points recorded on the puzzle are drawn
+        on_puzzle = (x >= 0) & (x < THUMBNAIL_SIZE) & (y >= 0) & (y < THUMBNAIL_SIZE)
+        _plot(canvas, x[on_puzzle], y[on_puzzle], np.ones(np.count_nonzero(on_puzzle), dtype=np.uint8), _DOT)
+    else:
+        # Sample every segment once per pixel along its longer axis; far jumps are sampled more sparsely
+        dx, dy = np.diff(x), np.diff(y)
+        steps = np.clip(np.maximum(np.abs(dx), np.abs(dy)), 1, 2 * THUMBNAIL_SIZE)
+        segment = np.repeat(np.arange(len(dx)), steps + 1)
+        starts = np.cumsum(steps + 1) - (steps + 1)
+        fraction = (np.arange(len(segment)) - starts[segment]) / steps[segment]
+        px = np.rint(x[:-1][segment] + dx[segment] * fraction).astype(np.int64)
+        py = np.rint(y[:-1][segment] + dy[segment] * fraction).astype(np.int64)
+        colors = (segment_speeds(trajectory) + 2).astype(np.uint8)
+        _plot(canvas, px, py, colors[segment], _PEN)
+
+    return canvas[_MARGIN:-_MARGIN, _MARGIN:-_MARGIN]
+
+
+def render_thumbnail(mouse_trajectory, mouse_movements, success, style='points'):
+    """Draw an attempt's mouse path as a PNG, or return None when the attempt has no mouse path."""
+    trajectory = load_trajectory(mouse_trajectory, mouse_movements)
+    if trajectory is None:
+        return None
+    # A palette image encodes several times faster than RGB, and smaller
+    image = Image.fromarray(np.ascontiguousarray(rasterize(trajectory, style)), mode='P')
+    image.putpalette(palette(success).tobytes())
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _hex(color):
+    return '#%02x%02x%02x' % tuple(int(channel) for channel in color)
+
+
+def svg_thumbnail(mouse_trajectory, mouse_movements, success, style='points'):
+    """Describe an attempt's mouse path as an SVG for the browser to draw, or None without a path."""
+    trajectory = load_trajectory(mouse_trajectory, mouse_movements)
+    if trajectory is None:
+        return None
+    x, y = trajectory.x, trajectory.y
+    shapes = []
+    if style == 'points' or len(x) < 2:
+        on_puzzle = (x >= 0) & (x < THUMBNAIL_SIZE) & (y >= 0) & (y < THUMBNAIL_SIZE)
+        # A zero-length segment with a round cap is a dot, so one path draws every point
+        dots = ''.join(f'M{px} {py}h0' for px, py in zip(x[on_puzzle].tolist(), y[on_puzzle].tolist()))
+        if dots:
+            shapes.append(f'<path d="{dots}" stroke="{_hex(POINT_COLOR)}" stroke-width="5" stroke-linecap="round"/>')
+    else:
+        # One path per speed step, each made of the segments of that speed
+        speeds = segment_speeds(trajectory)
+        colors = speed_colors()
+        x0, y0, x1, y1 = x[:-1].tolist(), y[:-1].tolist(), x[1:].tolist(), y[1:].tolist()
+        for step in np.unique(speeds).tolist():
+            d = ''.join(f'M{x0[i]} {y0[i]}L{x1[i]} {y1[i]}' for i in np.flatnonzero(speeds == step).tolist())
+            shapes.append(f'<path d="{d}" stroke="{_hex(colors[step])}" stroke-width="3" stroke-linecap="round" fill="none"/>')
+
+    size = THUMBNAIL_SIZE
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}">'
+        f'<rect width="{size}" height="{size}" fill="{_hex(SOLVED_COLOR if success else FAILED_COLOR)}"/>'
+        f'{"".join(shapes)}</svg>'
+    )
+
+
+def _render_rows(rows, style):
+    """Render (mouse_trajectory, mouse_movements, success) rows in a worker process."""
+    return [render_thumbnail(*row, style=style) for row in rows]
+
+
+class ThumbnailCache:
+    """In-process cache of at most `max_entries` rendered thumbnails, keyed by attempt id.
+
+    Each entry is stamped with the attempt's completed_at, since checking a CAPTCHA again
+    rewrites its attempt, and a stamp that no longer matches counts as a miss.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._thumbnails = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._thumbnails)
+
+    def get(self, attempt_id, completed_at):
+        """Return (True, PNG or None if the attempt has no path), or (False, None) on a miss."""
+        with self._lock:
+            entry = self._thumbnails.get(attempt_id)
+            if entry is None or entry[0] != completed_at:
+                return False, None
+            self._thumbnails.move_to_end(attempt_id)
+            return True, entry[1]
+
+    def put(self, attempt_id, completed_at, thumbnail):
+        with self._lock:
+            self._thumbnails[attempt_id] = (completed_at, thumbnail)
+            self._thumbnails.move_to_end(attempt_id)
+            while len(self._thumbnails) > self.max_entries:
+                self._thumbnails.popitem(last=False)
+
+
+class ThumbnailRenderer:
+    """Render mouse path thumbnails on a persistent pool of worker processes, caching every one.
+
+    With `processes=0` thumbnails are rendered in the calling thread instead. `style` is
+    one of THUMBNAIL_STYLES.
+    """
+
+    def __init__(self, cache, processes=0, chunk_size=8, style='points'):
+        if style not in THUMBNAIL_STYLES:
+            raise ValueError(f'Unknown thumbnail style {style!r}, expected one of {THUMBNAIL_STYLES}')
+        self.cache = cache
+        self.style = style
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes (again, if this process was forked).
+
+        Every process is started right away and imports the renderer, rather than on the first render.
+        """
+        with self._lock:
+            if not self.processes or (self._executor is not None and self._pid == os.getpid()):
+                return
+            self._pid = os.getpid()
+            self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=get_context('spawn'))
+            for _ in range(self.processes):
+                self._executor.submit(_render_rows, [], self.style)
+
+    def stop(self):
+        """Shut the worker processes down."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(cancel_futures=True)
+
+    def missing(self, keys):
+        """Return the (attempt id, completed_at) pairs in `keys` that are not cached."""
+        return [key for key in keys if not self.cache.get(*key)[0]]
+
+    def render(self, rows):
+        """Render and cache thumbnails for (id, completed_at, mouse_trajectory, mouse_movements, success) rows."""
+        data = [row[2:] for row in rows]
+        if not self.processes:
+            thumbnails = _render_rows(data, self.style)
+        else:
+            self.start()
+            chunks = [data[start:start + self.chunk_size] for start in range(0, len(data), self.chunk_size)]
+            chunks = self._executor.map(_render_rows, chunks, [self.style] * len(chunks))
+            thumbnails = [thumbnail for chunk in chunks for thumbnail in chunk]
+        for row, thumbnail in zip(rows, thumbnails):
+            self.cache.put(row[0], row[1], thumbnail)
+        return thumbnails
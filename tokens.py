@@ -0,0 +1,176 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from models import db, CAPTCHA_UsedToken
+
+
+class TokenError(Exception):
+    """A CAPTCHA token failed verification; str() is the message returned to the caller."""
+
+    message = 'Invalid token!'
+
+    def __init__(self):
+        super().__init__(self.message)
+
+
+class InvalidToken(TokenError):
+    message = 'Invalid token!'
+
+
+class ExpiredToken(TokenError):
+    message = 'Token has expired!'
+
+
+class IdentityMismatch(TokenError):
+    message = 'Identity mismatch!'
+
+
+class TokenAlreadyUsed(TokenError):
+    message = 'Token already used!'
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+# Every token is an HS256 JWT with this exact header, so verifying never has to parse one
+_HEADER = _b64encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode())
+
+
+class TokenVerifier:
+    """Issues and verifies the single-use JWTs handed out for solved CAPTCHAs."""
+
+    def __init__(self, secret_key, lifetime, used_tokens):
+        key = secret_key.encode() if isinstance(secret_key, str) else secret_key
+        # HMAC state with the key already absorbed, copied for every signature
+        self._mac = hmac.new(key, digestmod=hashlib.sha256)
+        self.lifetime = lifetime
+        self.used_tokens = used_tokens
+
+    def issue(self, captcha_id, session_id, user_ip, user_agent):
+        """Return a token bound to the client that solved the CAPTCHA."""
+        now = int(time.time())
+        claims = {
+            'captcha_id': captcha_id,
+            'session_id': session_id,
+            'user_ip': user_ip,
+            'user_agent': user_agent,
+            'iat': now,
+            'exp': now + int(self.lifetime),
+            'jti': uuid.uuid4().hex,
+        }
+        signing_input = _HEADER + b'.' + _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+        return (signing_input + b'.' + _b64encode(self._sign(signing_input))).decode('ascii')
+
+    def decode(self, token):
+        """Check a token's signature and expiry and return its claims."""
+        if not isinstance(token, str):
+            raise InvalidToken()
+        try:
+            signing_input, _, signature = token.encode('ascii').rpartition(b'.')
+            header, _, payload = signing_input.partition(b'.')
+            if header != _HEADER or not hmac.compare_digest(self._sign(signing_input), _b64decode(signature)):
+                raise InvalidToken()
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise InvalidToken()
+        if not isinstance(claims, dict) or not isinstance(claims.get('exp'), int) or not claims.get('jti'):
+            raise InvalidToken()
+        if claims['exp'] <= time.time():
+            raise ExpiredToken()
+        return claims
+
+    def verify(self, token, user_ip, user_agent):
+        """Check a token for the client it was issued to, mark it used and return its claims."""
+        claims = self.decode(token)
+        if claims.get('user_ip') != user_ip or claims.get('user_agent') != user_agent:
+            raise IdentityMismatch()
+        if not self.used_tokens.add(claims['jti'], claims['exp']):
+            raise TokenAlreadyUsed()
+        return claims
+
+    def _sign(self, signing_input):
+        mac = self._mac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+
+class UsedTokenStore:
+    """Remembers the ids of used tokens until the tokens expire."""
+
+    def add(self, token_id, expires_at):
+        """Mark a token as used and return False if it already was."""
+        raise NotImplementedError
+
+    def purge(self):
+        """Forget every expired token and return how many were removed."""
+        raise NotImplementedError
+
+
+class MemoryUsedTokenStore(UsedTokenStore):
+    """In-process used-token cache holding at most `max_entries` ids."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def add(self, token_id, expires_at):
+        with self._lock:
+            self._purge(time.time())
+            if token_id in self._tokens:
+                return False
+            self._tokens[token_id] = expires_at
+            # Past the bound the oldest ids go first, size it above the tokens verified per lifetime
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+                self.evicted += 1
+            return True
+
+    def purge(self):
+        with self._lock:
+            return self._purge(time.time())
+
+    def _purge(self, now):
+        # Tokens are verified soon after being issued, so the oldest entries expire first
+        removed = 0
+        while self._tokens:
+            token_id, expires_at = next(iter(self._tokens.items()))
+            if expires_at > now:
+                break
+            del self._tokens[token_id]
+            removed += 1
+        return removed
+
+
+class DatabaseUsedTokenStore(UsedTokenStore):
+    """Used-token store in the database, shared by every worker and node. Needs an app context."""
+
+    def add(self, token_id, expires_at):
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(CAPTCHA_UsedToken.__table__.insert().values(jti=token_id, expires_at=expires_at))
+        except IntegrityError:
+            return False
+        return True
+
+    def purge(self):
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                CAPTCHA_UsedToken.__table__.delete().where(CAPTCHA_UsedToken.expires_at <= int(time.time()))
+            )
+        return result.rowcount
@@ -0,0 +1,153 @@
+import base64
+import binascii
+import struct
+import zlib
+from collections import namedtuple
+import numpy as np
+
+# Mouse path of an attempt as three int64 arrays: x, y and time in milliseconds
+Trajectory = namedtuple('Trajectory', ['x', 'y', 't'])
+
+FORMAT_VERSION = 1
+FLAG_ZLIB = 0x01
+
+# version, flags, point count
+_HEADER = struct.Struct('<BBI')
+# delta width in bytes, first value
+_STREAM = struct.Struct('<Bq')
+_DELTA_TYPES = {2: '<i2', 4: '<i4', 8: '<i8'}
+
+
+def from_movements(movements):
+    """Convert the client's list of {x, y, time} dicts into a Trajectory."""
+    if not movements:
+        return Trajectory(*(np.zeros(0, dtype=np.int64) for _ in range(3)))
+    points = np.array([(point['x'], point['y'], point['time']) for point in movements], dtype=np.float64)
+    points = np.rint(points).astype(np.int64)
+    return Trajectory(points[:, 0], points[:, 1], points[:, 2])
+
+
+def _pack_stream(values):
+    """Store the first value followed by the deltas in the narrowest integer type that fits them."""
+    first = int(values[0]) if len(values) else 0
+    deltas = np.diff(values)
+    for width, dtype in _DELTA_TYPES.items():
+        info = np.iinfo(dtype)
+        if not len(deltas) or (deltas.min() >= info.min and deltas.max() <= info.max):
+            return _STREAM.pack(width, first) + deltas.astype(dtype).tobytes()
+
+
+def encode(trajectory, compress=True):
+    """Pack a Trajectory into delta-encoded bytes, zlib-compressed when that makes them smaller."""
+    x, y, t = (np.asarray(values, dtype=np.int64) for values in trajectory)
+    if not len(x) == len(y) == len(t):
+        raise ValueError('x, y and t must have the same length')
+
+    payload = b''.join(_pack_stream(values) for values in (x, y, t))
+    flags = 0
+    if compress:
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            payload, flags = compressed, FLAG_ZLIB
+    return _HEADER.pack(FORMAT_VERSION, flags, len(x)) + payload
+
+
+def encode_movements(movements, compress=True):
+    """Pack the client's list of {x, y, time} dicts."""
+    return encode(from_movements(movements), compress)
+
+
+def parse_movements(movements, max_points):
+    """Convert client movements into a Trajectory, or None if missing, malformed or over max_points."""
+    if not movements or not isinstance(movements, list) or len(movements) > max_points:
+        return None
+    try:
+        return from_movements(movements)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_packed_path(path, max_points):
+    """Convert the client's base64 little-endian int16 [x, y, ms since previous point] triples into a Trajectory."""
+    # Every point takes 6 bytes, or 8 base64 characters
+    if not path or not isinstance(path, str) or len(path) > max_points * 8:
+        return None
+    try:
+        data = base64.b64decode(path, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if len(data) % 6:
+        return None
+    points = np.frombuffer(data, dtype='<i2').reshape(-1, 3).astype(np.int64)
+    return Trajectory(points[:, 0], points[:, 1], np.cumsum(points[:, 2]))
+
+
+def simplify(trajectory, epsilon=1.0, max_points=256):
+    """Downsample a trajectory with Ramer-Douglas-Peucker, keeping the timestamps of the kept points."""
+    count = len(trajectory.x)
+    if count <= 2:
+        return trajectory
+    points = np.column_stack((trajectory.x, trajectory.y)).astype(np.float64)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    # Split segments iteratively at the point furthest from their chord while it is above epsilon
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        chord = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(chord[0], chord[1])
+        if length:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > epsilon:
+            split = start + 1 + furthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    indices = np.flatnonzero(keep)
+    if len(indices) > max_points:
+        # Still too detailed, thin the kept points evenly but always keep both ends
+        indices = indices[np.linspace(0, len(indices) - 1, max_points).round().astype(np.int64)]
+    return Trajectory(trajectory.x[indices], trajectory.y[indices], trajectory.t[indices])
+
+
+def pack_movements(movements):
+    """Pack the client's mouse movements, or return None if they are missing or malformed."""
+    if not movements:
+        return None
+    try:
+        return encode_movements(movements)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def decode(data):
+    """Unpack bytes from encode() into a Trajectory of int64 arrays."""
+    version, flags, count = _HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f'Unsupported trajectory format version {version}')
+    payload = memoryview(data)[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        payload = memoryview(zlib.decompress(payload))
+
+    streams = []
+    offset = 0
+    for _ in range(3):
+        width, first = _STREAM.unpack_from(payload, offset)
+        offset += _STREAM.size
+        deltas = np.frombuffer(payload, dtype=_DELTA_TYPES[width], count=max(count - 1, 0), offset=offset)
+        offset += deltas.nbytes
+        values = np.empty(count, dtype=np.int64)
+        if count:
+            values[0] = first
+            np.cumsum(deltas, dtype=np.int64, out=values[1:])
+            values[1:] += first
+        streams.append(values)
+    return Trajectory(*streams)